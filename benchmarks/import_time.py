@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Guards the startup time of build_ogc_app.
+#
+# Runs the help output of build_ogc_app and each of its subcommands under
+# 'python -X importtime' and checks that the total import time stays within a budget
+# and that none of the heavy dependencies are imported just to parse arguments.
+#
+# The parameters subcommand is also run against the state directory of a fixture
+# repository, with the notebook parameters already cached by an earlier run. Notebook
+# introspection uses app_pack_generator, which imports papermill and through it boto3 and
+# the docker SDK, so the heavy dependency check only applies to argument parsing. The
+# import time of that run is held to its own budget instead.
+#
+# Exits with a non zero status when a budget is exceeded.
+
+import os
+import re
+import sys
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# Default budget in milliseconds for imports done while starting up
+DEFAULT_BUDGET_MS = 250
+
+# Default budget in milliseconds for imports done by a parameters run with cached notebook parameters
+DEFAULT_RUN_BUDGET_MS = 1500
+
+# Packages that must only be imported by the stages that use them
+HEAVY_MODULES = [ "app_pack_generator", "unity_sds_client", "boto3", "botocore", "docker", "papermill", "repo2docker" ]
+
+SUBCOMMANDS = [ None, "init", "build_docker", "push_docker", "push_ecr", "parameters", "build_cwl", "validate_cwl", "push_app_registry", "all", "resume",
+                "batch", "serve", "build_worker" ]
+
+IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+def measure_imports(command_args):
+    "Return total import time in microseconds and the names of the imported modules of a build_ogc_app run"
+
+    cmd = [ sys.executable, "-X", "importtime", "-m", "unity_app_generator" ] + command_args
+
+    result = subprocess.run(cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    total_us = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if (match := IMPORT_TIME_RE.match(line)) is None:
+            continue
+
+        self_us, cumulative_us, indent, module_name = match.groups()
+        modules.append(module_name)
+
+        # Only top level imports, nested ones are already part of the cumulative time
+        if len(indent) == 1:
+            total_us += int(cumulative_us)
+
+    return total_us, modules
+
+def heavy_modules(modules):
+
+    return sorted(set([ m.split(".")[0] for m in modules if m.split(".")[0] in HEAVY_MODULES ]))
+
+def fixture_state_directory(work_dir):
+    "Initialize the state directory of a fixture repository and cache its notebook parameters"
+    from tests.fakes import create_fixture_repository
+
+    source_repository = create_fixture_repository(os.path.join(work_dir, "source"))
+    state_dir = os.path.join(work_dir, "app", ".unity_app_gen")
+
+    for command_args in [ [ "init", source_repository, os.path.join(work_dir, "app") ], [ "parameters" ] ]:
+        subprocess.run([ sys.executable, "-m", "unity_app_generator", "--state_directory", state_dir ] + command_args,
+                       cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    return state_dir
+
+def main():
+    parser = ArgumentParser(description="Check the import time budget of build_ogc_app subcommands")
+
+    parser.add_argument("--budget_ms", type=float, default=DEFAULT_BUDGET_MS,
+        help=f"Maximum import time in milliseconds for the help output of each subcommand, default: {DEFAULT_BUDGET_MS}")
+
+    parser.add_argument("--run_budget_ms", type=float, default=DEFAULT_RUN_BUDGET_MS,
+        help=f"Maximum import time in milliseconds for a parameters run with cached notebook parameters, default: {DEFAULT_RUN_BUDGET_MS}")
+
+    args = parser.parse_args()
+
+    failures = []
+    for subcommand in SUBCOMMANDS:
+        total_us, modules = measure_imports(([ subcommand ] if subcommand is not None else []) + [ "--help" ])
+
+        heavy_imported = heavy_modules(modules)
+
+        name = subcommand if subcommand is not None else "(no subcommand)"
+        status = "ok"
+
+        if total_us / 1000 > args.budget_ms:
+            status = "OVER BUDGET"
+            failures.append(name)
+        elif len(heavy_imported) > 0:
+            status = "IMPORTS " + ", ".join(heavy_imported)
+            failures.append(name)
+
+        print(f"{name:<20} {total_us / 1000:10.1f} ms  {status}")
+
+    with tempfile.TemporaryDirectory(prefix="import_time_") as work_dir:
+        state_dir = fixture_state_directory(work_dir)
+
+        total_us, modules = measure_imports([ "--state_directory", state_dir, "parameters" ])
+
+    name = "parameters run"
+    status = "ok, imports " + ", ".join(heavy_modules(modules))
+
+    if total_us / 1000 > args.run_budget_ms:
+        status = "OVER BUDGET"
+        failures.append(name)
+
+    print(f"{name:<20} {total_us / 1000:10.1f} ms  {status}")
+
+    if len(failures) > 0:
+        print(f"Startup budget exceeded by: {', '.join(failures)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+#
+# Measures the latency and memory allocation of each build_ogc_app stage.
+#
+# Runs init, build_docker, push_ecr, build_cwl, validate_cwl and push_app_registry through the interface
+# module against local stand-ins: a git fixture repository with a synthetic notebook,
+# FakeDockerUtil in place of repo2docker and the Docker daemon, an ECR mocked with moto
+# and a stub Dockstore HTTP server. See tests/fakes.py for what each stand-in simulates.
+#
+# The first pass starts from empty state and caches, later passes show the effect of the
+# caches kept by each stage. With --apps the same stages also run for a batch of
+# applications through the batch interface. With --build_workers the builds and pushes
+# are sent through a build queue directory to that many build workers running in
+# threads of the benchmark process. The workers share the fake Docker daemon, so this
+# measures the overhead of the queue rather than the benefit of a warm layer cache.
+#
+# Allocation is the peak and net size of Python memory allocated while a stage runs as
+# traced by tracemalloc, it includes the threads of the stand-in servers but not child
+# processes. Tracing slows down the stages, use --no_allocations for latency alone.
+#
+# Dependencies imported by the stages are loaded before measuring so that the cold pass
+# does not include import time, benchmarks/import_time.py covers that.
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import importlib
+import tracemalloc
+from argparse import ArgumentParser
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from unity_app_generator import interface
+from unity_app_generator.generator import UnityApplicationGenerator
+from unity_app_generator.ecr_helper import ECRHelper
+from unity_app_generator.server import WARM_IMPORTS
+from unity_app_generator.build_queue import BuildWorker
+
+from tests.fakes import FakeDockerUtil, FakeDockerClient, StubDockstoreServer, create_fixture_repository
+
+AWS_REGION = "us-west-2"
+
+STAGES = [ "init", "build_docker", "push_ecr", "build_cwl", "validate_cwl", "push_app_registry" ]
+
+def ecr_push_hook(image_url, digest):
+    "Record images pushed to ECR registries in the moto backend so ECR reports their digests"
+
+    registry, _, repository = image_url.partition("/")
+
+    if ".dkr.ecr." not in registry:
+        return digest
+
+    repository_name, _, image_tag = repository.rpartition(":")
+
+    ecr_client = boto3.client("ecr", region_name=AWS_REGION)
+
+    image_manifest = json.dumps({
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+        "config": { "mediaType": "application/vnd.docker.container.image.v1+json", "size": 1024, "digest": digest },
+        "layers": [],
+    })
+
+    try:
+        response = ecr_client.put_image(repositoryName=repository_name, imageManifest=image_manifest, imageTag=image_tag)
+    except ClientError as err:
+        if err.response["Error"]["Code"] != "ImageAlreadyExistsException":
+            raise
+
+        response = ecr_client.describe_images(repositoryName=repository_name, imageIds=[{ "imageTag": image_tag }])
+        return response["imageDetails"][0]["imageDigest"]
+
+    return response["image"]["imageId"]["imageDigest"]
+
+class StageMeasurements(object):
+    "Wall time and tracemalloc allocation of named stages"
+
+    def __init__(self, trace_allocations=True):
+
+        self.trace_allocations = trace_allocations
+        self.results = []
+
+    def measure(self, pass_name, stage_name, stage_func, *args, **kwargs):
+
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+
+        start_time = time.perf_counter()
+        try:
+            return stage_func(*args, **kwargs)
+        finally:
+            result = {
+                "pass": pass_name,
+                "stage": stage_name,
+                "seconds": time.perf_counter() - start_time,
+            }
+
+            if self.trace_allocations:
+                current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                result["peak_bytes"] = peak_bytes - start_bytes
+                result["net_bytes"] = current_bytes - start_bytes
+
+            self.results.append(result)
+
+    def print_table(self):
+
+        alloc_header = f" {'peak MB':>10} {'net MB':>10}" if self.trace_allocations else ""
+        print(f"{'pass':<8} {'stage':<24} {'seconds':>10}{alloc_header}")
+
+        for result in self.results:
+            alloc_str = ""
+            if "peak_bytes" in result:
+                alloc_str = f" {result['peak_bytes'] / 1e6:10.2f} {result['net_bytes'] / 1e6:10.2f}"
+
+            print(f"{result['pass']:<8} {result['stage']:<24} {result['seconds']:10.3f}{alloc_str}")
+
+def fixture_source(repo_dir, build_queue):
+    "Source repository argument for a fixture repository, build workers only clone Git URLs"
+
+    return f"file://{repo_dir}" if build_queue is not None else repo_dir
+
+def run_stages(measurements, pass_name, source_repository, app_dir, dockstore_api_url, force=False, slim=False, build_queue=None):
+    "Run each stage for one application through the interface functions"
+
+    state_dir = os.path.join(app_dir, interface.DEFAULT_STATE_DIRECTORY)
+
+    measurements.measure(pass_name, "init", interface.init, None, source_repository, destination_directory=app_dir)
+    measurements.measure(pass_name, "build_docker", interface.build_docker, state_dir, force=force, slim=slim, build_queue=build_queue)
+    measurements.measure(pass_name, "push_ecr", interface.push_ecr, state_dir, force=force)
+    measurements.measure(pass_name, "build_cwl", interface.build_cwl, state_dir, force=force)
+    measurements.measure(pass_name, "validate_cwl", interface.validate_cwl, state_dir, force=force)
+    measurements.measure(pass_name, "push_app_registry", interface.push_app_registry, state_dir, dockstore_api_url, "benchmark-token", force=force)
+
+def run_batch(measurements, pass_name, source_repositories, work_dir, dockstore_api_url, max_workers, max_builds, max_transfers, slim=False,
+              build_queue=None):
+    "Run the pipeline for a batch of applications, recording the batch and the mean time of each stage"
+
+    manifest = {
+        "defaults": {
+            "use_ecr": True,
+            "slim": slim,
+            "build_queue": build_queue,
+            "dockstore_api_url": dockstore_api_url,
+            "dockstore_token": "benchmark-token",
+        },
+        "applications": [ { "source_repository": source_repository, "destination_directory": os.path.join(work_dir, os.path.basename(source_repository)) }
+                          for source_repository in source_repositories ],
+    }
+
+    results = measurements.measure(pass_name, f"batch of {len(source_repositories)}", interface.batch, manifest,
+                                   max_workers=max_workers, max_builds=max_builds, max_transfers=max_transfers)
+
+    failures = [ r for r in results if not r["success"] ]
+    if len(failures) > 0:
+        raise RuntimeError(f"{len(failures)} batch applications failed, first error: {failures[0]['error']}")
+
+    for stage_name in STAGES:
+        stage_seconds = [ seconds for r in results for name, seconds in r["stage_times"] if name == stage_name ]
+
+        measurements.results.append({
+            "pass": pass_name,
+            "stage": f"  mean {stage_name}",
+            "seconds": sum(stage_seconds) / len(stage_seconds),
+        })
+
+def main():
+    parser = ArgumentParser(description="Benchmark build_ogc_app stages against local stand-ins for Docker, ECR and Dockstore")
+
+    parser.add_argument("--parameters", type=int, default=10,
+        help="Number of parameters in the synthetic notebook besides stage-in and stage-out, default: 10")
+
+    parser.add_argument("--output_mb", type=float, default=1,
+        help="Size in MB of the cell outputs saved in the synthetic notebook, default: 1")
+
+    parser.add_argument("--notebooks", type=int, default=1,
+        help="Number of synthetic notebooks in each repository, each is generated and registered as its own application, default: 1")
+
+    parser.add_argument("--passes", type=int, default=2,
+        help="Number of times to run the stages, the first pass starts without state or caches, default: 2")
+
+    parser.add_argument("--force", action="store_true", default=False,
+        help="Run every stage with force so later passes repeat the work instead of using caches")
+
+    parser.add_argument("--slim", action="store_true", default=False,
+        help="Remove build only content from the built image, which adds saving and loading the image to build_docker")
+
+    parser.add_argument("--apps", type=int, default=0,
+        help="Also run the stages for a batch of this many applications, default: 0")
+
+    parser.add_argument("--build_workers", type=int, default=0,
+        help="Send builds and pushes through a build queue to this many build workers, default: 0 for local builds")
+
+    parser.add_argument("--max_workers", type=int, default=4,
+        help="Concurrent applications in the batch, default: 4")
+
+    parser.add_argument("--max_builds", type=int, default=1,
+        help="Concurrent Docker builds in the batch, default: 1")
+
+    parser.add_argument("--max_transfers", type=int, default=4,
+        help="Concurrent pushes in the batch, default: 4")
+
+    parser.add_argument("--step_seconds", type=float, default=FakeDockerUtil.step_seconds,
+        help=f"Seconds each uncached build step takes, default: {FakeDockerUtil.step_seconds}")
+
+    parser.add_argument("--push_mbps", type=float, default=1000,
+        help="Simulated registry upload bandwidth in MB/s, default: 1000")
+
+    parser.add_argument("--no_allocations", dest="trace_allocations", action="store_false", default=True,
+        help="Do not trace memory allocation")
+
+    parser.add_argument("--json", dest="json_output",
+        help="Also write the results as JSON to this file")
+
+    parser.add_argument("--keep", action="store_true", default=False,
+        help="Keep the working directory with the fixture repositories and application directories")
+
+    parser.add_argument("--verbose", "-v", action="store_true", default=False,
+        help="Show log output of the stages")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s: %(message)s")
+
+    work_dir = tempfile.mkdtemp(prefix="unity_app_gen_bench_")
+
+    # Keep caches shared between applications out of the user's home directory
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, "cache")
+
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "AWS_DEFAULT_REGION": AWS_REGION,
+    })
+
+    FakeDockerUtil.step_seconds = args.step_seconds
+    FakeDockerUtil.client = FakeDockerClient(push_bandwidth=args.push_mbps * 1e6, push_hook=ecr_push_hook)
+    UnityApplicationGenerator.docker_util_factory = FakeDockerUtil
+
+    dockstore = StubDockstoreServer().start()
+
+    output_bytes = int(args.output_mb * 1e6)
+
+    measurements = StageMeasurements(trace_allocations=args.trace_allocations)
+
+    build_queue = os.path.join(work_dir, "build_queue") if args.build_workers > 0 else None
+
+    stop_workers = threading.Event()
+    worker_threads = [ threading.Thread(target=BuildWorker(build_queue, work_directory=os.path.join(work_dir, f"build_worker_{index}"),
+                                                           worker_id=f"worker_{index}").run,
+                                        args=(stop_workers,), daemon=True)
+                       for index in range(args.build_workers) ]
+
+    for worker_thread in worker_threads:
+        worker_thread.start()
+
+    try:
+        with mock_aws():
+            # Clients created before moto was started would talk to AWS
+            ECRHelper._shared_client = ECRHelper._shared_session = None
+            ECRHelper._auth_data = {}
+
+            for module_name in WARM_IMPORTS:
+                importlib.import_module(module_name)
+
+            # moto loads its ECR backend on first use
+            boto3.client("ecr", region_name=AWS_REGION).describe_repositories()
+
+            if args.trace_allocations:
+                tracemalloc.start()
+
+            source_repository = fixture_source(create_fixture_repository(os.path.join(work_dir, "sources", "bench_app"), args.parameters, output_bytes, args.notebooks),
+                                               build_queue)
+
+            for pass_index in range(args.passes):
+                pass_name = "cold" if pass_index == 0 else f"warm {pass_index}"
+                run_stages(measurements, pass_name, source_repository, os.path.join(work_dir, "app"), dockstore.api_url,
+                           force=args.force, slim=args.slim, build_queue=build_queue)
+
+            if args.apps > 0:
+                source_repositories = [ fixture_source(create_fixture_repository(os.path.join(work_dir, "sources", f"batch_app_{index:03d}"), args.parameters, output_bytes, args.notebooks),
+                                                       build_queue)
+                                        for index in range(args.apps) ]
+
+                for pass_index in range(args.passes):
+                    pass_name = "cold" if pass_index == 0 else f"warm {pass_index}"
+                    run_batch(measurements, pass_name, source_repositories, os.path.join(work_dir, "batch"), dockstore.api_url,
+                              args.max_workers, args.max_builds, args.max_transfers, slim=args.slim, build_queue=build_queue)
+
+    finally:
+        stop_workers.set()
+        for worker_thread in worker_threads:
+            worker_thread.join()
+
+        dockstore.stop()
+
+        if args.keep:
+            print(f"Working directory: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{args.notebooks} notebook(s) with {args.parameters} parameters and {args.output_mb} MB of outputs")
+    measurements.print_table()
+
+    if args.json_output is not None:
+        with open(args.json_output, "w") as json_file:
+            json.dump({ "arguments": vars(args), "results": measurements.results }, json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -18,13 +18,9 @@ done
 # This will not display the token to the logs 
 echo $DOCKERHUB_TOKEN | docker login --username $DOCKERHUB_USERNAME --password-stdin
 
-build_ogc_app init $GITHUB_REPO build
-cd build
-build_ogc_app build_docker --image_namespace ""
-
-build_ogc_app push_docker $DOCKERHUB_USERNAME 
-build_ogc_app build_cwl
-build_ogc_app push_app_registry --api_url $DOCKSTORE_API_URL --token $DOCKSTORE_TOKEN 
+build_ogc_app all $GITHUB_REPO build --image_namespace "" \
+    --container_registry $DOCKERHUB_USERNAME \
+    --api_url $DOCKSTORE_API_URL --token $DOCKSTORE_TOKEN
 
 deactivate
 
@@ -0,0 +1,37 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def user_cache(tmp_path, monkeypatch):
+    "Keep user caches written by the code under test out of the home directory"
+
+    cache_home = tmp_path / "cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+
+    return cache_home
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    "Fresh in memory Docker client used by FakeDockerUtil, with builds that do not wait"
+    from tests.fakes import FakeDockerUtil, FakeDockerClient
+
+    client = FakeDockerClient(push_bandwidth=1e12)
+
+    monkeypatch.setattr(FakeDockerUtil, "client", client)
+    monkeypatch.setattr(FakeDockerUtil, "step_seconds", 0)
+
+    return client
+
+@pytest.fixture
+def source_repository(tmp_path):
+    from tests.fakes import create_fixture_repository
+
+    return create_fixture_repository(str(tmp_path / "source" / "app"))
+
+@pytest.fixture
+def dockstore():
+    "Stub Dockstore API served from a background thread"
+    from tests.fakes import StubDockstoreServer
+
+    server = StubDockstoreServer().start()
+    yield server
+    server.stop()
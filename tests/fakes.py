@@ -0,0 +1,553 @@
+#
+# Local stand-ins for the services build_ogc_app talks to, used by the tests and the benchmarks.
+#
+# FakeDockerUtil runs a small script that prints repo2docker style BuildKit output in
+# place of repo2docker, so the real output parsing and event code is exercised. Images,
+# pushes and registry contents are kept in memory by FakeDockerClient. StubDockstoreServer
+# serves the part of the Dockstore API used by push_app_registry. Fake images can be saved
+# and loaded as Docker image archives whose layers hold small files at the paths repo2docker
+# uses, including build only content such as the .git directory, so image slimming works on them.
+#
+# Git fixture repositories hold a synthetic process.ipynb whose number of parameters and
+# size of saved outputs can be scaled.
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import tarfile
+import threading
+import subprocess
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import docker.errors
+
+from unity_app_generator.docker_stream import StreamingDockerUtil
+
+# Script run in place of repo2docker, prints BuildKit plain progress output for each step
+FAKE_REPO2DOCKER_SCRIPT = """
+import sys, time
+num_steps, num_cached, step_seconds = int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])
+for step in range(1, num_steps + 1):
+    print(f"#{step + 1} [{step}/{num_steps}] RUN step {step}", flush=True)
+    if step <= num_cached:
+        print(f"#{step + 1} CACHED", flush=True)
+    else:
+        time.sleep(step_seconds)
+        print(f"#{step + 1} DONE {step_seconds:.1f}s", flush=True)
+"""
+
+# Parameters written into synthetic notebooks, cycling through these types
+PARAMETER_VALUES = [ "{index}", "{index}.5", "'value_{index}'", "True" ]
+
+def write_synthetic_notebook(notebook_filename, num_parameters=4, output_bytes=0):
+    """
+    Write a notebook with stage-in and stage-out parameters plus num_parameters more in its
+    parameters cell, followed by a cell with output_bytes of base64 image output
+    """
+
+    param_source = [
+        "input_stac_collection_file = 'catalog.json' # type: stage-in\n",
+        "output_stac_catalog_dir = '/tmp/outputs' # type: stage-out\n",
+    ]
+
+    for index in range(num_parameters):
+        value = PARAMETER_VALUES[index % len(PARAMETER_VALUES)].format(index=index)
+        param_source.append(f"param_{index} = {value}\n")
+
+    # Random bytes do not compress so the output keeps its size in git and Docker contexts
+    image_data = base64.b64encode(os.urandom(output_bytes * 3 // 4)).decode()
+
+    notebook = {
+        "cells": [
+            {
+                "id": "parameters",
+                "cell_type": "code",
+                "execution_count": None,
+                "metadata": { "tags": [ "parameters" ] },
+                "outputs": [],
+                "source": param_source,
+            },
+            {
+                "id": "outputs",
+                "cell_type": "code",
+                "execution_count": 1,
+                "metadata": {},
+                "outputs": [ { "output_type": "display_data", "data": { "image/png": image_data }, "metadata": {} } ],
+                "source": [ "plot(outputs)" ],
+            },
+        ],
+        "metadata": {
+            "kernelspec": { "display_name": "Python 3", "language": "python", "name": "python3" },
+            "language_info": { "name": "python" },
+        },
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+
+    with open(notebook_filename, "w") as notebook_file:
+        json.dump(notebook, notebook_file, indent=1)
+
+def create_fixture_repository(repo_dir, num_parameters=4, output_bytes=0, num_notebooks=1):
+    """
+    Create a git repository holding synthetic notebooks and an environment file. A single notebook
+    is named process.ipynb, multiple notebooks are placed under processes/ to be discovered.
+    """
+
+    os.makedirs(repo_dir)
+
+    if num_notebooks == 1:
+        write_synthetic_notebook(os.path.join(repo_dir, "process.ipynb"), num_parameters, output_bytes)
+    else:
+        os.makedirs(os.path.join(repo_dir, "processes"))
+
+        for index in range(num_notebooks):
+            write_synthetic_notebook(os.path.join(repo_dir, "processes", f"step_{index:02d}.ipynb"), num_parameters, output_bytes)
+
+    with open(os.path.join(repo_dir, "environment.yml"), "w") as env_file:
+        env_file.write("dependencies:\n  - python=3.11\n  - numpy\n")
+
+    git_env = { **os.environ,
+                "GIT_AUTHOR_NAME": "benchmark", "GIT_AUTHOR_EMAIL": "benchmark@localhost",
+                "GIT_COMMITTER_NAME": "benchmark", "GIT_COMMITTER_EMAIL": "benchmark@localhost" }
+
+    for git_args in [ ["init", "--quiet"], ["add", "."], ["commit", "--quiet", "-m", "Benchmark fixture"] ]:
+        subprocess.run(["git"] + git_args, cwd=repo_dir, env=git_env, check=True)
+
+    return repo_dir
+
+# Environment of the configuration of fake images, as set by repo2docker
+FAKE_IMAGE_ENV = [ "HOME=/home/jovyan", "REPO_DIR=/home/jovyan", "NB_PYTHON_PREFIX=/srv/conda/envs/notebook" ]
+
+def _layer_archive(layer_files):
+    "Uncompressed layer archive holding files given as (path, size) with contents derived from their paths"
+
+    archive = io.BytesIO()
+
+    with tarfile.open(fileobj=archive, mode="w", format=tarfile.PAX_FORMAT) as layer_tar:
+        for path, size in layer_files:
+            contents = (hashlib.sha256(path.encode()).digest() * (size // 32 + 1))[:size]
+
+            file_info = tarfile.TarInfo(path)
+            file_info.size = size
+            file_info.mtime = 0
+            layer_tar.addfile(file_info, io.BytesIO(contents))
+
+    return archive.getvalue()
+
+def fake_layer_files(layer_id, app_layer_index=None):
+    "Files of a fake layer, the application layers hold the repository along with build only content"
+
+    if app_layer_index is None:
+        return [ (f"srv/conda/envs/notebook/lib/{layer_id}.so", 64 * 1024) ]
+
+    if app_layer_index == 0:
+        return [ ("home/jovyan/process.ipynb", 16 * 1024),
+                 ("home/jovyan/.git/HEAD", 32),
+                 (f"home/jovyan/.git/objects/pack/pack-{layer_id}.pack", 512 * 1024),
+                 ("home/jovyan/.unity_app_gen/app_state.json", 1024) ]
+
+    return [ ("home/jovyan/environment.yml", 64),
+             (f"home/jovyan/.cache/pip/http/{layer_id}", 128 * 1024) ]
+
+class FakeImage(object):
+    """
+    Image with layers given as (layer id, size) pairs. Sizes are those simulated for pushes, the
+    saved layer archives are built from layer_archives or otherwise from fake_layer_files.
+    """
+
+    def __init__(self, client, image_id, size, layers, layer_archives=None, num_app_layers=0):
+
+        self.client = client
+        self.id = image_id
+        self.attrs = { "Size": size, "Config": { "Env": FAKE_IMAGE_ENV } }
+        self.layers = layers
+
+        if layer_archives is None:
+            num_env_layers = len(layers) - num_app_layers
+            layer_archives = [ _layer_archive(fake_layer_files(layer_id, index - num_env_layers if index >= num_env_layers else None))
+                               for index, (layer_id, _) in enumerate(layers) ]
+
+        self.layer_archives = layer_archives
+
+    def tag(self, repository, tag=None):
+
+        self.client.images.add(f"{repository}:{tag}" if tag is not None else repository, self)
+
+        return True
+
+    def history(self):
+
+        history = [ { "Id": "<missing>", "CreatedBy": "/bin/sh -c #(nop) ENV REPO_DIR=/home/jovyan", "Size": 0 } ]
+
+        for index, (layer_id, layer_size) in enumerate(self.layers):
+            history.append({ "Id": "<missing>", "CreatedBy": f"RUN step {index + 1} # {layer_id}", "Size": layer_size })
+
+        return list(reversed(history))
+
+    def save(self, chunk_size=2097152, named=False):
+        "Generate a Docker image archive in chunks"
+
+        diff_ids = [ "sha256:" + hashlib.sha256(archive).hexdigest() for archive in self.layer_archives ]
+
+        config = json.dumps({ "config": self.attrs["Config"], "rootfs": { "type": "layers", "diff_ids": diff_ids } }).encode()
+        config_name = hashlib.sha256(config).hexdigest() + ".json"
+
+        layer_names = [ f"{diff_id[7:]}/layer.tar" for diff_id in diff_ids ]
+        manifest = json.dumps([{ "Config": config_name, "RepoTags": None, "Layers": layer_names }]).encode()
+
+        members = [ (config_name, config), ("manifest.json", manifest) ] + list(zip(layer_names, self.layer_archives))
+
+        # Layers keep their simulated sizes and ids when loaded unchanged
+        self.client.images.known_layers.update({ diff_id: layer for diff_id, layer in zip(diff_ids, self.layers) })
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as image_tar:
+            for member_name, member_bytes in members:
+                member_info = tarfile.TarInfo(member_name)
+                member_info.size = len(member_bytes)
+                image_tar.addfile(member_info, io.BytesIO(member_bytes))
+
+        archive_bytes = archive.getvalue()
+        for offset in range(0, len(archive_bytes), chunk_size):
+            yield archive_bytes[offset:offset + chunk_size]
+
+class FakeImageCollection(object):
+    "Local images and the contents of the registries they are pushed to"
+
+    def __init__(self, client):
+
+        self.client = client
+        self._lock = threading.Lock()
+        self.local = {}
+
+        # Layer diff id -> (layer id, size) of layers of saved images
+        self.known_layers = {}
+
+        # Registry image URL -> digest and registry repository -> pushed layers
+        self.remote = {}
+        self.remote_layers = {}
+
+    def add(self, image_reference, image):
+
+        with self._lock:
+            self.local[image_reference] = image
+
+    def get(self, image_reference):
+
+        with self._lock:
+            if image_reference not in self.local:
+                raise docker.errors.NotFound(f"No such image: {image_reference}")
+
+            return self.local[image_reference]
+
+    def get_registry_data(self, image_url):
+
+        with self._lock:
+            if image_url not in self.remote:
+                raise docker.errors.NotFound(f"Manifest unknown: {image_url}")
+
+            return mock.Mock(id=self.remote[image_url])
+
+    def push(self, image_url, stream=True, decode=True):
+        "Generate push messages like the Docker Engine API, taking time according to the client bandwidth"
+
+        image = self.get(image_url)
+        repository = image_url.rsplit(":", 1)[0]
+
+        with self._lock:
+            pushed_layers = self.remote_layers.setdefault(repository, set())
+
+        for layer_id, layer_size in image.layers:
+            yield { "status": "Preparing", "progressDetail": {}, "id": layer_id }
+
+        for layer_id, layer_size in image.layers:
+            if layer_id in pushed_layers:
+                yield { "status": "Layer already exists", "progressDetail": {}, "id": layer_id }
+                continue
+
+            time.sleep(layer_size / self.client.push_bandwidth)
+
+            yield { "status": "Pushing", "progressDetail": { "current": layer_size, "total": layer_size }, "id": layer_id }
+            yield { "status": "Pushed", "progressDetail": {}, "id": layer_id }
+
+            pushed_layers.add(layer_id)
+
+        digest = "sha256:" + hashlib.sha256(f"{image_url}|{image.id}".encode()).hexdigest()
+
+        if self.client.push_hook is not None:
+            digest = self.client.push_hook(image_url, digest)
+
+        with self._lock:
+            self.remote[image_url] = digest
+
+        yield { "progressDetail": {}, "aux": { "Tag": image_url.rsplit(":", 1)[-1], "Digest": digest, "Size": 1024 } }
+
+    def load(self, data):
+        "Load a Docker image archive as written by ImageSlimmer"
+
+        with tarfile.open(fileobj=io.BytesIO(data.read()), mode="r:") as image_tar:
+            manifest = json.load(image_tar.extractfile("manifest.json"))[0]
+
+            config_bytes = image_tar.extractfile(manifest["Config"]).read()
+            config = json.loads(config_bytes)
+
+            layers = []
+            layer_archives = []
+            for diff_id, layer_name in zip(config["rootfs"]["diff_ids"], manifest["Layers"]):
+                layer_archive = image_tar.extractfile(layer_name).read()
+
+                if "sha256:" + hashlib.sha256(layer_archive).hexdigest() != diff_id:
+                    raise docker.errors.APIError(f"Layer {layer_name} does not match diff id {diff_id}")
+
+                layers.append(self.known_layers.get(diff_id, (diff_id[7:19], len(layer_archive))))
+                layer_archives.append(layer_archive)
+
+        image = FakeImage(self.client, "sha256:" + hashlib.sha256(config_bytes).hexdigest(),
+                          sum([ size for _, size in layers ]), layers, layer_archives)
+
+        for image_reference in manifest["RepoTags"]:
+            self.add(image_reference, image)
+
+        return [ image ]
+
+    def remove(self, image_id, force=False):
+
+        with self._lock:
+            self.local = { ref: image for ref, image in self.local.items() if image.id != image_id }
+
+    def prune(self):
+        return {}
+
+class FakeDockerClient(object):
+    """
+    In memory replacement for docker.DockerClient. push_hook is called with the image URL and
+    digest of each completed push and returns the digest reported to the client.
+    """
+
+    def __init__(self, push_bandwidth=1e9, push_hook=None):
+
+        self.push_bandwidth = push_bandwidth
+        self.push_hook = push_hook
+
+        self.images = FakeImageCollection(self)
+        self.containers = mock.Mock()
+
+    def login(self, username=None, password=None, registry=None, **kwargs):
+        return { "Status": "Login Succeeded" }
+
+    def close(self):
+        pass
+
+class FakeDockerUtil(StreamingDockerUtil):
+    """
+    StreamingDockerUtil that builds into a FakeDockerClient. Builds run a script printing
+    BuildKit output, uncached steps take step_seconds. Steps are cached when a cache source
+    image exists locally, except for the final steps that copy in the application.
+    """
+
+    client = FakeDockerClient()
+
+    build_steps = 10
+    app_steps = 2
+    step_seconds = 0.05
+
+    # Environment layers shared by every image built from the same environment files
+    layer_size = 50 * 1024 * 1024
+
+    _git_lock = threading.Lock()
+
+    def __init__(self, git_mgr, **kwargs):
+
+        super().__init__(git_mgr, docker_client=type(self).client, **kwargs)
+
+    def repo2docker_command(self, image_reference=None, extra_args=[]):
+
+        cache_sources = [ extra_args[i + 1] for i, arg in enumerate(extra_args[:-1]) if arg == "--cache-from" ]
+        has_cache = any([ self._image_exists(ref) for ref in cache_sources ])
+
+        num_cached = self.build_steps - self.app_steps if has_cache else 0
+
+        return [ sys.executable, "-c", FAKE_REPO2DOCKER_SCRIPT, str(self.build_steps), str(num_cached), str(self.step_seconds) ]
+
+    def _image_exists(self, image_reference):
+
+        try:
+            self.docker_client.images.get(image_reference)
+        except docker.errors.NotFound:
+            return False
+
+        return True
+
+    def _run_repo2docker(self, image_reference, extra_args=[], event_fields={}):
+
+        super()._run_repo2docker(image_reference, extra_args, event_fields)
+
+        # GitPython repositories are not safe to use from the threads of concurrent target builds
+        with self._git_lock:
+            commit_identifier = self.git_mgr.commit_identifier
+
+        source_id = hashlib.sha256(f"{commit_identifier}|{extra_args}".encode()).hexdigest()
+
+        env_layers = [ (f"env{i}", self.layer_size) for i in range(self.build_steps - self.app_steps) ]
+        app_layers = [ (f"{source_id[:8]}{i}", 1024 * 1024) for i in range(self.app_steps) ]
+
+        image = FakeImage(self.docker_client, "sha256:" + source_id, sum([ s for _, s in env_layers + app_layers ]), env_layers + app_layers,
+                          num_app_layers=self.app_steps)
+        self.docker_client.images.add(image_reference, image)
+
+        return image_reference
+
+    def convert_image(self, image_reference, converted_reference, lazy_format, priority_paths=[]):
+        "Convert by tagging, lazy pull formats only change how layers are compressed"
+
+        repository, _, tag = converted_reference.rpartition(":")
+        self.docker_client.images.get(image_reference).tag(repository, tag)
+
+        self._emit("convert_complete", image=converted_reference, source=image_reference, format=lazy_format)
+
+        return converted_reference
+
+    def create_manifest_list(self, manifest_dest, source_images):
+
+        images = self.docker_client.images
+
+        manifest_digest = "sha256:" + hashlib.sha256("|".join([ images.remote[s] for s in source_images ]).encode()).hexdigest()
+
+        images.remote[manifest_dest] = manifest_digest
+
+        self._emit("manifest_complete", destination=manifest_dest, digest=manifest_digest, sources=source_images)
+
+        return manifest_digest
+
+class _DockstoreHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, value, status=200):
+
+        body = json.dumps(value).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+
+        length = int(self.headers.get("Content-Length") or 0)
+
+        return json.loads(self.rfile.read(length)) if length > 0 else None
+
+    def _path_parts(self):
+
+        path = urlparse(self.path).path
+
+        # Strip the API prefix
+        return path[len(self.server.api_prefix):].strip("/").split("/")
+
+    def do_GET(self):
+
+        parts = self._path_parts()
+
+        with self.server.lock:
+            if parts == ["users", "user"]:
+                return self._send({ "id": 1 })
+
+            if parts == ["users", "1", "workflows"]:
+                return self._send([ { "id": app_id } for app_id in self.server.apps ])
+
+            if len(parts) == 2 and parts[0] == "workflows" and parts[1].isdigit() and int(parts[1]) in self.server.apps:
+                return self._send(self.server.workflow_json(int(parts[1])))
+
+        self._send({ "message": "Not found" }, status=404)
+
+    def do_POST(self):
+
+        parts = self._path_parts()
+        self._read_body()
+
+        with self.server.lock:
+            if parts == ["workflows", "hostedEntry"]:
+                app_id = len(self.server.apps) + 1
+                self.server.apps[app_id] = { "name": parse_qs(urlparse(self.path).query)["name"][0], "files": {}, "published": False }
+
+                return self._send(self.server.workflow_json(app_id))
+
+            if len(parts) == 3 and parts[0] == "workflows" and parts[2] == "publish" and int(parts[1]) in self.server.apps:
+                self.server.apps[int(parts[1])]["published"] = True
+
+                return self._send(self.server.workflow_json(int(parts[1])))
+
+        self._send({ "message": "Not found" }, status=404)
+
+    def do_PATCH(self):
+
+        parts = self._path_parts()
+        files = self._read_body()
+
+        with self.server.lock:
+            if len(parts) == 3 and parts[:2] == ["workflows", "hostedEntry"] and int(parts[2]) in self.server.apps:
+                app = self.server.apps[int(parts[2])]
+                app["files"].update({ f["path"]: f["content"] for f in files })
+                self.server.bytes_uploaded += sum([ len(f["content"]) for f in files ])
+
+                return self._send(self.server.workflow_json(int(parts[2])))
+
+        self._send({ "message": "Not found" }, status=404)
+
+class StubDockstoreServer(ThreadingHTTPServer):
+    "Serves the Dockstore API requests made when registering hosted workflows from a background thread"
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, api_prefix="/api"):
+
+        super().__init__((host, port), _DockstoreHandler)
+
+        self.api_prefix = api_prefix
+        self.lock = threading.Lock()
+        self.apps = {}
+        self.bytes_uploaded = 0
+
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}{self.api_prefix}"
+
+    def workflow_json(self, app_id):
+
+        app = self.apps[app_id]
+
+        return {
+            "id": app_id,
+            "full_workflow_path": f"dockstore.org/benchmark/{app['name']}",
+            "gitUrl": "",
+            "workflow_path": "/Dockstore.cwl",
+            "is_published": app["published"],
+            "description": "",
+            "mode": "HOSTED",
+            "descriptorType": "cwl",
+        }
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+
+        self.shutdown()
+        self.server_close()
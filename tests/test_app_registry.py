@@ -0,0 +1,93 @@
+import os
+from unittest import mock
+
+import pytest
+
+from unity_app_generator.app_catalog import PooledDockstoreAppCatalog
+from unity_app_generator.cache import user_cache_directory
+
+from tests.test_fingerprint import create_generator
+
+TOKEN = "dockstore-secret-token"
+
+@pytest.fixture
+def generator(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository, [])
+    generator.create_docker_image()
+    generator.create_cwl()
+
+    return generator
+
+def push(tmp_path, source_repository, dockstore, force=False):
+    "Push from a new generator, returning the file names uploaded by each call to upload_contents"
+
+    uploads = []
+    original_upload = PooledDockstoreAppCatalog.upload_contents
+
+    def record_upload(app_catalog, application, cwl_contents={}, json_contents={}):
+        uploads.append(sorted(list(cwl_contents.keys()) + list(json_contents.keys())))
+        return original_upload(app_catalog, application, cwl_contents=cwl_contents, json_contents=json_contents)
+
+    generator = create_generator(tmp_path, source_repository, [])
+
+    with mock.patch.object(PooledDockstoreAppCatalog, "upload_contents", record_upload):
+        generator.push_to_application_registry(dockstore.api_url, TOKEN, force=force)
+
+    return generator, uploads
+
+def test_register_application(tmp_path, source_repository, dockstore, generator):
+
+    generator, _ = push(tmp_path, source_repository, dockstore)
+
+    assert list(dockstore.apps.keys()) == [ int(generator.app_state.app_registry_id) ]
+
+    app = dockstore.apps[int(generator.app_state.app_registry_id)]
+    assert app["published"]
+    assert sorted(app["files"].keys()) == sorted([ "/" + relpath for relpath in generator.app_state.cwl_output_hashes.keys() ])
+
+def test_unchanged_files_not_uploaded(tmp_path, source_repository, dockstore, generator):
+
+    push(tmp_path, source_repository, dockstore)
+    bytes_uploaded = dockstore.bytes_uploaded
+
+    # The cached application id avoids listing the applications of the user
+    with mock.patch.object(PooledDockstoreAppCatalog, "application_list") as application_list:
+        _, uploads = push(tmp_path, source_repository, dockstore)
+
+    application_list.assert_not_called()
+    assert uploads == []
+    assert dockstore.bytes_uploaded == bytes_uploaded
+
+    _, uploads = push(tmp_path, source_repository, dockstore, force=True)
+    assert len(uploads) == 1
+    assert len(dockstore.apps) == 1
+
+def test_changed_files_uploaded(tmp_path, source_repository, dockstore, generator):
+
+    push(tmp_path, source_repository, dockstore)
+
+    changed_files = generator.create_cwl(docker_url="registry.example.com/app:v2")
+    _, uploads = push(tmp_path, source_repository, dockstore)
+
+    assert uploads == [ sorted([ os.path.basename(filename) for filename in changed_files ]) ]
+    assert len(uploads[0]) < len(generator.app_state.cwl_output_hashes)
+
+def test_deleted_application_registered_again(tmp_path, source_repository, dockstore, generator):
+
+    generator, _ = push(tmp_path, source_repository, dockstore)
+    del dockstore.apps[int(generator.app_state.app_registry_id)]
+
+    # All files are uploaded to the new entry
+    generator, uploads = push(tmp_path, source_repository, dockstore)
+
+    assert list(dockstore.apps.keys()) == [ int(generator.app_state.app_registry_id) ]
+    assert uploads == [ sorted(generator.app_state.cwl_output_hashes.keys()) ]
+
+def test_token_not_cached(tmp_path, source_repository, dockstore, generator):
+
+    push(tmp_path, source_repository, dockstore)
+
+    for filename in os.listdir(user_cache_directory()):
+        with open(os.path.join(user_cache_directory(), filename)) as cache_file:
+            assert TOKEN not in cache_file.read()
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+import yaml
+
+from unity_app_generator import interface
+from unity_app_generator.generator import ApplicationGenerationError
+
+@pytest.mark.parametrize("manifest, message", [
+    ({ "defaults": {} }, "must contain an applications list"),
+    ({ "applications": "https://github.com/unity-sds/example.git" }, "must contain an applications list"),
+    ({ "applications": [ "https://github.com/unity-sds/example.git" ] }, "application entry 1 must be a dictionary"),
+    ({ "applications": [], "defaults": [ "--ecr" ] }, "defaults must be a dictionary"),
+    ({ "applications": [ { "source_repository": "app", "checkuot": "v1.0.0" } ] }, "application entry 1 has unknown arguments: checkuot"),
+    ({ "applications": [], "defaults": { "profile": True } }, "defaults has unknown arguments: profile"),
+    ({ "applications": [], "default": {} }, "unknown keys: default"),
+])
+def test_invalid_manifest(manifest, message):
+
+    with pytest.raises(ApplicationGenerationError, match=message):
+        interface.batch(manifest)
+
+def test_manifest_file_paths(tmp_path):
+
+    manifest_filename = tmp_path / "manifests" / "batch.yml"
+    manifest_filename.parent.mkdir()
+    manifest_filename.write_text(yaml.safe_dump({
+        "defaults": { "config_file": "repo2docker.json" },
+        "applications": [
+            { "source_repository": "../sources/app", "destination_directory": "app" },
+            { "source_repository": "https://github.com/unity-sds/example.git", "state_directory": "/tmp/example" },
+        ],
+    }))
+
+    manifest = interface.load_batch_manifest(str(manifest_filename))
+
+    manifest_dir = str(manifest_filename.parent.resolve())
+
+    assert manifest["defaults"]["config_file"] == os.path.join(manifest_dir, "repo2docker.json")
+    assert manifest["applications"][0] == { "source_repository": os.path.join(str(tmp_path.resolve()), "sources", "app"),
+                                            "destination_directory": os.path.join(manifest_dir, "app") }
+    assert manifest["applications"][1] == { "source_repository": "https://github.com/unity-sds/example.git", "state_directory": "/tmp/example" }
+
+def test_batch(tmp_path, fake_docker):
+    from tests.fakes import FakeDockerUtil, create_fixture_repository
+
+    sources = [ create_fixture_repository(str(tmp_path / "sources" / f"app_{index}")) for index in range(2) ]
+
+    manifest = {
+        "defaults": { "image_namespace": "" },
+        "applications": [ { "source_repository": source, "destination_directory": str(tmp_path / "apps" / os.path.basename(source)) }
+                          for source in sources ] +
+                        [ { "source_repository": str(tmp_path / "sources" / "missing"), "destination_directory": str(tmp_path / "apps" / "missing") } ],
+    }
+
+    results = interface.batch(manifest, max_builds=1, docker_util_factory=FakeDockerUtil)
+
+    assert [ result["success"] for result in results ] == [ True, True, False ]
+
+    # A failed application does not stop the others
+    assert results[2]["error"] is not None
+
+    for result, source in zip(results[:2], sources):
+        assert result["docker_url"].startswith(os.path.basename(source) + ":")
+        assert [ stage_name for stage_name, _ in result["stage_times"] ] == [ "init", "build_docker", "build_cwl", "validate_cwl" ]
+
+    with pytest.raises(ApplicationGenerationError, match="1 of 3 batch applications failed"):
+        interface.batch(manifest, raise_on_failure=True, docker_util_factory=FakeDockerUtil)
+
+def test_shared_state_directory(tmp_path):
+
+    manifest = { "applications": [ { "source_repository": "a", "state_directory": str(tmp_path / "state") },
+                                   { "source_repository": "b", "state_directory": str(tmp_path / "state") } ] }
+
+    with pytest.raises(ApplicationGenerationError, match="Multiple batch manifest applications"):
+        interface.batch(manifest)
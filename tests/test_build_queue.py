@@ -0,0 +1,56 @@
+import os
+import glob
+import threading
+
+import pytest
+
+from unity_app_generator import interface
+from unity_app_generator.generator import UnityApplicationGenerator, ApplicationGenerationError
+from unity_app_generator.build_queue import BuildWorker
+
+from tests.test_remote_source import commit_file, create_generator
+
+@pytest.fixture
+def start_worker(tmp_path, fake_docker, monkeypatch):
+    "Start build workers serving a queue directory from background threads"
+    from tests.fakes import FakeDockerUtil
+
+    # Generators created by the workers build with the fake Docker client
+    monkeypatch.setattr(UnityApplicationGenerator, "docker_util_factory", FakeDockerUtil)
+
+    stop_event = threading.Event()
+    threads = []
+
+    def start(queue_directory, worker_id, **kwargs):
+        worker = BuildWorker(queue_directory, work_directory=str(tmp_path / worker_id), worker_id=worker_id, **kwargs)
+
+        threads.append(threading.Thread(target=worker.run, args=(stop_event,), daemon=True))
+        threads[-1].start()
+
+        return worker
+
+    yield start
+
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+
+def test_shallow_worker(tmp_path, source_repository, start_worker):
+
+    commit_file(source_repository, "second.txt")
+
+    build_queue = str(tmp_path / "build_queue")
+    worker = start_worker(build_queue, "shallow_worker", shallow=True)
+
+    generator = create_generator(tmp_path, f"file://{source_repository}")
+    generator.create_docker_image(build_queue=build_queue, build_timeout=60)
+
+    assert generator.app_state.docker_builder["worker_id"] == "shallow_worker"
+
+    shallow_files = glob.glob(os.path.join(worker.work_directory, "**", ".git", "shallow"), recursive=True)
+    assert len(shallow_files) == 1
+
+def test_shallow_mirror_worker_rejected(tmp_path):
+
+    with pytest.raises(ApplicationGenerationError, match="can not use both shallow clones and Git mirrors"):
+        interface.build_worker(str(tmp_path / "build_queue"), work_directory=str(tmp_path / "worker"), shallow=True, git_mirror=True)
@@ -0,0 +1,91 @@
+import os
+import time
+
+import pytest
+
+from unity_app_generator.bundle import ArtifactCache, ArtifactBundle, BundleError
+
+@pytest.fixture
+def artifact_cache(tmp_path):
+    return ArtifactCache(str(tmp_path / "artifacts"))
+
+def write_files(directory, contents):
+    "Write files named by the keys of contents and return their paths"
+
+    filenames = []
+    for name, text in contents.items():
+        filename = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, "w") as output_file:
+            output_file.write(text)
+
+        filenames.append(filename)
+
+    return filenames
+
+def object_files(artifact_cache):
+    return [ os.path.join(dir_path, name) for dir_path, _, names in os.walk(artifact_cache.objects_directory) for name in names ]
+
+def test_files_shared_between_bundles(tmp_path, artifact_cache):
+
+    app_a = str(tmp_path / "app_a")
+    app_b = str(tmp_path / "app_b")
+
+    bundle_a = artifact_cache.store_bundle(write_files(app_a, { "stage_in.cwl": "stage in", "process.cwl": "process a" }), base_directory=app_a)
+    bundle_b = artifact_cache.store_bundle(write_files(app_b, { "stage_in.cwl": "stage in", "process.cwl": "process b" }), base_directory=app_b)
+
+    assert bundle_a != bundle_b
+
+    # The identical stage in file is stored once
+    assert len(object_files(artifact_cache)) == 3
+
+    with ArtifactBundle(bundle_a) as bundle:
+        assert bundle.read("process.cwl") == b"process a"
+        assert bundle.read("stage_in.cwl") == b"stage in"
+
+    with ArtifactBundle(bundle_b) as bundle:
+        assert bundle.read("process.cwl") == b"process b"
+
+    # Storing the same files again gives the same bundle
+    assert artifact_cache.store_bundle(write_files(app_a, { "stage_in.cwl": "stage in", "process.cwl": "process a" }), base_directory=app_a) == bundle_a
+
+def test_corrupt_object(tmp_path, artifact_cache):
+
+    app_dir = str(tmp_path / "app")
+    bundle_filename = artifact_cache.store_bundle(write_files(app_dir, { "process.cwl": "process" }), base_directory=app_dir)
+
+    for object_filename in object_files(artifact_cache):
+        os.remove(object_filename)
+
+    with ArtifactBundle(bundle_filename) as bundle:
+        with pytest.raises(BundleError, match="process.cwl"):
+            bundle.read("process.cwl")
+
+def test_prune(tmp_path, artifact_cache):
+
+    app_a = str(tmp_path / "app_a")
+    app_b = str(tmp_path / "app_b")
+
+    bundle_a = artifact_cache.store_bundle(write_files(app_a, { "stage_in.cwl": "stage in", "process.cwl": "process a" }), base_directory=app_a)
+    bundle_b = artifact_cache.store_bundle(write_files(app_b, { "stage_in.cwl": "stage in", "process.cwl": "process b" }), base_directory=app_b)
+
+    # Age every file of the cache, then use bundle_b again
+    old_time = time.time() - 3600
+    for filename in object_files(artifact_cache) + [ bundle_a, bundle_b ]:
+        os.utime(filename, (old_time, old_time))
+
+    ArtifactBundle(bundle_b).close()
+
+    # The bundle not used within the age limit and the object only it references are removed
+    assert artifact_cache.prune(max_age=60) == 2
+    assert not os.path.exists(bundle_a)
+
+    with ArtifactBundle(bundle_b) as bundle:
+        assert bundle.read("stage_in.cwl") == b"stage in"
+        assert bundle.read("process.cwl") == b"process b"
+
+    # Pruning again within the interval does nothing
+    os.utime(bundle_b, (old_time, old_time))
+    assert artifact_cache.prune(max_age=60) == 0
+    assert os.path.exists(bundle_b)
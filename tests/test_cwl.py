@@ -0,0 +1,108 @@
+import os
+import json
+
+from tests.test_fingerprint import create_generator
+
+def build_cwl(tmp_path, source_repository, **kwargs):
+
+    generator = create_generator(tmp_path, source_repository, [])
+    generator.create_docker_image()
+
+    return generator, generator.create_cwl(**kwargs)
+
+def test_unchanged_inputs_skipped(tmp_path, fake_docker, source_repository):
+
+    generator, files_rewritten = build_cwl(tmp_path, source_repository)
+
+    assert len(files_rewritten) > 0
+    assert sorted(generator.app_state.cwl_output_hashes.keys()) == sorted([ os.path.basename(f) for f in files_rewritten ])
+
+    generator, files_rewritten = build_cwl(tmp_path, source_repository)
+    assert files_rewritten == []
+
+    # Forced generation writes identical files, which are left alone
+    assert generator.create_cwl(force=True) == []
+
+def test_changed_docker_url(tmp_path, fake_docker, source_repository):
+
+    generator, _ = build_cwl(tmp_path, source_repository)
+
+    files_rewritten = generator.create_cwl(docker_url="registry.example.com/app:v2")
+
+    assert len(files_rewritten) > 0
+
+    for filename in files_rewritten:
+        with open(filename) as cwl_file:
+            assert "registry.example.com/app:v2" in cwl_file.read()
+
+def test_changed_notebook(tmp_path, fake_docker, source_repository):
+
+    generator, _ = build_cwl(tmp_path, source_repository)
+
+    notebook_filename = os.path.join(generator.repo_info.directory, "process.ipynb")
+    with open(notebook_filename) as notebook_file:
+        notebook = json.load(notebook_file)
+
+    notebook["cells"][0]["source"].append("param_extra = 'extra'\n")
+
+    with open(notebook_filename, "w") as notebook_file:
+        json.dump(notebook, notebook_file)
+
+    files_rewritten = generator.create_cwl()
+
+    assert any([ "param_extra" in open(filename).read() for filename in files_rewritten ])
+
+def test_missing_output_regenerated(tmp_path, fake_docker, source_repository):
+
+    generator, files_rewritten = build_cwl(tmp_path, source_repository)
+
+    os.remove(files_rewritten[0])
+
+    assert generator.create_cwl() == [ files_rewritten[0] ]
+
+def test_removed_outputs_deleted(tmp_path, fake_docker, source_repository):
+
+    generator, _ = build_cwl(tmp_path, source_repository, monolithic=True)
+    monolithic_files = set(generator.app_state.cwl_output_hashes.keys())
+
+    generator.create_cwl(monolithic=False)
+    default_files = set(generator.app_state.cwl_output_hashes.keys())
+
+    assert default_files < monolithic_files
+
+    # Files only generated in monolithic mode are removed
+    for relpath in monolithic_files - default_files:
+        assert not os.path.exists(os.path.join(generator.app_state.cwl_output_path, relpath))
+
+def test_multiple_notebooks(tmp_path, fake_docker, dockstore):
+    from tests.fakes import create_fixture_repository
+
+    source_repository = create_fixture_repository(str(tmp_path / "source" / "app"), num_notebooks=3)
+
+    generator, _ = build_cwl(tmp_path, source_repository)
+
+    subdirectories = [ f"processes-step-{index:02d}" for index in range(3) ]
+
+    assert sorted(generator.app_state.cwl_applications.keys()) == [ f"app-{subdirectory}" for subdirectory in subdirectories ]
+    assert sorted(set([ os.path.dirname(relpath) for relpath in generator.app_state.cwl_output_hashes ])) == subdirectories
+
+    # Only the application of a changed notebook is regenerated
+    notebook_filename = os.path.join(generator.repo_info.directory, "processes", "step_01.ipynb")
+    with open(notebook_filename) as notebook_file:
+        notebook = json.load(notebook_file)
+
+    notebook["cells"][0]["source"].append("param_extra = 'extra'\n")
+
+    with open(notebook_filename, "w") as notebook_file:
+        json.dump(notebook, notebook_file)
+
+    files_rewritten = generator.create_cwl()
+
+    assert len(files_rewritten) > 0
+    assert all([ os.path.basename(os.path.dirname(filename)) == "processes-step-01" for filename in files_rewritten ])
+
+    # Each notebook is registered as its own application
+    generator.push_to_application_registry(dockstore.api_url, "token")
+
+    assert sorted([ app["name"] for app in dockstore.apps.values() ]) == sorted(generator.app_state.cwl_applications.keys())
+    assert sorted(generator.app_state.app_registry_ids.keys()) == sorted(generator.app_state.cwl_applications.keys())
@@ -0,0 +1,111 @@
+import os
+import stat
+import base64
+import datetime
+from unittest import mock
+
+import pytest
+
+# moto is only needed for testing and is not a requirement of the package
+moto = pytest.importorskip("moto")
+
+from unity_app_generator.cache import JSONCache, user_cache_directory
+from unity_app_generator.ecr_helper import ECRHelper
+
+ACCESS_KEY_ID = "AKIAUNITYTESTKEY0001"
+
+class RepositoryDockerUtil(object):
+    "Only the attributes of DockerUtil that ECRHelper reads"
+
+    image_namespace = "unity"
+    image_repository = "example-app"
+    docker_client = None
+
+@pytest.fixture
+def ecr_helper(monkeypatch):
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", ACCESS_KEY_ID)
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-west-2")
+
+    # Clients and tokens are shared per process, start each test without them
+    monkeypatch.setattr(ECRHelper, "_shared_session", None)
+    monkeypatch.setattr(ECRHelper, "_shared_client", None)
+    monkeypatch.setattr(ECRHelper, "_auth_data", {})
+
+    with moto.mock_aws():
+        yield ECRHelper(RepositoryDockerUtil())
+
+def authorization_response():
+    "Token that stays valid for the test, moto returns one that expired long ago"
+
+    return { "authorizationData": [ {
+        "authorizationToken": base64.b64encode(b"AWS:password").decode(),
+        "proxyEndpoint": "https://123456789012.dkr.ecr.us-west-2.amazonaws.com",
+        "expiresAt": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=12),
+    } ] }
+
+def cache_contents():
+    contents = ""
+
+    for filename in os.listdir(user_cache_directory()):
+        with open(os.path.join(user_cache_directory(), filename)) as cache_file:
+            contents += cache_file.read()
+
+    return contents
+
+def test_repository_uri_cached(ecr_helper):
+
+    repository_uri = ecr_helper.create_repository()
+
+    assert repository_uri.endswith("/unity/example-app")
+
+    with mock.patch.object(ecr_helper.ecr_client, "create_repository") as create_repository:
+        assert ecr_helper.create_repository() == repository_uri
+
+    create_repository.assert_not_called()
+
+def test_deleted_repository_recreated(ecr_helper):
+
+    ecr_helper.create_repository()
+    ecr_helper.ecr_client.delete_repository(repositoryName=ecr_helper.repository_name)
+
+    assert not ecr_helper.repository_exists()
+
+    ecr_helper.forget_repository()
+    ecr_helper.create_repository()
+
+    assert ecr_helper.repository_exists()
+
+def test_authorization_token_cached(ecr_helper):
+
+    with mock.patch.object(ecr_helper.ecr_client, "get_authorization_token", return_value=authorization_response()):
+        auth_data = ecr_helper._authorization_data()
+
+    # Neither this process nor a later one asks ECR for a new token
+    ECRHelper._auth_data.clear()
+
+    with mock.patch.object(ecr_helper.ecr_client, "get_authorization_token") as get_authorization_token:
+        assert ecr_helper._authorization_data() == auth_data
+
+    get_authorization_token.assert_not_called()
+
+    token_filename = JSONCache("ecr_auth").cache_filename
+    assert stat.S_IMODE(os.stat(token_filename).st_mode) == 0o600
+
+def test_caches_keyed_by_identity(ecr_helper, monkeypatch):
+
+    ecr_helper.create_repository()
+
+    with mock.patch.object(ecr_helper.ecr_client, "get_authorization_token", return_value=authorization_response()):
+        ecr_helper._authorization_data()
+
+    assert ACCESS_KEY_ID not in cache_contents()
+
+    first_identity = ecr_helper._identity_key
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIAUNITYTESTKEY0002")
+    monkeypatch.setattr(ECRHelper, "_shared_session", None)
+    monkeypatch.setattr(ECRHelper, "_shared_client", None)
+
+    assert ECRHelper(RepositoryDockerUtil())._identity_key != first_identity
@@ -0,0 +1,87 @@
+import os
+
+from unity_app_generator.generator import UnityApplicationGenerator
+from unity_app_generator.fingerprint import source_fingerprint
+
+from tests.test_remote_source import commit_file
+
+def create_generator(tmp_path, source_repository, events):
+    from tests.fakes import FakeDockerUtil
+
+    return UnityApplicationGenerator(str(tmp_path / "app" / ".unity_app_gen"), source_repository, str(tmp_path / "app"),
+                                     docker_util_factory=FakeDockerUtil, event_callback=events.append)
+
+def event_count(events, event_name):
+    return len([ event for event in events if event["event"] == event_name ])
+
+def test_source_fingerprint(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository, [])
+    app_dir = generator.repo_info.directory
+    git_mgr = generator.repo_info
+
+    # The state directory inside the checkout is not part of the source
+    clean_fingerprint = source_fingerprint(git_mgr, exclude_paths=[generator.app_state.state_directory])
+
+    with open(os.path.join(app_dir, "untracked.txt"), "w") as untracked_file:
+        untracked_file.write("first\n")
+
+    untracked_fingerprint = source_fingerprint(git_mgr, exclude_paths=[generator.app_state.state_directory])
+    assert untracked_fingerprint != clean_fingerprint
+
+    with open(os.path.join(app_dir, "untracked.txt"), "w") as untracked_file:
+        untracked_file.write("second\n")
+
+    assert source_fingerprint(git_mgr, exclude_paths=[generator.app_state.state_directory]) != untracked_fingerprint
+
+    os.remove(os.path.join(app_dir, "untracked.txt"))
+    assert source_fingerprint(git_mgr, exclude_paths=[generator.app_state.state_directory]) == clean_fingerprint
+
+    config_filename = tmp_path / "repo2docker.json"
+    config_filename.write_text("{}")
+    assert source_fingerprint(git_mgr, extra_files=[str(config_filename)]) != source_fingerprint(git_mgr)
+
+def test_unchanged_source_skips_build(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    create_generator(tmp_path, source_repository, events).create_docker_image()
+    assert event_count(events, "build_start") == 1
+
+    create_generator(tmp_path, source_repository, events).create_docker_image()
+    assert event_count(events, "build_start") == 1
+
+    create_generator(tmp_path, source_repository, events).create_docker_image(force=True)
+    assert event_count(events, "build_start") == 2
+
+def test_changed_source_rebuilds(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    generator = create_generator(tmp_path, source_repository, events)
+    generator.create_docker_image()
+
+    # Uncommitted changes count as well as commits
+    with open(os.path.join(generator.repo_info.directory, "process.ipynb"), "a") as notebook_file:
+        notebook_file.write("\n")
+
+    create_generator(tmp_path, source_repository, events).create_docker_image()
+    assert event_count(events, "build_start") == 2
+
+    commit_file(generator.repo_info.directory, "process.ipynb")
+
+    create_generator(tmp_path, source_repository, events).create_docker_image()
+    assert event_count(events, "build_start") == 3
+
+def test_removed_image_rebuilds(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    generator = create_generator(tmp_path, source_repository, events)
+    generator.create_docker_image()
+
+    image_id = fake_docker.images.get(generator.app_state.docker_image_reference).id
+    fake_docker.images.remove(image_id, force=True)
+
+    create_generator(tmp_path, source_repository, events).create_docker_image()
+    assert event_count(events, "build_start") == 2
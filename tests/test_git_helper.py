@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from unity_app_generator import interface
+from unity_app_generator.generator import ApplicationGenerationError
+from unity_app_generator.git_helper import clone_source, mirror_directory, is_remote_source, is_checked_out
+
+@pytest.fixture
+def source_url(source_repository):
+    from tests.test_remote_source import commit_file
+
+    # A second commit so that a shallow clone has less history than the source
+    commit_file(source_repository, "second.txt")
+
+    return f"file://{source_repository}"
+
+def test_is_remote_source():
+
+    assert is_remote_source("https://github.com/unity-sds/example.git")
+    assert is_remote_source("git@github.com:unity-sds/example.git")
+    assert is_remote_source("file:///srv/git/example")
+    assert not is_remote_source("/srv/git/example")
+    assert not is_remote_source("../example")
+
+def test_shallow_clone(tmp_path, source_url):
+
+    repo = clone_source(source_url, str(tmp_path / "clone"), shallow=True)
+
+    assert os.path.exists(tmp_path / "clone" / ".git" / "shallow")
+    assert len(list(repo.iter_commits())) == 1
+
+def test_shallow_clone_of_commit(tmp_path, source_url, source_repository):
+    import git
+
+    first_commit = list(git.Repo(source_repository).iter_commits())[-1].hexsha
+
+    repo = clone_source(source_url, str(tmp_path / "clone"), checkout=first_commit, shallow=True)
+
+    assert is_checked_out(repo, first_commit)
+
+def test_mirror_clone(tmp_path, source_url):
+
+    repo = clone_source(source_url, str(tmp_path / "clone"), use_mirror=True)
+
+    assert len(os.listdir(mirror_directory())) > 0
+    assert len(list(repo.iter_commits())) == 2
+
+    # The clone does not depend on the mirror once made
+    assert not os.path.exists(tmp_path / "clone" / ".git" / "objects" / "info" / "alternates")
+
+def test_shallow_mirror_rejected(tmp_path, source_url):
+
+    with pytest.raises(ValueError):
+        clone_source(source_url, str(tmp_path / "clone"), shallow=True, use_mirror=True)
+
+    with pytest.raises(ApplicationGenerationError, match="shallow clone can not be combined with a Git mirror"):
+        interface.init(None, source_url, destination_directory=str(tmp_path / "app"), shallow=True, git_mirror=True)
@@ -0,0 +1,113 @@
+import io
+import tarfile
+from unittest import mock
+
+import pytest
+
+from unity_app_generator.generator import ApplicationGenerationError
+from unity_app_generator.image_optimize import ImageSlimmer, build_only_paths, startup_paths, layer_report
+
+from tests.fakes import FakeImage, FakeDockerClient
+from tests.test_fingerprint import create_generator
+
+def layer_paths(layer_archive):
+
+    with tarfile.open(fileobj=io.BytesIO(layer_archive), mode="r:") as layer_tar:
+        return sorted(layer_tar.getnames())
+
+@pytest.fixture
+def docker_client():
+    return FakeDockerClient()
+
+def add_image(docker_client, image_reference, num_app_layers):
+
+    layers = [ ("env0", 1000), ("env1", 2000), ("app0", 300), ("app1", 400) ][:2 + num_app_layers]
+
+    image = FakeImage(docker_client, f"sha256:{image_reference}", sum([ size for _, size in layers ]), layers, num_app_layers=num_app_layers)
+    docker_client.images.add(image_reference, image)
+
+    return image
+
+def test_build_only_paths(docker_client):
+
+    image = add_image(docker_client, "app:v1", 2)
+
+    assert build_only_paths(image, [ ".unity_app_gen" ]) == [
+        "home/jovyan/.cache/pip", "home/jovyan/.cache/yarn", "home/jovyan/.git",
+        "home/jovyan/.ipynb_checkpoints", "home/jovyan/.unity_app_gen",
+    ]
+
+    assert startup_paths(image, [ "steps/qa.ipynb" ])[-1] == "/home/jovyan/steps/qa.ipynb"
+
+def test_slim_image(docker_client):
+
+    image = add_image(docker_client, "app:v1", 2)
+
+    result = ImageSlimmer(docker_client).slim("app:v1", "app:v1-slim", build_only_paths(image, [ ".unity_app_gen" ]))
+
+    assert result["stripped_files"] == 4
+    assert result["layers_rewritten"] == 2
+    assert result["stripped_bytes"] == 32 + 512 * 1024 + 1024 + 128 * 1024
+
+    slim_image = docker_client.images.get("app:v1-slim")
+
+    # Layers without build only content are left as they are and keep their ids
+    assert slim_image.layer_archives[:2] == image.layer_archives[:2]
+    assert slim_image.layers[:2] == image.layers[:2]
+
+    assert layer_paths(slim_image.layer_archives[2]) == [ "home/jovyan/process.ipynb" ]
+    assert layer_paths(slim_image.layer_archives[3]) == [ "home/jovyan/environment.yml" ]
+
+def test_slim_image_without_build_content(docker_client):
+
+    image = add_image(docker_client, "env:v1", 0)
+
+    result = ImageSlimmer(docker_client).slim("env:v1", "env:v1-slim", build_only_paths(image))
+
+    assert result == { "stripped_files": 0, "stripped_bytes": 0, "layers_rewritten": 0 }
+    assert docker_client.images.get("env:v1-slim") is image
+
+def test_layer_report(docker_client):
+
+    image = add_image(docker_client, "app:v1", 2)
+
+    assert [ layer["size"] for layer in layer_report(image) ] == [ 1000, 2000, 300, 400 ]
+
+def test_slim_build(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository, [])
+    generator.create_docker_image(slim=True)
+
+    optimized_image = generator.app_state.docker_optimized_image
+    image_reference = generator.app_state.docker_image_reference
+
+    assert optimized_image["image_reference"] == image_reference + "-slim"
+    assert optimized_image["size"] < optimized_image["source_size"]
+    assert optimized_image["layers_rewritten"] == 2
+    assert generator._pushed_image_reference() == image_reference + "-slim"
+
+    # The slim image is pushed and used in the CWL files
+    generator.push_to_docker_registry("registry.example.com")
+    assert generator.app_state.docker_url == f"registry.example.com/{image_reference}-slim"
+
+    generator = create_generator(tmp_path, source_repository, [])
+
+    with mock.patch.object(ImageSlimmer, "slim") as slim:
+        generator.create_docker_image(slim=True)
+
+    slim.assert_not_called()
+
+    generator.create_docker_image()
+    assert generator.app_state.docker_optimized_image is None
+    assert generator._pushed_image_reference() == image_reference
+
+def test_lazy_format_build(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository, [])
+    generator.create_docker_image(slim=True, lazy_format="estargz")
+
+    image_reference = generator.app_state.docker_image_reference
+    assert generator.app_state.docker_optimized_image["image_reference"] == image_reference + "-slim-estargz"
+
+    with pytest.raises(ApplicationGenerationError, match="Unknown lazy pull format"):
+        generator.create_docker_image(lazy_format="squashfs")
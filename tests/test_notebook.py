@@ -0,0 +1,174 @@
+import os
+import json
+from unittest import mock
+
+import pytest
+
+from app_pack_generator import ApplicationNotebook
+from app_pack_generator.application import ApplicationError
+
+from unity_app_generator import notebook
+from unity_app_generator.notebook import read_parameters_notebook, load_notebook, ParsedApplicationNotebook, discover_notebooks, notebook_applications
+
+@pytest.fixture
+def notebook_filename(tmp_path):
+    from tests.fakes import write_synthetic_notebook
+
+    filename = str(tmp_path / "process.ipynb")
+    write_synthetic_notebook(filename, num_parameters=4, output_bytes=64 * 1024)
+
+    return filename
+
+def parameter_summary(app_notebook):
+    return [ (param.name, param.inferred_type, param.default) for param in app_notebook.notebook_parameters ] + \
+           [ (param.name, param.cwl_type) for param in app_notebook.arguments ] + \
+           [ app_notebook.stage_in_param.name, app_notebook.stage_out_param.name ]
+
+def test_read_parameters_notebook(notebook_filename, monkeypatch):
+
+    # Reads smaller than strings and escapes exercise values split across reads
+    monkeypatch.setattr(notebook, "NOTEBOOK_READ_SIZE", 7)
+
+    parameters_notebook = read_parameters_notebook(notebook_filename)
+
+    with open(notebook_filename) as notebook_file:
+        full_notebook = json.load(notebook_file)
+
+    assert parameters_notebook["metadata"] == full_notebook["metadata"]
+    assert parameters_notebook["nbformat"] == 4
+    assert parameters_notebook["cells"] == full_notebook["cells"][:1]
+
+def test_escaped_strings(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(notebook, "NOTEBOOK_READ_SIZE", 3)
+
+    source = [ 'text = "quoted \\"value\\" with \\\\ and {braces} [brackets]" # type: string\n' ]
+    cells = [ { "cell_type": "markdown", "metadata": {}, "source": [ '"\\u00e9" \\\\' ] },
+              { "cell_type": "code", "execution_count": None, "metadata": { "tags": [ "parameters" ] }, "outputs": [], "source": source } ]
+
+    filename = tmp_path / "escapes.ipynb"
+    filename.write_text(json.dumps({ "cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 4 }))
+
+    assert read_parameters_notebook(str(filename))["cells"][0]["source"] == source
+
+def test_parameters_match_full_parser(notebook_filename, tmp_path):
+
+    parsed = load_notebook(notebook_filename, str(tmp_path / "cache"))
+
+    assert isinstance(parsed, ParsedApplicationNotebook)
+    assert parameter_summary(parsed) == parameter_summary(ApplicationNotebook(notebook_filename))
+
+def test_parameters_cached(notebook_filename, tmp_path):
+
+    cache_directory = str(tmp_path / "cache")
+
+    load_notebook(notebook_filename, cache_directory)
+
+    with mock.patch.object(notebook, "inspect_notebook_parameters") as inspect_parameters, \
+         mock.patch.object(notebook, "validate_notebook") as validate:
+
+        load_notebook(notebook_filename, cache_directory)
+
+        # A checkout changes the modification time but not the contents
+        os.utime(notebook_filename, ns=(0, 0))
+        load_notebook(notebook_filename, cache_directory)
+
+    inspect_parameters.assert_not_called()
+    validate.assert_not_called()
+
+    with open(notebook_filename) as notebook_file:
+        notebook_dict = json.load(notebook_file)
+
+    notebook_dict["cells"][0]["source"].append("param_extra = 1\n")
+
+    with open(notebook_filename, "w") as notebook_file:
+        json.dump(notebook_dict, notebook_file)
+
+    assert "param_extra" in [ param.name for param in load_notebook(notebook_filename, cache_directory).arguments ]
+
+def test_invalid_notebook(notebook_filename, tmp_path):
+
+    with open(notebook_filename) as notebook_file:
+        notebook_dict = json.load(notebook_file)
+
+    # Code cells require a source
+    del notebook_dict["cells"][1]["source"]
+
+    with open(notebook_filename, "w") as notebook_file:
+        json.dump(notebook_dict, notebook_file)
+
+    with pytest.raises(ApplicationError, match="Failed to validate"):
+        load_notebook(notebook_filename, str(tmp_path / "cache"))
+
+def test_malformed_notebook(tmp_path):
+
+    filename = tmp_path / "truncated.ipynb"
+    filename.write_text('{ "cells": [ { "cell_type": "code"')
+
+    # Parsed again by the full parser, which reports the error
+    with pytest.raises(ValueError):
+        load_notebook(str(filename), str(tmp_path / "cache"))
+
+def write_notebooks(repo_dir, notebook_paths, parameters=True):
+    from tests.fakes import write_synthetic_notebook
+
+    for notebook_path in notebook_paths:
+        notebook_filename = os.path.join(repo_dir, notebook_path)
+        os.makedirs(os.path.dirname(notebook_filename), exist_ok=True)
+        write_synthetic_notebook(notebook_filename)
+
+        if not parameters:
+            with open(notebook_filename) as notebook_file:
+                notebook_dict = json.load(notebook_file)
+
+            notebook_dict["cells"][0]["metadata"]["tags"] = []
+
+            with open(notebook_filename, "w") as notebook_file:
+                json.dump(notebook_dict, notebook_file)
+
+def test_discover_notebooks(tmp_path):
+
+    repo_dir = str(tmp_path / "repo")
+    write_notebooks(repo_dir, [ "steps/b.ipynb", "steps/a.ipynb", "top.ipynb" ])
+    write_notebooks(repo_dir, [ "notes/scratch.ipynb" ], parameters=False)
+    write_notebooks(repo_dir, [ ".ipynb_checkpoints/top-checkpoint.ipynb", "build/copy.ipynb" ])
+
+    assert discover_notebooks(repo_dir, exclude_paths=[os.path.join(repo_dir, "build")]) == [ "top.ipynb", "steps/a.ipynb", "steps/b.ipynb" ]
+
+    # The default notebook is used on its own when present
+    write_notebooks(repo_dir, [ "process.ipynb" ])
+    assert discover_notebooks(repo_dir) == [ "process.ipynb" ]
+
+def test_notebook_applications(tmp_path):
+
+    repo_dir = str(tmp_path / "repo")
+    write_notebooks(repo_dir, [ "process.ipynb", "steps/l2 product.ipynb", "steps/qa.ipynb" ])
+
+    single_app, = notebook_applications(repo_dir, "example", notebooks=[ "process.ipynb" ])
+    assert (single_app.name, single_app.subdirectory) == ("example", "")
+
+    notebook_apps = notebook_applications(repo_dir, "example", notebooks=[ "process.ipynb", "steps/*.ipynb" ])
+
+    assert [ (app.notebook_path, app.name, app.subdirectory) for app in notebook_apps ] == [
+        ("process.ipynb", "example", "process"),
+        ("steps/l2 product.ipynb", "example-steps-l2-product", "steps-l2-product"),
+        ("steps/qa.ipynb", "example-steps-qa", "steps-qa"),
+    ]
+
+def test_invalid_notebook_declarations(tmp_path):
+
+    repo_dir = str(tmp_path / "repo")
+    write_notebooks(repo_dir, [ "steps/qa.ipynb", "steps_qa.ipynb" ])
+    write_notebooks(str(tmp_path), [ "outside.ipynb" ])
+
+    with pytest.raises(ApplicationError, match="Could not find notebook file"):
+        notebook_applications(repo_dir, "example", notebooks=[ "missing.ipynb" ])
+
+    with pytest.raises(ApplicationError, match="outside of the repository"):
+        notebook_applications(repo_dir, "example", notebooks=[ "../outside.ipynb" ])
+
+    with pytest.raises(ApplicationError, match="would share the application names: example-steps-qa"):
+        notebook_applications(repo_dir, "example")
+
+    with pytest.raises(ApplicationError, match="Could not find any notebook files"):
+        notebook_applications(repo_dir, "example", notebooks=[ "*.missing" ])
@@ -0,0 +1,68 @@
+from tests.test_fingerprint import create_generator, event_count
+
+REGISTRY = "registry.example.com"
+
+def build_and_push(tmp_path, source_repository, events, force_build=False):
+
+    generator = create_generator(tmp_path, source_repository, events)
+    generator.create_docker_image(force=force_build)
+    generator.push_to_docker_registry(REGISTRY)
+
+    return generator
+
+def test_pushed_image_skipped(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    generator = build_and_push(tmp_path, source_repository, events)
+
+    assert event_count(events, "push_start") == 1
+    assert fake_docker.images.remote[generator.app_state.docker_url] == generator.app_state.docker_image_digest
+
+    build_and_push(tmp_path, source_repository, events)
+    assert event_count(events, "push_start") == 1
+
+    create_generator(tmp_path, source_repository, events).push_to_docker_registry(REGISTRY, force=True)
+    assert event_count(events, "push_start") == 2
+
+def test_image_missing_from_registry(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    generator = build_and_push(tmp_path, source_repository, events)
+
+    del fake_docker.images.remote[generator.app_state.docker_url]
+
+    build_and_push(tmp_path, source_repository, events)
+    assert event_count(events, "push_start") == 2
+
+def test_registry_digest_changed(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    generator = build_and_push(tmp_path, source_repository, events)
+
+    # Another image was pushed under the same tag
+    fake_docker.images.remote[generator.app_state.docker_url] = "sha256:" + "0" * 64
+
+    build_and_push(tmp_path, source_repository, events)
+    assert event_count(events, "push_start") == 2
+
+def test_rebuilt_image_pushed(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    build_and_push(tmp_path, source_repository, events)
+    build_and_push(tmp_path, source_repository, events, force_build=True)
+
+    assert event_count(events, "push_start") == 2
+
+def test_other_registry_pushed(tmp_path, fake_docker, source_repository):
+
+    events = []
+
+    generator = build_and_push(tmp_path, source_repository, events)
+    generator.push_to_docker_registry("other-registry.example.com")
+
+    assert event_count(events, "push_start") == 2
+    assert generator.app_state.docker_url.startswith("other-registry.example.com/")
@@ -0,0 +1,60 @@
+import os
+import subprocess
+
+import pytest
+
+from unity_app_generator.generator import UnityApplicationGenerator, ApplicationGenerationError
+
+GIT_ENV = { **os.environ,
+            "GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@localhost",
+            "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@localhost" }
+
+def commit_file(repo_dir, filename):
+
+    with open(os.path.join(repo_dir, filename), "w") as output_file:
+        output_file.write("changed\n")
+
+    for git_args in [ ["add", filename], ["commit", "--quiet", "-m", f"Add {filename}"] ]:
+        subprocess.run(["git"] + git_args, cwd=repo_dir, env=GIT_ENV, check=True)
+
+def create_generator(tmp_path, source_repository):
+    from tests.fakes import FakeDockerUtil
+
+    return UnityApplicationGenerator(str(tmp_path / "app" / ".unity_app_gen"), source_repository, str(tmp_path / "app"),
+                                     docker_util_factory=FakeDockerUtil)
+
+def test_local_source_rejected(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository)
+
+    with pytest.raises(ApplicationGenerationError, match="not a Git URL"):
+        generator._remote_build_source()
+
+def test_unpushed_commit_rejected(tmp_path, fake_docker, source_repository):
+
+    source_url = f"file://{source_repository}"
+    generator = create_generator(tmp_path, source_url)
+
+    build_source = generator._remote_build_source()
+    assert build_source["source_repository"] == source_url
+    assert build_source["checkout"] == generator.repo_info.repo.head.commit.hexsha
+
+    commit_file(str(tmp_path / "app"), "local_change.txt")
+
+    with pytest.raises(ApplicationGenerationError, match="is not pushed"):
+        create_generator(tmp_path, source_url)._remote_build_source()
+
+def test_commit_advertised_by_source(tmp_path, fake_docker, source_repository):
+
+    source_url = f"file://{source_repository}"
+    generator = create_generator(tmp_path, source_url)
+
+    # A commit pushed after the clone is not on a remote tracking branch yet, but the source advertises it
+    commit_file(source_repository, "new_file.txt")
+    generator.repo_info.repo.git.fetch("origin", "HEAD")
+    generator.repo_info.repo.git.checkout("--quiet", "FETCH_HEAD")
+
+    repo = generator.repo_info.repo
+    assert repo.git.branch("-r", "--contains", repo.head.commit.hexsha) == ""
+
+    assert create_generator(tmp_path, source_url)._remote_build_source()["checkout"] == repo.head.commit.hexsha
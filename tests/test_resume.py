@@ -0,0 +1,64 @@
+import pytest
+
+from unity_app_generator.generator import UnityApplicationGenerator, ApplicationGenerationError
+from unity_app_generator.build_queue import BuildQueueError
+
+from tests.test_remote_source import commit_file, create_generator
+
+def test_resume_after_change(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository)
+    generator.create_docker_image()
+    generator.create_cwl()
+    generator.validate_cwl()
+
+    assert create_generator(tmp_path, source_repository).resume() == []
+
+    # A change to the checked out source invalidates the build and the stages using its image
+    commit_file(str(tmp_path / "app"), "environment.yml")
+
+    stages_run = create_generator(tmp_path, source_repository).resume()
+
+    assert stages_run[:2] == [ "build_docker", "build_cwl" ]
+    assert create_generator(tmp_path, source_repository).resume() == []
+
+def test_resume_without_records(tmp_path, fake_docker, source_repository):
+
+    with pytest.raises(ApplicationGenerationError, match="No stages have been recorded"):
+        create_generator(tmp_path, source_repository).resume()
+
+class FailingBuildExecutor(object):
+    "Build executor whose worker never finishes the job, recording the timeouts it was given"
+
+    timeouts = []
+
+    def __init__(self, queue_directory, timeout=None):
+
+        self.queue_directory = queue_directory
+        type(self).timeouts.append(timeout)
+
+    def run(self, operation, job_args, affinity_keys=[]):
+        raise BuildQueueError("Timed out waiting for a build worker")
+
+def test_resume_queued_build(tmp_path, fake_docker, source_repository, monkeypatch):
+
+    monkeypatch.setattr(UnityApplicationGenerator, "build_executor_factory", FailingBuildExecutor)
+    monkeypatch.setattr(FailingBuildExecutor, "timeouts", [])
+
+    source_url = f"file://{source_repository}"
+    build_queue = str(tmp_path / "build_queue")
+
+    with pytest.raises(ApplicationGenerationError, match="Timed out"):
+        create_generator(tmp_path, source_url).create_docker_image(build_queue=build_queue, build_timeout=30)
+
+    generator = create_generator(tmp_path, source_url)
+    stage_record = generator.app_state.stage_records["build_docker"]
+
+    assert stage_record["status"] == "error"
+    assert stage_record["arguments"]["build_queue"] == build_queue
+
+    # The build is sent to the queue again with the same timeout
+    with pytest.raises(ApplicationGenerationError, match="Timed out"):
+        generator.resume()
+
+    assert FailingBuildExecutor.timeouts == [ 30, 30 ]
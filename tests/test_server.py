@@ -0,0 +1,214 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import pytest
+
+from unity_app_generator.server import BuildServer, run_server, is_loopback_host
+from unity_app_generator.generator import ApplicationGenerationError
+
+# Seconds a test waits for its jobs to finish
+JOB_TIMEOUT = 120
+
+class RunningServer(object):
+    "BuildServer handling connections on an event loop in a background thread"
+
+    def __init__(self, build_server):
+
+        self.build_server = build_server
+        self.loop = asyncio.new_event_loop()
+
+        self._server = self.loop.run_until_complete(asyncio.start_server(build_server.handle_connection, host="127.0.0.1", port=0))
+        self.url = "http://127.0.0.1:{}".format(self._server.sockets[0].getsockname()[1])
+
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def request(self, path, body=None, headers={}):
+        "Return the status and decoded body of a request, posting body as JSON if given"
+
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers=headers, method="POST" if data is not None else "GET")
+
+        try:
+            with urllib.request.urlopen(request, timeout=JOB_TIMEOUT) as response:
+                status, content_type, content = response.status, response.headers["Content-Type"], response.read().decode()
+        except urllib.error.HTTPError as err:
+            status, content_type, content = err.code, err.headers["Content-Type"], err.read().decode()
+
+        if content_type == "application/json":
+            content = json.loads(content)
+
+        return status, content
+
+    def wait(self, job_id):
+
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            _, info = self.request(f"/jobs/{job_id}")
+            if info["status"] in ("success", "failed"):
+                return info
+            time.sleep(0.1)
+
+        raise TimeoutError(f"Job {job_id} did not finish")
+
+    def stop(self):
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+        self._server.close()
+        self.loop.run_until_complete(self._server.wait_closed())
+        self.loop.close()
+
+        self.build_server.executor.shutdown(wait=True)
+        logging.getLogger().removeHandler(self.build_server.log_handler)
+
+@pytest.fixture
+def start_server(caplog):
+    "Start BuildServers constructed with the given arguments, stopping them after the test"
+
+    # Job logs only receive records at the level of the root logger
+    caplog.set_level(logging.INFO)
+
+    servers = []
+
+    def start(**kwargs):
+        servers.append(RunningServer(BuildServer(**kwargs)))
+        return servers[-1]
+
+    yield start
+
+    for server in servers:
+        server.stop()
+
+def test_jobs(tmp_path, fake_docker, dockstore, start_server):
+    from tests.fakes import FakeDockerUtil, create_fixture_repository
+    from unity_app_generator.app_catalog import PooledDockstoreAppCatalog
+
+    # Builds take long enough to overlap if they were not limited
+    FakeDockerUtil.step_seconds = 0.02
+
+    server = start_server(max_workers=3, max_builds=1, docker_util_factory=FakeDockerUtil, app_catalog_factory=PooledDockstoreAppCatalog)
+
+    app_names = [ f"server_app_{index}" for index in range(3) ]
+
+    job_ids = []
+    for app_name in app_names:
+        source = create_fixture_repository(str(tmp_path / "sources" / app_name))
+
+        status, info = server.request("/jobs", { "operation": "all", "args": {
+            "state_directory": None,
+            "source_repository": source,
+            "destination_directory": str(tmp_path / "apps" / app_name),
+            "image_namespace": "",
+            "container_registry": "registry.example.com",
+            "dockstore_api_url": dockstore.api_url,
+            "dockstore_token": "token",
+        } })
+
+        assert status == 202
+        job_ids.append(info["id"])
+
+    infos = [ server.wait(job_id) for job_id in job_ids ]
+
+    assert [ info["status"] for info in infos ] == [ "success" ] * 3
+    assert [ info["result"]["docker_url"].split(":")[0] for info in infos ] == [ f"registry.example.com/{app_name}" for app_name in app_names ]
+    assert sorted([ app["name"] for app in dockstore.apps.values() ]) == app_names
+
+    status, job_list = server.request("/jobs")
+    assert status == 200
+    assert sorted([ info["id"] for info in job_list ]) == sorted(job_ids)
+
+    # Each job log only holds the lines of that job
+    for job_id, app_name in zip(job_ids, app_names):
+        status, log = server.request(f"/jobs/{job_id}/log")
+
+        assert status == 200
+        assert app_name in log
+        assert not any([ other_name in log for other_name in app_names if other_name != app_name ])
+
+    # Builds of different jobs never run at the same time
+    build_intervals = []
+    for job_id in job_ids:
+        status, events = server.request(f"/jobs/{job_id}/events?follow=1")
+        events = [ json.loads(line) for line in events.splitlines() ]
+
+        start_time = [ event["time"] for event in events if event["event"] == "build_start" ][0]
+        end_time = [ event["time"] for event in events if event["event"] == "build_complete" ][0]
+        build_intervals.append( (start_time, end_time) )
+
+    build_intervals.sort()
+    for (_, end_time), (next_start_time, _) in zip(build_intervals[:-1], build_intervals[1:]):
+        assert end_time <= next_start_time
+
+def test_failed_job(tmp_path, start_server):
+
+    server = start_server()
+
+    status, info = server.request("/jobs", { "operation": "build_docker", "args": { "state_directory": str(tmp_path / "missing") } })
+    assert status == 202
+
+    info = server.wait(info["id"])
+
+    assert info["status"] == "failed"
+    assert info["error"] is not None
+
+def test_invalid_requests(start_server):
+
+    server = start_server()
+
+    status, response = server.request("/jobs", { "operation": "deploy" })
+    assert status == 400
+    assert "Unknown operation deploy" in response["error"]
+
+    status, response = server.request("/jobs", { "operation": "init", "args": [ "app" ] })
+    assert status == 400
+
+    status, response = server.request("/jobs/unknown")
+    assert status == 404
+
+def test_auth_token(start_server):
+
+    server = start_server(auth_token="secret")
+
+    status, _ = server.request("/health")
+    assert status == 401
+
+    status, _ = server.request("/health", headers={ "Authorization": "Bearer wrong" })
+    assert status == 401
+
+    status, response = server.request("/health", headers={ "Authorization": "Bearer secret" })
+    assert status == 200
+    assert response["status"] == "ok"
+
+def test_remote_host_requires_token():
+
+    assert is_loopback_host("127.0.0.1")
+    assert is_loopback_host("::1")
+    assert is_loopback_host("localhost")
+    assert not is_loopback_host("0.0.0.0")
+    assert not is_loopback_host("build-server.example.com")
+
+    with pytest.raises(ApplicationGenerationError, match="only listen on 0.0.0.0 with an auth token"):
+        run_server(host="0.0.0.0")
+
+def test_shared_docker_client():
+
+    build_server = BuildServer()
+
+    try:
+        with mock.patch("docker.from_env") as from_env:
+            docker_utils = [ build_server._shared_docker_util(None) for _ in range(3) ]
+
+        from_env.assert_called_once()
+        assert all([ docker_util.docker_client is from_env.return_value for docker_util in docker_utils ])
+
+    finally:
+        build_server.executor.shutdown()
+        logging.getLogger().removeHandler(build_server.log_handler)
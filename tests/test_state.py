@@ -0,0 +1,131 @@
+import os
+import json
+
+import pytest
+
+from unity_app_generator.state import ApplicationState, ApplicationStateError, ApplicationStateConflictError, STORE_BASENAME, VERSION_KEY
+
+@pytest.fixture
+def state_directory(tmp_path):
+    "State directory initialized by one instance, other instances open it as separate steps would"
+
+    state_dir = str(tmp_path / ".unity_app_gen")
+
+    ApplicationState(state_dir, app_base_path=str(tmp_path), source_repository="https://github.com/unity-sds/example.git")
+
+    return state_dir
+
+def stored_values(state_directory):
+
+    with open(os.path.join(state_directory, STORE_BASENAME)) as store_file:
+        return json.load(store_file)
+
+def test_missing_app_base_path(tmp_path):
+
+    with pytest.raises(ApplicationStateError, match="app_base_path must be supplied"):
+        ApplicationState(str(tmp_path / ".unity_app_gen"))
+
+def test_version_increments(state_directory):
+
+    app_state = ApplicationState(state_directory)
+    initial_version = app_state.version
+
+    app_state.docker_url = "registry.example.com/app:1234"
+    assert app_state.version == initial_version + 1
+
+    # Unchanged values are not written
+    app_state.docker_url = "registry.example.com/app:1234"
+    assert app_state.version == initial_version + 1
+
+    with app_state.batch():
+        app_state.docker_image_tag = "1234"
+        app_state.docker_image_digest = "sha256:abcd"
+
+    assert app_state.version == initial_version + 2
+    assert stored_values(state_directory)[VERSION_KEY] == initial_version + 2
+
+def test_merge_disjoint_values(state_directory):
+
+    state_a = ApplicationState(state_directory)
+    state_b = ApplicationState(state_directory)
+
+    state_a.docker_url = "registry.example.com/app:1234"
+    state_b.cwl_output_path = "/outputs/cwl"
+
+    # The second write merges in the value written by the first
+    assert state_b.docker_url == "registry.example.com/app:1234"
+
+    reread_state = ApplicationState(state_directory)
+    assert reread_state.docker_url == "registry.example.com/app:1234"
+    assert reread_state.cwl_output_path == "/outputs/cwl"
+    assert reread_state.version == state_b.version
+
+def test_merge_disjoint_dictionary_keys(state_directory):
+
+    state_a = ApplicationState(state_directory)
+    state_b = ApplicationState(state_directory)
+
+    state_a.stage_records = { "build_docker": { "status": "success" } }
+    state_b.stage_records = { "build_cwl": { "status": "running" } }
+
+    expected_records = { "build_docker": { "status": "success" }, "build_cwl": { "status": "running" } }
+
+    assert state_b.stage_records == expected_records
+    assert ApplicationState(state_directory).stage_records == expected_records
+
+def test_conflicting_dictionary_key(state_directory):
+
+    state_a = ApplicationState(state_directory)
+    state_b = ApplicationState(state_directory)
+
+    state_a.stage_records = { "build_docker": { "status": "success" } }
+
+    with pytest.raises(ApplicationStateConflictError, match="stage_records"):
+        state_b.stage_records = { "build_docker": { "status": "error" } }
+
+    # The value written first is kept
+    assert ApplicationState(state_directory).stage_records == { "build_docker": { "status": "success" } }
+
+def test_conflicting_value(state_directory):
+
+    state_a = ApplicationState(state_directory)
+    state_b = ApplicationState(state_directory)
+
+    state_a.docker_url = "registry.example.com/app:1234"
+
+    with pytest.raises(ApplicationStateConflictError, match="docker_url"):
+        state_b.docker_url = "other.example.com/app:1234"
+
+def test_same_change_is_not_a_conflict(state_directory):
+
+    state_a = ApplicationState(state_directory)
+    state_b = ApplicationState(state_directory)
+
+    state_a.docker_url = "registry.example.com/app:1234"
+    state_b.docker_url = "registry.example.com/app:1234"
+
+    assert ApplicationState(state_directory).docker_url == "registry.example.com/app:1234"
+
+def test_reload_keeps_unwritten_changes(state_directory):
+
+    state_a = ApplicationState(state_directory)
+    state_b = ApplicationState(state_directory)
+
+    with state_b.batch():
+        state_b.docker_image_tag = "local"
+
+        state_a.docker_url = "registry.example.com/app:1234"
+
+        state_b.reload()
+
+        assert state_b.docker_url == "registry.example.com/app:1234"
+        assert state_b.docker_image_tag == "local"
+        assert state_b.version == state_a.version
+
+        # Nothing was written by reloading
+        assert stored_values(state_directory)["docker_image_tag"] is None
+
+    reread_state = ApplicationState(state_directory)
+    assert reread_state.docker_url == "registry.example.com/app:1234"
+    assert reread_state.docker_image_tag == "local"
+    assert reread_state.version == state_a.version + 1
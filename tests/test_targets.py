@@ -0,0 +1,101 @@
+import os
+import json
+
+import pytest
+
+from unity_app_generator.targets import BuildTarget, BuildTargetError, parse_build_targets
+from unity_app_generator.generator import UnityApplicationGenerator
+
+def test_parse_build_targets():
+
+    targets = parse_build_targets([ "linux/amd64", "linux/arm64/v8", "gpu=linux/amd64@nvidia/cuda:12.4.1-runtime-ubuntu22.04" ])
+
+    assert [ t.name for t in targets ] == [ "amd64", "arm64v8", "gpu" ]
+    assert [ t.platform for t in targets ] == [ "linux/amd64", "linux/arm64/v8", "linux/amd64" ]
+    assert [ t.in_manifest_list for t in targets ] == [ True, True, False ]
+    assert targets[2].base_image == "nvidia/cuda:12.4.1-runtime-ubuntu22.04"
+    assert targets[0].image_reference("app:1234") == "app:1234-amd64"
+
+    assert BuildTarget.from_dict(targets[2].to_dict()).to_dict() == targets[2].to_dict()
+
+@pytest.mark.parametrize("target_specs", [
+    [ "windows/amd64" ],
+    [ "linux" ],
+    [ "linux/amd64", "amd64=linux/arm64" ],
+    [ "gpu=linux/amd64@nvidia/cuda" ],
+    [ "linux/amd64", "x86=linux/amd64" ],
+])
+def test_parse_build_targets_errors(target_specs):
+
+    with pytest.raises(BuildTargetError):
+        parse_build_targets(target_specs)
+
+def stage_metrics(state_directory, stage_name):
+    "Metrics of the last timeline record of a stage"
+
+    with open(os.path.join(state_directory, "timeline.jsonl")) as timeline_file:
+        records = [ json.loads(line) for line in timeline_file ]
+
+    return [ r for r in records if r["stage"] == stage_name ][-1]
+
+@pytest.fixture
+def events():
+    return []
+
+@pytest.fixture
+def target_generator(tmp_path, fake_docker, source_repository, events):
+    from tests.fakes import FakeDockerUtil
+
+    state_directory = str(tmp_path / "app" / ".unity_app_gen")
+
+    return UnityApplicationGenerator(state_directory, source_repository, str(tmp_path / "app"),
+                                     event_callback=events.append, docker_util_factory=FakeDockerUtil)
+
+TARGET_SPECS = [ "linux/amd64", "linux/arm64", "gpu=linux/amd64@nvidia/cuda:12.4.1-runtime-ubuntu22.04" ]
+
+def test_build_targets(target_generator, fake_docker):
+    from tests.fakes import FakeDockerUtil
+
+    target_generator.create_docker_image(targets=TARGET_SPECS)
+
+    image_reference = target_generator.app_state.docker_image_reference
+    docker_targets = target_generator.app_state.docker_targets
+
+    assert list(docker_targets.keys()) == [ "amd64", "arm64", "gpu" ]
+
+    for name, target in docker_targets.items():
+        assert target["image_reference"] == f"{image_reference}-{name}"
+        assert fake_docker.images.get(target["image_reference"]) is not None
+
+    # Each concurrent target build adds its steps to the stage metrics
+    metrics = stage_metrics(target_generator.app_state.state_directory, "create_docker_image")
+    assert metrics["build_steps"] == len(TARGET_SPECS) * FakeDockerUtil.build_steps
+
+def test_push_targets_manifest_list(target_generator, fake_docker, events):
+
+    target_generator.create_docker_image(targets=TARGET_SPECS)
+    target_generator.push_to_docker_registry("registry.example.com")
+
+    app_state = target_generator.app_state
+    docker_targets = app_state.docker_targets
+
+    for name, target in docker_targets.items():
+        assert target["docker_url"] == f"registry.example.com/{target['image_reference']}"
+        assert target["docker_url"] in fake_docker.images.remote
+
+    # The manifest list under the application image only combines targets with the default base image
+    assert app_state.docker_url == f"registry.example.com/{app_state.docker_image_reference}"
+    assert app_state.docker_image_digest == fake_docker.images.remote[app_state.docker_url]
+
+    manifest_events = [ e for e in events if e["event"] == "manifest_complete" ]
+    assert len(manifest_events) == 1
+    assert manifest_events[0]["sources"] == [ docker_targets[name]["docker_url"] for name in ("amd64", "arm64") ]
+
+    # The totals of each concurrent target push add up in the stage metrics
+    push_events = [ e for e in events if e["event"] == "push_complete" ]
+    assert sorted([ e["target"] for e in push_events ]) == sorted(docker_targets.keys())
+
+    metrics = stage_metrics(app_state.state_directory, "push_to_docker_registry")
+
+    for metric_name in ("bytes_pushed", "layers_pushed", "layers_skipped"):
+        assert metrics[metric_name] == sum([ e[metric_name] for e in push_events ])
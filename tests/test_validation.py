@@ -0,0 +1,168 @@
+import os
+import hashlib
+from unittest import mock
+
+import pytest
+
+from unity_app_generator import validation
+from unity_app_generator.generator import ApplicationGenerationError
+from unity_app_generator.validation import check_file, check_package, PackageValidator
+
+from tests.test_fingerprint import create_generator
+
+TOOL_CWL = """
+cwlVersion: v1.2
+class: CommandLineTool
+baseCommand: papermill
+inputs:
+  input: Directory
+outputs:
+  output:
+    type: Directory
+    outputBinding:
+      glob: $(runtime.outdir)
+requirements:
+  DockerRequirement:
+    dockerPull: app:v1
+"""
+
+WORKFLOW_CWL = """
+cwlVersion: v1.2
+class: Workflow
+inputs:
+  input: Directory
+outputs:
+  result:
+    type: Directory
+    outputSource: process/output
+steps:
+  process:
+    run: {run}
+    in:
+      input: {source}
+    out: [ {out} ]
+"""
+
+def workflow_cwl(run="process.cwl", source="input", out="output"):
+    return WORKFLOW_CWL.format(run=run, source=source, out=out)
+
+def summaries(directory, file_contents):
+
+    file_summaries = {}
+    for basename, contents in file_contents.items():
+        issues, file_summaries[os.path.join(directory, basename)] = check_file(basename, contents)
+        assert issues == []
+
+    return file_summaries
+
+def messages(issues):
+    return [ issue["message"] for issue in issues ]
+
+def test_check_file():
+
+    issues, summary = check_file("process.cwl", TOOL_CWL)
+
+    assert issues == []
+    assert (summary["class"], summary["outputs"], summary["docker_pull"]) == ("CommandLineTool", [ "output" ], "app:v1")
+
+    issues, summary = check_file("process.cwl", TOOL_CWL + "unknownField: 1\n")
+    assert messages(issues) == [ "Unknown field unknownField, fields of extensions need a namespace prefix" ]
+
+    # Extension fields with a namespace prefix are allowed
+    assert check_file("process.cwl", TOOL_CWL + "cwltool:extra: 1\n")[0] == []
+
+def test_unparsable_files():
+
+    issues, summary = check_file("process.cwl", "class: [ CommandLineTool")
+    assert summary is None and messages(issues)[0].startswith("Invalid YAML")
+
+    issues, summary = check_file("applicationDescriptor.json", "{ \"processDescription\": ")
+    assert summary is None and messages(issues)[0].startswith("Invalid JSON")
+
+    issues, summary = check_file("process.cwl", "- CommandLineTool")
+    assert messages(issues) == [ "Document is not a mapping" ]
+
+def test_dockstore_cwl():
+
+    assert check_file("Dockstore.cwl", "class: Workflow\nsteps:\n  step:\n    run: workflow.cwl\n") == ([], { "class": "Dockstore", "run": "workflow.cwl" })
+
+    issues, summary = check_file("Dockstore.cwl", "class: Workflow\nsteps: {}\n")
+    assert summary is None and messages(issues) == [ "No entry point CWL file given by step run" ]
+
+def test_check_package():
+
+    valid_files = { "process.cwl": TOOL_CWL, "workflow.cwl": workflow_cwl(), "Dockstore.cwl": "steps:\n  step:\n    run: workflow.cwl\n" }
+    assert check_package("app", summaries("app", valid_files)) == {}
+
+    def workflow_messages(**kwargs):
+        package_issues = check_package("app", summaries("app", { **valid_files, "workflow.cwl": workflow_cwl(**kwargs) }))
+        return messages(package_issues["app/workflow.cwl"])
+
+    assert workflow_messages(run="missing.cwl") == [ "Step runs missing.cwl which is not a generated file" ]
+    assert workflow_messages(source="other") == [ "Source other is not a workflow input" ]
+    assert workflow_messages(out="result") == [ "Step output result is not an output of process.cwl",
+                                                "Source process/output is not an output of step process" ]
+
+    # The entry point of Dockstore is looked up in the same application directory
+    package_issues = check_package("app", summaries("app", { **valid_files, "Dockstore.cwl": "steps:\n  step:\n    run: other.cwl\n" }))
+    assert messages(package_issues["app/Dockstore.cwl"]) == [ "Entry point other.cwl is not a generated file" ]
+
+def test_memoized_results(tmp_path):
+
+    file_contents = { "a/process.cwl": TOOL_CWL, "b/process.cwl": TOOL_CWL, "a/workflow.cwl": workflow_cwl(), "b/workflow.cwl": workflow_cwl() }
+    file_hashes = { relpath: hashlib.sha256(contents.encode()).hexdigest() for relpath, contents in file_contents.items() }
+
+    reads = []
+    def read_contents(relpaths):
+        reads.extend(relpaths)
+        return { relpath: file_contents[relpath] for relpath in relpaths }
+
+    issues, num_memoized = PackageValidator(cache_directory=str(tmp_path)).validate(file_hashes, read_contents)
+
+    # Files with the same contents in different applications are read once
+    assert (issues, num_memoized) == ([], 0)
+    assert sorted(reads) == [ "a/process.cwl", "a/workflow.cwl" ]
+
+    reads.clear()
+    issues, num_memoized = PackageValidator(cache_directory=str(tmp_path)).validate(file_hashes, read_contents)
+
+    assert (issues, num_memoized) == ([], len(file_hashes))
+    assert reads == []
+
+    # Results memoized by other versions of the checks are not used
+    with mock.patch.object(validation, "checks_fingerprint", return_value="other"):
+        PackageValidator(cache_directory=str(tmp_path)).validate(file_hashes, read_contents)
+
+    assert len(reads) == 2
+
+def test_validate_generated_files(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository, [])
+
+    with pytest.raises(ApplicationGenerationError, match="run build_cwl first"):
+        generator.validate_cwl()
+
+    generator.create_docker_image()
+    generator.create_cwl()
+
+    issues = generator.validate_cwl()
+    assert [ issue for issue in issues if issue["severity"] == "error" ] == []
+
+    # Unchanged files are not checked again
+    with mock.patch.object(PackageValidator, "validate") as validate:
+        assert create_generator(tmp_path, source_repository, []).validate_cwl() == []
+
+    validate.assert_not_called()
+
+def test_invalid_generated_file(tmp_path, fake_docker, source_repository):
+
+    generator = create_generator(tmp_path, source_repository, [])
+    generator.create_docker_image()
+    generator.create_cwl()
+    generator.validate_cwl()
+
+    with open(os.path.join(generator.app_state.cwl_output_path, "process.cwl"), "a") as cwl_file:
+        cwl_file.write("unknownField: 1\n")
+
+    with pytest.raises(ApplicationGenerationError, match="process.cwl: error: Unknown field unknownField"):
+        generator.validate_cwl()
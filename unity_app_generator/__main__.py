@@ -19,6 +19,8 @@ from argparse import ArgumentParser
 from unity_app_generator.generator import ApplicationGenerationError
 
 from . import interface
+from .image_optimize import LAZY_PULL_FORMATS
+from .events import JSONEventWriter, LogEventRenderer
 
 logger = logging.getLogger()
 
@@ -31,6 +33,15 @@ def main():
     parser.add_argument("--verbose", "-v", action="store_true", default=False,
         help=f"Enable verbose logging")
 
+    parser.add_argument("--profile", action="store_true", default=False,
+        help=f"Write cProfile statistics for the Python side of each step into the profile subdirectory of the state directory")
+
+    parser.add_argument("--json_events", "--json-events", action="store_true", default=False,
+        help=f"Write Docker build and push progress events to standard output as JSON lines instead of logging them")
+
+    parser.add_argument("--stall_timeout", type=float,
+        help=f"Abort Docker pushes that receive no progress from the registry for this many seconds")
+
     # init
     subparsers = parser.add_subparsers(required=True)
 
@@ -46,6 +57,14 @@ def main():
     parser_init.add_argument("-c", "--checkout", required=False,
         help="Git hash, tag or branch to checkout from the source repository")
 
+    init_clone_group = parser_init.add_mutually_exclusive_group()
+
+    init_clone_group.add_argument("--shallow", action="store_true",
+        help="Clone a remote source repository with only the history of the requested checkout")
+
+    init_clone_group.add_argument("--git_mirror", action="store_true",
+        help="Keep a bare mirror of a remote source repository in the user cache directory and use it as a reference when cloning to avoid refetching objects")
+
     parser_init.set_defaults(func=interface.init)
 
     # build_docker
@@ -65,6 +84,30 @@ def main():
     parser_build_docker.add_argument("-c", "--config_file",
         help="JSON or Python Traitlets style config file for repo2docker. Use 'repo2docker --help-all' to see configurable options.")
 
+    parser_build_docker.add_argument("--target", dest="targets", action="append",
+        help="Build an image for a target given as [name=]platform[@base_image], for example linux/arm64 or gpu=linux/amd64@nvidia/cuda:12.4.1-runtime-ubuntu22.04. Repeat to build several targets concurrently, targets with the default base image are pushed as one multi-architecture manifest list")
+
+    parser_build_docker.add_argument("--cache_from", action="append",
+        help="Image to use as a layer cache source for the build, may be repeated. By default the images from the previous build and push are used")
+
+    parser_build_docker.add_argument("--no_env_cache", dest="env_cache", action="store_false",
+        help="Do not reuse or record local images by the hash of their environment files")
+
+    parser_build_docker.add_argument("--slim", action="store_true",
+        help="Remove content only needed for the build, such as the .git directory, from the image layers into an optimized image that is pushed instead")
+
+    parser_build_docker.add_argument("--lazy_pull", dest="lazy_format", choices=LAZY_PULL_FORMATS,
+        help="Convert the image into a lazily pullable format with nerdctl so containers can start before the image is fully pulled, requires the Docker containerd image store")
+
+    parser_build_docker.add_argument("--build_queue",
+        help="Directory of a build queue shared with build_worker processes on builder nodes. The image is built and later pushed by one of the workers instead of the local Docker daemon")
+
+    parser_build_docker.add_argument("--build_timeout", type=float,
+        help="Seconds to wait for a build worker to build or push the image when using --build_queue, by default there is no limit")
+
+    parser_build_docker.add_argument("--force", action="store_true",
+        help="Build the Docker image even if the source has not changed since the last build")
+
     parser_build_docker.set_defaults(func=interface.build_docker)
 
     # push_docker
@@ -75,6 +118,9 @@ def main():
     parser_push_docker.add_argument("container_registry", 
         help="URL or Dockerhub username of a Docker registry for pushing of the built image")
 
+    parser_push_docker.add_argument("--force", action="store_true",
+        help="Push the Docker image even if the registry already contains the same image digest")
+
     parser_push_docker.set_defaults(func=interface.push_docker)
 
     # push_ecr
@@ -82,6 +128,9 @@ def main():
     parser_push_ecr = subparsers.add_parser('push_ecr',
         help=f"Push a Docker image from the initialized application directory to an AWS Elastic Container Registry (ECR)")
 
+    parser_push_ecr.add_argument("--force", action="store_true",
+        help="Push the Docker image even if ECR already contains the same image digest")
+
     parser_push_ecr.set_defaults(func=interface.push_ecr)
 
     # notebook_parameters
@@ -89,6 +138,9 @@ def main():
     parser_parameters = subparsers.add_parser('parameters',
         help=f"Display parsed notebook parameters")
 
+    parser_parameters.add_argument("--notebook", dest="notebooks", action="append",
+        help="Notebook path or glob pattern relative to the repository to display the parameters of, may be repeated. By default the notebooks last used by build_cwl or those it would discover are displayed")
+
     parser_parameters.set_defaults(func=interface.notebook_parameters)
 
     # build_cwl
@@ -105,8 +157,30 @@ def main():
     parser_build_cwl.add_argument("--monolithic", action="store_true",
         help="Use the deprecated 'monolithic' approach to generating CWL where stage in and out are bundled inside the application")
 
+    parser_build_cwl.add_argument("--notebook", dest="notebooks", action="append",
+        help="Notebook path or glob pattern relative to the repository to generate an application from, may be repeated. By default process.ipynb is used, or if it does not exist every notebook with a cell tagged parameters")
+
+    parser_build_cwl.add_argument("--bundle", action="store_true",
+        help="Store the CWL files compressed in the artifact cache, listed by a single bundle manifest, instead of the CWL output directory")
+
+    parser_build_cwl.add_argument("--artifact_cache",
+        help="Directory of the artifact cache used with --bundle, may be shared between applications, default: ~/.cache/unity_app_generator/artifacts")
+
+    parser_build_cwl.add_argument("--force", action="store_true",
+        help="Regenerate CWL files even if the notebook, image URL and options have not changed")
+
     parser_build_cwl.set_defaults(func=interface.build_cwl)
 
+    # validate_cwl
+
+    parser_validate_cwl = subparsers.add_parser('validate_cwl',
+        help=f"Check the generated CWL files and application descriptors locally before pushing them to the application registry")
+
+    parser_validate_cwl.add_argument("--force", action="store_true",
+        help="Check the files even if they have not changed since they last passed validation")
+
+    parser_validate_cwl.set_defaults(func=interface.validate_cwl)
+
     # push_app_registry
 
     parser_app_registry = subparsers.add_parser('push_app_registry',
@@ -118,17 +192,207 @@ def main():
     parser_app_registry.add_argument("--token", dest="dockstore_token", required=True,
         help="Dockstore API token obtained from the My Services / Account page") 
 
+    parser_app_registry.add_argument("--force", action="store_true",
+        help="Upload all files even if they have not changed since the last upload")
+
     parser_app_registry.set_defaults(func=interface.push_app_registry)
 
+    # all
+
+    parser_all = subparsers.add_parser('all',
+        help=f"Run init, build_docker, push_docker or push_ecr, build_cwl, validate_cwl and push_app_registry in a single process")
+
+    parser_all.add_argument("source_repository",
+        help="Directory or Git URL of application source files")
+
+    parser_all.add_argument("destination_directory", nargs="?",
+        help="Directory where to check out source repository, default is a directory under the current subdirectory with same basename as the source_repository")
+
+    parser_all.add_argument("-c", "--checkout", required=False,
+        help="Git hash, tag or branch to checkout from the source repository")
+
+    all_clone_group = parser_all.add_mutually_exclusive_group()
+
+    all_clone_group.add_argument("--shallow", action="store_true",
+        help="Clone a remote source repository with only the history of the requested checkout")
+
+    all_clone_group.add_argument("--git_mirror", action="store_true",
+        help="Keep a bare mirror of a remote source repository in the user cache directory and use it as a reference when cloning to avoid refetching objects")
+
+    parser_all.add_argument("-n", "--image_namespace",
+        help="Docker image namespace to use instead of the automatically generated one from the Git repository owner. An empty string removes the namespace from the image reference.")
+
+    parser_all.add_argument("-r", "--image_repository",
+        help="Docker image repository to use instead of the automatically generated one from the Git repository name.")
+
+    parser_all.add_argument("-t", "--image_tag",
+        help="Docker image tag to use instead of the automatically generated one from the Git commit id")
+
+    parser_all.add_argument("--config_file",
+        help="JSON or Python Traitlets style config file for repo2docker. Use 'repo2docker --help-all' to see configurable options.")
+
+    parser_all.add_argument("--target", dest="targets", action="append",
+        help="Build an image for a target given as [name=]platform[@base_image], for example linux/arm64 or gpu=linux/amd64@nvidia/cuda:12.4.1-runtime-ubuntu22.04. Repeat to build several targets concurrently, targets with the default base image are pushed as one multi-architecture manifest list")
+
+    parser_all.add_argument("--cache_from", action="append",
+        help="Image to use as a layer cache source for the build, may be repeated. By default the images from the previous build and push are used")
+
+    parser_all.add_argument("--no_env_cache", dest="env_cache", action="store_false",
+        help="Do not reuse or record local images by the hash of their environment files")
+
+    parser_all.add_argument("--slim", action="store_true",
+        help="Remove content only needed for the build, such as the .git directory, from the image layers into an optimized image that is pushed instead")
+
+    parser_all.add_argument("--lazy_pull", dest="lazy_format", choices=LAZY_PULL_FORMATS,
+        help="Convert the image into a lazily pullable format with nerdctl so containers can start before the image is fully pulled, requires the Docker containerd image store")
+
+    parser_all.add_argument("--build_queue",
+        help="Directory of a build queue shared with build_worker processes on builder nodes. The image is built and later pushed by one of the workers instead of the local Docker daemon")
+
+    parser_all.add_argument("--build_timeout", type=float,
+        help="Seconds to wait for a build worker to build or push the image when using --build_queue, by default there is no limit")
+
+    push_group = parser_all.add_mutually_exclusive_group()
+
+    push_group.add_argument("--container_registry",
+        help="URL or Dockerhub username of a Docker registry for pushing of the built image, the push is skipped if neither this or --ecr is supplied")
+
+    push_group.add_argument("--ecr", dest="use_ecr", action="store_true",
+        help="Push the built image to an AWS Elastic Container Registry (ECR)")
+
+    parser_all.add_argument("-o", "--cwl_output_path",
+        help="Alternate location to place CWL output files other than within application state directory")
+
+    parser_all.add_argument("--monolithic", action="store_true",
+        help="Use the deprecated 'monolithic' approach to generating CWL where stage in and out are bundled inside the application")
+
+    parser_all.add_argument("--notebook", dest="notebooks", action="append",
+        help="Notebook path or glob pattern relative to the repository to generate an application from, may be repeated. By default process.ipynb is used, or if it does not exist every notebook with a cell tagged parameters")
+
+    parser_all.add_argument("--bundle", action="store_true",
+        help="Store the CWL files compressed in the artifact cache, listed by a single bundle manifest, instead of the CWL output directory")
+
+    parser_all.add_argument("--artifact_cache",
+        help="Directory of the artifact cache used with --bundle, may be shared between applications, default: ~/.cache/unity_app_generator/artifacts")
+
+    parser_all.add_argument("--no_validate", dest="validate", action="store_false",
+        help="Do not check the generated CWL files before pushing them to the application registry")
+
+    parser_all.add_argument("--api_url", dest="dockstore_api_url",
+        help="Dockstore API URL including the trailing api/ portion of the URL, the application registry push is skipped if not supplied")
+
+    parser_all.add_argument("--token", dest="dockstore_token",
+        help="Dockstore API token obtained from the My Services / Account page")
+
+    parser_all.set_defaults(func=interface.run_pipeline)
+
+    # resume
+
+    parser_resume = subparsers.add_parser('resume',
+        help=f"Run again the steps that failed or whose inputs changed since they last completed, using the arguments they were run with")
+
+    parser_resume.add_argument("--token", dest="dockstore_token",
+        help="Dockstore API token, required when the push_app_registry step needs to run again since tokens are not recorded")
+
+    parser_resume.set_defaults(func=interface.resume)
+
+    # batch
+
+    parser_batch = subparsers.add_parser('batch',
+        help=f"Run the same steps as the all command for multiple applications listed in a YAML or JSON manifest file concurrently")
+
+    parser_batch.add_argument("manifest",
+        help="YAML or JSON file with an applications list of per application arguments named as in the programmatic interface and an optional defaults dictionary")
+
+    parser_batch.add_argument("--max_workers", type=int, default=4,
+        help="Maximum number of applications processed at the same time")
+
+    parser_batch.add_argument("--max_builds", type=int, default=1,
+        help="Maximum number of Docker image builds running at the same time")
+
+    parser_batch.add_argument("--max_transfers", type=int, default=4,
+        help="Maximum number of Docker pushes and application registry uploads running at the same time")
+
+    parser_batch.set_defaults(func=interface.batch, raise_on_failure=True)
+
+    # serve
+
+    parser_serve = subparsers.add_parser('serve',
+        help=f"Run a long lived build server that accepts jobs for the other commands over a local HTTP API")
+
+    parser_serve.add_argument("--host", default="127.0.0.1",
+        help="Address to listen on, default: 127.0.0.1. Addresses other than loopback require --auth_token_file")
+
+    parser_serve.add_argument("--port", type=int, default=8765,
+        help="Port to listen on, default: 8765")
+
+    parser_serve.add_argument("--socket", dest="socket_path",
+        help="Listen on a Unix domain socket at this path instead of a TCP port")
+
+    parser_serve.add_argument("--max_workers", type=int, default=4,
+        help="Maximum number of jobs processed at the same time")
+
+    parser_serve.add_argument("--max_builds", type=int, default=1,
+        help="Maximum number of Docker image builds running at the same time")
+
+    parser_serve.add_argument("--max_transfers", type=int, default=4,
+        help="Maximum number of Docker pushes and application registry uploads running at the same time")
+
+    parser_serve.add_argument("--max_finished_jobs", type=int, default=100,
+        help="Number of finished jobs whose status and logs are kept, older jobs are removed")
+
+    parser_serve.add_argument("--auth_token_file",
+        help="File holding a token that clients must send in an 'Authorization: Bearer <token>' header")
+
+    parser_serve.set_defaults(func=interface.serve)
+
+    # build_worker
+
+    parser_build_worker = subparsers.add_parser('build_worker',
+        help=f"Run build and push jobs submitted with --build_queue using the Docker daemon of this host")
+
+    parser_build_worker.add_argument("queue_directory",
+        help="Build queue directory shared with the hosts submitting jobs")
+
+    parser_build_worker.add_argument("--work_directory",
+        help="Directory for the source checkouts and state of jobs, default: ~/.cache/unity_app_generator/build_worker")
+
+    parser_build_worker.add_argument("--worker_id",
+        help="Name of this worker in the queue, default is the host name. Keep it the same across restarts so jobs are still placed where the layer cache is warm")
+
+    parser_build_worker.add_argument("--max_jobs", type=int, default=1,
+        help="Maximum number of jobs run at the same time")
+
+    parser_build_worker.add_argument("--affinity_wait", type=float,
+        help="Seconds a job waits for the worker with a warm cache for it before this worker takes it, default: 10")
+
+    worker_clone_group = parser_build_worker.add_mutually_exclusive_group()
+
+    worker_clone_group.add_argument("--shallow", action="store_true",
+        help="Clone source repositories with only the history of the commit being built")
+
+    worker_clone_group.add_argument("--git_mirror", action="store_true",
+        help="Keep bare mirrors of remote source repositories in the user cache directory and use them as references when cloning")
+
+    parser_build_worker.set_defaults(func=interface.build_worker)
+
     # Process arguments
 
     args = parser.parse_args()
 
+    if getattr(args, "dockstore_api_url", None) is not None and args.dockstore_token is None:
+        parser.error("--token is required when --api_url is supplied")
+
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
+    if args.json_events:
+        args.event_callback = JSONEventWriter()
+    else:
+        args.event_callback = LogEventRenderer()
+
     try:
         args.func(**vars(args))
     except ApplicationGenerationError as err:
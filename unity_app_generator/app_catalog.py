@@ -0,0 +1,99 @@
+import json
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from unity_sds_client.services.application_service import DockstoreAppCatalog, ApplicationCatalogAccessError, \
+    DockstoreFileType, DockstoreJSONFileType, CWL_VALUE
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of connections kept open to the Dockstore API
+DOCKSTORE_POOL_SIZE = 10
+
+class PooledDockstoreAppCatalog(DockstoreAppCatalog):
+    """
+    DockstoreAppCatalog that sends requests through a requests.Session so that
+    connections to the Dockstore API are pooled and reused between requests
+    """
+
+    def __init__(self, api_url, token, session=None):
+
+        super().__init__(api_url, token)
+
+        if session is None:
+            session = requests.Session()
+
+            adapter = HTTPAdapter(pool_connections=DOCKSTORE_POOL_SIZE, pool_maxsize=DOCKSTORE_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+        self.session = session
+
+    def _request(self, method, request_url, ok_status=(200,), **kwargs):
+
+        request_url = request_url.strip("/")
+
+        response = self.session.request(method, f"{self.api_url}/{request_url}", **kwargs)
+
+        if response.status_code not in ok_status:
+            raise ApplicationCatalogAccessError(
+                f"{method} operation to application catalog at {self.api_url}/{request_url} return unexpected status code: {response.status_code} with message: {response.content}"
+            )
+
+        return response
+
+    def _get(self, request_url, params=None):
+
+        return self._request("GET", request_url, headers=self._headers, params=params)
+
+    def _get_zip(self, request_url):
+
+        return self._request("GET", request_url, headers=self._zip_headers)
+
+    def _post(self, request_url, params=None, data=None):
+
+        if data is not None:
+            data = json.dumps(data)
+
+        return self._request("POST", request_url, headers=self._headers, params=params, data=data)
+
+    def _patch(self, request_url, data):
+
+        # 204 indicates that no action was taken
+        return self._request("PATCH", request_url, ok_status=(200, 204), headers=self._headers, data=json.dumps(data))
+
+    def _delete(self, request_url):
+
+        return self._request("DELETE", request_url, ok_status=(200, 204), headers=self._headers)
+
+    def upload_contents(self, application, cwl_contents={}, json_contents={}):
+        """
+        Upload workflow parameter files given as dictionaries of Dockstore paths and file contents
+        in a single request, like upload_files does for local files
+        """
+
+        app_type = application.workflow_type
+
+        params = []
+        for contents, file_type in ((cwl_contents, DockstoreFileType[app_type]), (json_contents, DockstoreJSONFileType[app_type])):
+            for dockstore_path, file_contents in contents.items():
+                params.append({ **DockstoreAppCatalog._file_to_json(None, dockstore_path, file_type), "content": file_contents })
+
+        if len(params) > 0:
+            self._patch(f"/workflows/hostedEntry/{application.id}", params)
+
+    def register_contents(self, app_name, cwl_contents={}, json_contents={}, publish=True):
+        "Register a new hosted workflow with files given as contents, like register does for local files"
+
+        response = self._post("/workflows/hostedEntry", { "name": app_name, "descriptorType": CWL_VALUE })
+
+        new_app = self._application_from_json(response.json())
+
+        self.upload_contents(new_app, cwl_contents, json_contents)
+
+        if publish:
+            self._publish(new_app.id, publish)
+
+        return self.application(new_app.id)
@@ -0,0 +1,47 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Repository of the local tags that make up the environment image store
+ENVIRONMENT_IMAGE_REPOSITORY = "unity-app-gen-env"
+
+class EnvironmentImageStore(object):
+    """
+    Local store of built images indexed by the fingerprint of the environment files they were
+    built from. Images are kept as tags in the local Docker daemon, so the store takes no extra
+    disk space beyond keeping the layers. A build whose environment files match a stored image
+    uses it as a layer cache source, so only the layers adding the application are rebuilt.
+    Stored images can be removed with 'docker image rm' to reclaim space.
+    """
+
+    def __init__(self, docker_client):
+
+        self.docker_client = docker_client
+
+    def image_reference(self, env_fingerprint):
+
+        return f"{ENVIRONMENT_IMAGE_REPOSITORY}:{env_fingerprint[:32]}"
+
+    def find(self, env_fingerprint):
+        "Return the reference of the stored image for env_fingerprint or None if there is none"
+        import docker.errors
+
+        env_image_reference = self.image_reference(env_fingerprint)
+
+        try:
+            self.docker_client.images.get(env_image_reference)
+        except docker.errors.NotFound:
+            return None
+
+        return env_image_reference
+
+    def store(self, env_fingerprint, image_reference):
+        "Record the local image image_reference as built from the environment with env_fingerprint"
+
+        env_image_reference = self.image_reference(env_fingerprint)
+
+        logger.debug(f"Storing {image_reference} as environment image {env_image_reference}")
+
+        self.docker_client.images.get(image_reference).tag(ENVIRONMENT_IMAGE_REPOSITORY, env_fingerprint[:32])
+
+        return env_image_reference
@@ -0,0 +1,520 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import user_cache_directory
+from .locking import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Seconds between worker heartbeats, a worker is considered gone after WORKER_TIMEOUT seconds without one
+WORKER_HEARTBEAT_INTERVAL = 5
+WORKER_TIMEOUT = 30
+
+# Seconds a job waits for its preferred worker before any worker may claim it
+AFFINITY_WAIT = 10
+
+# Seconds between checks of the queue directory by workers and submitters
+POLL_INTERVAL = 0.25
+
+# Number of affinity keys of recent builds advertised by a worker
+MAX_AFFINITY_KEYS = 256
+
+QUEUE_SUBDIRECTORIES = [ "pending", "running", "results", "workers" ]
+
+# State values a build job or push job returns to the state directory of the submitter
+BUILD_STATE_VALUES = [ "docker_image_namespace", "docker_image_repository", "docker_image_tag", "docker_image_reference",
+                       "docker_targets", "docker_layer_reports", "docker_optimized_image" ]
+PUSH_STATE_VALUES = [ "docker_url", "docker_pushed_image_id", "docker_image_digest", "docker_targets" ]
+
+class BuildQueueError(Exception):
+    pass
+
+def default_worker_directory():
+    return os.path.join(user_cache_directory(), "build_worker")
+
+class DirectoryBuildQueue(object):
+    """
+    Queue of build jobs kept as JSON files in a directory shared by the hosts submitting jobs and the
+    builder nodes, such as a network file system mount. Jobs move between subdirectories by renaming,
+    which is atomic within a file system, so each job is claimed by exactly one worker:
+
+        pending/<job>.json            waiting for a worker
+        running/<worker>/<job>.json   claimed by a worker
+        results/<job>.json            written by the worker once the job finished
+        workers/<worker>.json         heartbeat, load and affinity keys of each worker
+    """
+
+    def __init__(self, queue_directory):
+
+        self.queue_directory = os.path.realpath(queue_directory)
+
+        for subdirectory in QUEUE_SUBDIRECTORIES:
+            os.makedirs(os.path.join(self.queue_directory, subdirectory), exist_ok=True)
+
+    def _path(self, *parts):
+
+        return os.path.join(self.queue_directory, *parts)
+
+    def _write_json(self, filename, values):
+
+        with atomic_write(filename) as json_file:
+            json.dump(values, json_file, indent=4)
+
+    def _read_json(self, filename):
+        "Contents of a queue file or None when it was moved or removed in the meantime"
+
+        try:
+            with open(filename, "r") as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:
+            return None
+
+    def submit(self, operation, args, affinity_keys=[], preferred_worker=None, pinned_worker=None):
+        """
+        Add a job to the queue and return it. A job with a pinned_worker is only run by that worker,
+        otherwise the preferred_worker gets the first chance to claim it.
+        """
+
+        submitted = time.time()
+
+        job = {
+            # Job file names sort in submission order
+            "id": f"{int(submitted * 1000):015d}-{uuid.uuid4().hex}",
+            "operation": operation,
+            "args": args,
+            "affinity_keys": affinity_keys,
+            "preferred_worker": preferred_worker,
+            "pinned_worker": pinned_worker,
+            "submitted": submitted,
+        }
+
+        self._write_json(self._path("pending", f"{job['id']}.json"), job)
+
+        return job
+
+    def pending_jobs(self):
+        "Jobs waiting for a worker, oldest first"
+
+        jobs = [ self._read_json(filename) for filename in sorted(glob(self._path("pending", "*.json"))) ]
+
+        return [ job for job in jobs if job is not None ]
+
+    def claim(self, job, worker_id):
+        "Move a pending job to the running jobs of a worker, returns False if another worker claimed it first"
+
+        os.makedirs(self._path("running", worker_id), exist_ok=True)
+
+        try:
+            os.rename(self._path("pending", f"{job['id']}.json"), self._path("running", worker_id, f"{job['id']}.json"))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def cancel(self, job_id):
+        "Remove a job that no worker claimed yet, returns False if it was already claimed"
+
+        try:
+            os.remove(self._path("pending", f"{job_id}.json"))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def running_worker(self, job_id):
+        "Id of the worker running a job or None if it is not running"
+
+        running_filenames = glob(self._path("running", "*", f"{job_id}.json"))
+
+        if len(running_filenames) == 0:
+            return None
+
+        return os.path.basename(os.path.dirname(running_filenames[0]))
+
+    def running_jobs(self, worker_id):
+
+        jobs = [ self._read_json(filename) for filename in sorted(glob(self._path("running", worker_id, "*.json"))) ]
+
+        return [ job for job in jobs if job is not None ]
+
+    def complete(self, job, worker_id, values=None, error=None):
+        "Record the outcome of a job run by a worker"
+
+        result = {
+            "id": job["id"],
+            "worker_id": worker_id,
+            "success": error is None,
+            "values": values,
+            "error": error,
+            "finished": time.time(),
+        }
+
+        self._write_json(self._path("results", f"{job['id']}.json"), result)
+
+        try:
+            os.remove(self._path("running", worker_id, f"{job['id']}.json"))
+        except FileNotFoundError:
+            pass
+
+    def result(self, job_id):
+
+        return self._read_json(self._path("results", f"{job_id}.json"))
+
+    def remove_result(self, job_id):
+
+        try:
+            os.remove(self._path("results", f"{job_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def write_worker(self, worker_info):
+
+        self._write_json(self._path("workers", f"{worker_info['worker_id']}.json"), worker_info)
+
+    def worker(self, worker_id):
+
+        return self._read_json(self._path("workers", f"{worker_id}.json"))
+
+    def live_workers(self):
+        "Workers with a recent heartbeat by worker id"
+
+        now = time.time()
+
+        live_workers = {}
+        for filename in glob(self._path("workers", "*.json")):
+            worker_info = self._read_json(filename)
+
+            if worker_info is not None and not worker_info.get("stopped") and now - worker_info["updated"] < WORKER_TIMEOUT:
+                live_workers[worker_info["worker_id"]] = worker_info
+
+        return live_workers
+
+    def wait(self, job, timeout=None):
+        """
+        Wait for a job to finish and return its result. Raises BuildQueueError if the worker running
+        the job or the worker it is pinned to stops sending heartbeats, or after timeout seconds.
+        """
+
+        start_time = time.time()
+        warned_no_workers = False
+
+        while (result := self.result(job["id"])) is None:
+            if timeout is not None and time.time() - start_time > timeout:
+                if self.cancel(job["id"]):
+                    raise BuildQueueError(f"No build worker claimed job {job['id']} within {timeout} seconds")
+                raise BuildQueueError(f"Job {job['id']} did not finish within {timeout} seconds")
+
+            live_workers = self.live_workers()
+
+            if (worker_id := self.running_worker(job["id"])) is not None:
+                if worker_id not in live_workers:
+                    raise BuildQueueError(f"Build worker {worker_id} running job {job['id']} stopped sending heartbeats")
+
+            # Check the result again in case the job finished after the first check
+            elif self.result(job["id"]) is None:
+                if job["pinned_worker"] is not None and job["pinned_worker"] not in live_workers:
+                    self.cancel(job["id"])
+                    raise BuildQueueError(f"Build worker {job['pinned_worker']} holding the image for job {job['id']} is not running")
+
+                if len(live_workers) == 0 and not warned_no_workers:
+                    logger.warning(f"No build workers are serving {self.queue_directory}, waiting for one to start")
+                    warned_no_workers = True
+
+            time.sleep(POLL_INTERVAL)
+
+        self.remove_result(job["id"])
+
+        return result
+
+class QueueBuildExecutor(object):
+    """
+    Runs the build and push jobs of a generator on builder nodes serving a DirectoryBuildQueue.
+    A build job prefers the live worker that advertises the most of its affinity keys, so that
+    repeat builds of a repository or of the same environment files land on the builder whose
+    Docker layer cache and workspace are warm. Without a match the least loaded worker is
+    preferred. Push jobs are pinned to the worker holding the image.
+    """
+
+    def __init__(self, queue_directory, timeout=None):
+
+        self.queue = DirectoryBuildQueue(queue_directory)
+        self.timeout = timeout
+
+    @property
+    def queue_directory(self):
+        return self.queue.queue_directory
+
+    def place(self, affinity_keys):
+        "Id of the live worker to prefer for a job with affinity_keys, or None if there is none"
+
+        live_workers = self.queue.live_workers()
+
+        if len(live_workers) == 0:
+            return None
+
+        def placement_score(worker_info):
+            matches = len(set(affinity_keys) & set(worker_info.get("affinity_keys", [])))
+            load = worker_info.get("running", 0) / max(worker_info.get("max_jobs", 1), 1)
+            return (matches, -load)
+
+        return max(live_workers.values(), key=placement_score)["worker_id"]
+
+    def run(self, operation, args, affinity_keys=[], pinned_worker=None):
+        "Run a job on a worker and return the id of the worker and the values it returned"
+
+        preferred_worker = self.place(affinity_keys) if pinned_worker is None else None
+
+        job = self.queue.submit(operation, args, affinity_keys=affinity_keys, preferred_worker=preferred_worker, pinned_worker=pinned_worker)
+
+        logger.info(f"Queued {operation} job {job['id']} in {self.queue_directory}" +
+                    (f", preferring worker {preferred_worker}" if preferred_worker is not None else ""))
+
+        result = self.queue.wait(job, timeout=self.timeout)
+
+        if not result["success"]:
+            raise BuildQueueError(f"{operation.capitalize()} job {job['id']} failed on worker {result['worker_id']}: {result['error']}")
+
+        logger.info(f"{operation.capitalize()} job {job['id']} finished on worker {result['worker_id']}")
+
+        return result["worker_id"], result["values"]
+
+class BuildWorker(object):
+    """
+    Runs build and push jobs from a DirectoryBuildQueue on a builder node with its own Docker daemon.
+    Each job works in a workspace under work_directory named by the source repository and commit, which
+    holds a clone of the source and a state directory, so a repeated build of the same commit is
+    skipped as it would be locally. Build jobs add their affinity keys to those the worker advertises.
+    Sources are cloned shallow or through a Git mirror as chosen for the worker, not by the submitter.
+    """
+
+    def __init__(self, queue_directory, work_directory=None, worker_id=None, max_jobs=1, affinity_wait=AFFINITY_WAIT,
+                 shallow=False, git_mirror=False, event_callback=None):
+
+        if shallow and git_mirror:
+            raise BuildQueueError("A build worker can not use both shallow clones and Git mirrors, choose one of them")
+
+        self.queue = DirectoryBuildQueue(queue_directory)
+
+        self.work_directory = os.path.realpath(work_directory if work_directory is not None else default_worker_directory())
+        self.worker_id = worker_id if worker_id is not None else socket.gethostname()
+        self.max_jobs = max_jobs
+        self.affinity_wait = affinity_wait
+        self.shallow = shallow
+        self.git_mirror = git_mirror
+        self.event_callback = event_callback
+
+        self.affinity_keys = []
+        self.running = 0
+
+        # Guards the heartbeat values shared with job threads
+        self._lock = threading.Lock()
+
+        # Jobs for the same workspace run one at a time
+        self._workspace_locks = {}
+
+    def heartbeat(self, stopped=False):
+
+        with self._lock:
+            self.queue.write_worker({
+                "worker_id": self.worker_id,
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "max_jobs": self.max_jobs,
+                "running": self.running,
+                "affinity_keys": self.affinity_keys,
+                "stopped": stopped,
+                "updated": time.time(),
+            })
+
+    def _start(self):
+        "Take over the affinity keys of an earlier run of this worker and fail the jobs it left running"
+
+        if (previous_info := self.queue.worker(self.worker_id)) is not None:
+            if not previous_info.get("stopped") and time.time() - previous_info["updated"] < WORKER_TIMEOUT and \
+               (previous_info["host"], previous_info["pid"]) != (socket.gethostname(), os.getpid()):
+                raise BuildQueueError(f"Build worker id {self.worker_id} is in use by process {previous_info['pid']} on {previous_info['host']}")
+
+            self.affinity_keys = previous_info.get("affinity_keys", [])
+
+        for job in self.queue.running_jobs(self.worker_id):
+            logger.warning(f"Failing job {job['id']} left running by an earlier run of worker {self.worker_id}")
+            self.queue.complete(job, self.worker_id, error=f"Build worker {self.worker_id} restarted while running the job")
+
+        os.makedirs(self.work_directory, exist_ok=True)
+
+        self.heartbeat()
+
+    def _claimable(self, job, live_worker_ids):
+
+        if job.get("pinned_worker") is not None:
+            return job["pinned_worker"] == self.worker_id
+
+        preferred_worker = job.get("preferred_worker")
+
+        if preferred_worker in (None, self.worker_id) or preferred_worker not in live_worker_ids:
+            return True
+
+        # Delay scheduling, give the preferred worker a chance before running the job with a cold cache
+        return time.time() - job["submitted"] >= self.affinity_wait
+
+    def _claim_next(self):
+        "Claim the next job this worker may run, jobs meant for this worker first, or return None"
+
+        live_worker_ids = self.queue.live_workers().keys()
+
+        jobs = [ job for job in self.queue.pending_jobs() if self._claimable(job, live_worker_ids) ]
+        jobs.sort(key=lambda job: self.worker_id not in (job.get("pinned_worker"), job.get("preferred_worker")))
+
+        for job in jobs:
+            if self.queue.claim(job, self.worker_id):
+                return job
+
+        return None
+
+    def run(self, stop_event=None):
+        "Claim and run jobs until stop_event is set or the process is interrupted"
+
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        self._start()
+
+        logger.info(f"Build worker {self.worker_id} serving {self.queue.queue_directory} with up to {self.max_jobs} jobs at a time")
+
+        last_heartbeat = time.time()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+                while not stop_event.is_set():
+                    if self.running < self.max_jobs and (job := self._claim_next()) is not None:
+                        with self._lock:
+                            self.running += 1
+                        self.heartbeat()
+
+                        executor.submit(self._run_job, job)
+                        continue
+
+                    if time.time() - last_heartbeat >= WORKER_HEARTBEAT_INTERVAL:
+                        self.heartbeat()
+                        last_heartbeat = time.time()
+
+                    stop_event.wait(POLL_INTERVAL)
+        finally:
+            self.heartbeat(stopped=True)
+
+        logger.info(f"Build worker {self.worker_id} stopped")
+
+    def _run_job(self, job):
+
+        logger.info(f"Running {job['operation']} job {job['id']}")
+
+        try:
+            if job["operation"] == "build":
+                values = self._build(job["args"])
+            elif job["operation"] == "push":
+                values = self._push(job["args"])
+            else:
+                raise BuildQueueError(f"Unknown build job operation: {job['operation']}")
+
+        except Exception as err:
+            logger.exception(f"{job['operation'].capitalize()} job {job['id']} failed")
+            self.queue.complete(job, self.worker_id, error=str(err))
+
+        else:
+            with self._lock:
+                if job["operation"] == "build":
+                    recent_keys = [ key for key in self.affinity_keys if key not in job["affinity_keys"] ] + job["affinity_keys"]
+                    self.affinity_keys = recent_keys[-MAX_AFFINITY_KEYS:]
+
+            self.queue.complete(job, self.worker_id, values=values)
+            logger.info(f"Finished {job['operation']} job {job['id']}")
+
+        finally:
+            with self._lock:
+                self.running -= 1
+            self.heartbeat()
+
+    def _workspace(self, args):
+        "Directory of the workspace of a job and a lock for it"
+
+        workspace_name = hashlib.sha256(f"{args['source_repository']}\n{args['checkout']}".encode()).hexdigest()[:16]
+
+        with self._lock:
+            workspace_lock = self._workspace_locks.setdefault(workspace_name, threading.Lock())
+
+        return os.path.join(self.work_directory, "workspaces", workspace_name), workspace_lock
+
+    def _build(self, args):
+        from .generator import UnityApplicationGenerator
+        from .targets import BuildTarget
+
+        workspace_dir, workspace_lock = self._workspace(args)
+
+        # Image names come from the name of the checkout directory for local source repositories
+        repo_dir = os.path.join(workspace_dir, args["repo_name"])
+        state_dir = os.path.join(repo_dir, ".unity_app_gen")
+
+        with workspace_lock:
+            # A repo2docker config file of the submitter is sent along with the job
+            repo_config = args["config_file"]
+            if isinstance(repo_config, dict):
+                config_dir = os.path.join(workspace_dir, "config")
+                os.makedirs(config_dir, exist_ok=True)
+
+                repo_config = os.path.join(config_dir, repo_config["name"])
+                with open(repo_config, "w") as config_file:
+                    config_file.write(args["config_file"]["contents"])
+
+            app_gen = UnityApplicationGenerator(state_dir, args["source_repository"], repo_dir, args["checkout"],
+                                                repo2docker_config=repo_config,
+                                                use_namespace=args["image_namespace"],
+                                                use_repository=args["image_repository"],
+                                                use_tag=args["image_tag"],
+                                                shallow_clone=self.shallow,
+                                                use_git_mirror=self.git_mirror,
+                                                event_callback=self.event_callback)
+
+            targets = [ BuildTarget.from_dict(t) for t in args["targets"] ] if args["targets"] is not None else None
+
+            app_gen.create_docker_image(force=args["force"], targets=targets, cache_from=args["cache_from"], env_cache=args["env_cache"],
+                                        slim=args["slim"], lazy_format=args["lazy_format"])
+
+            return {
+                "state_values": { name: app_gen.app_state.state_values[name] for name in BUILD_STATE_VALUES },
+                "image_id": app_gen._local_image_id(),
+            }
+
+    def _push(self, args):
+        from .generator import UnityApplicationGenerator
+
+        workspace_dir, workspace_lock = self._workspace(args)
+
+        state_dir = os.path.join(workspace_dir, args["repo_name"], ".unity_app_gen")
+
+        with workspace_lock:
+            if not os.path.exists(state_dir):
+                raise BuildQueueError(f"Build worker {self.worker_id} has no build of {args['source_repository']} at {args['checkout']}")
+
+            app_gen = UnityApplicationGenerator(state_dir, event_callback=self.event_callback)
+
+            # A later build of the same commit with other options may have replaced the image
+            if app_gen._local_image_id() != args["image_id"]:
+                raise BuildQueueError(f"Image built for {args['source_repository']} at {args['checkout']} was replaced by a later build " +
+                                      f"on worker {self.worker_id}, build it again")
+
+            if args["use_ecr"]:
+                app_gen.push_to_aws_ecr(force=args["force"])
+            else:
+                app_gen.push_to_docker_registry(args["container_registry"], force=args["force"])
+
+            return {
+                "state_values": { name: app_gen.app_state.state_values[name] for name in PUSH_STATE_VALUES },
+            }
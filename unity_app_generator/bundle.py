@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+
+from .cache import user_cache_directory
+from .locking import atomic_write
+from .fingerprint import file_digest, values_fingerprint
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT_VERSION = 2
+
+# Bundles not used for this long are removed from the artifact cache along with the objects only they reference
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+# Minimum time between removals of unused bundles from the same artifact cache
+PRUNE_INTERVAL = 24 * 60 * 60
+
+PRUNE_MARKER = ".last_prune"
+
+class BundleError(Exception):
+    pass
+
+def default_artifact_cache_directory():
+    return os.path.join(user_cache_directory(), "artifacts")
+
+class ArtifactBundle(object):
+    """
+    Manifest of generated files with their SHA256 digests. The compressed contents of each file
+    are stored once per digest in the objects directory of the artifact cache holding the bundle,
+    so they are shared by all bundles with a file of the same contents.
+    """
+
+    def __init__(self, bundle_filename):
+
+        self.bundle_filename = bundle_filename
+
+        # Bundles are stored as <cache>/bundles/<xx>/<digest>.json
+        cache_directory = os.path.dirname(os.path.dirname(os.path.dirname(bundle_filename)))
+        self.objects_directory = os.path.join(cache_directory, "objects")
+
+        try:
+            with open(bundle_filename) as bundle_file:
+                self.manifest = json.load(bundle_file)
+        except (OSError, ValueError) as err:
+            raise BundleError(f"Could not read artifact bundle {bundle_filename}: {err}")
+
+        if not isinstance(self.manifest, dict) or self.manifest.get("format") != BUNDLE_FORMAT_VERSION:
+            raise BundleError(f"Unsupported format version of artifact bundle {bundle_filename}, run build_cwl again")
+
+        # Mark the bundle as used so that it is not pruned from the cache
+        try:
+            os.utime(bundle_filename)
+        except OSError:
+            pass
+
+    @property
+    def files(self):
+        "Dictionary of file names and their SHA256 digests"
+        return self.manifest["files"]
+
+    def object_path(self, digest):
+
+        return os.path.join(self.objects_directory, digest[:2], digest)
+
+    def read(self, name):
+        "Return the contents of a file in the bundle after checking its digest"
+
+        digest = self.files[name]
+
+        try:
+            with open(self.object_path(digest), "rb") as object_file:
+                contents = zlib.decompress(object_file.read())
+        except (OSError, zlib.error) as err:
+            raise BundleError(f"Could not read {name} of artifact bundle {self.bundle_filename}: {err}")
+
+        if hashlib.sha256(contents).hexdigest() != digest:
+            raise BundleError(f"Contents of {name} in artifact bundle {self.bundle_filename} do not match the manifest digest")
+
+        return contents
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ArtifactCache(object):
+    """
+    Directory of artifact bundles named by the digest of their manifest, and of the file objects
+    they reference named by the digest of their contents. Identical files, such as those generated
+    for several applications from the same staging templates, are stored once. The directory can
+    be shared between state directories and hosts.
+    """
+
+    def __init__(self, cache_directory=None):
+
+        if cache_directory is None:
+            cache_directory = default_artifact_cache_directory()
+
+        self.cache_directory = os.path.realpath(cache_directory)
+
+        self.bundles_directory = os.path.join(self.cache_directory, "bundles")
+        self.objects_directory = os.path.join(self.cache_directory, "objects")
+
+    def bundle_path(self, bundle_digest):
+
+        return os.path.join(self.bundles_directory, bundle_digest[:2], f"{bundle_digest}.json")
+
+    def object_path(self, digest):
+
+        return os.path.join(self.objects_directory, digest[:2], digest)
+
+    def store_object(self, filename, digest):
+        "Store the compressed contents of filename under its digest unless already present"
+
+        object_filename = self.object_path(digest)
+
+        if os.path.exists(object_filename):
+            # Refresh the modification time so a concurrent prune does not remove it before the bundle is written
+            os.utime(object_filename)
+            return False
+
+        with open(filename, "rb") as input_file, atomic_write(object_filename, binary=True) as object_file:
+            object_file.write(zlib.compress(input_file.read()))
+
+        return True
+
+    def store_bundle(self, filenames, base_directory=None):
+        """
+        Store a bundle of the files in the filenames list and return its path. Files are named by
+        their path relative to base_directory, or by their basename without it.
+        """
+
+        if base_directory is not None:
+            file_names = { filename: os.path.relpath(filename, base_directory) for filename in filenames }
+        else:
+            file_names = { filename: os.path.basename(filename) for filename in filenames }
+
+        file_digests = { file_names[filename]: file_digest(filename) for filename in filenames }
+
+        objects_stored = [ filename for filename in filenames if self.store_object(filename, file_digests[file_names[filename]]) ]
+
+        logger.debug(f"Stored {len(objects_stored)} new objects of {len(filenames)} files in artifact cache {self.cache_directory}")
+
+        manifest = {
+            "format": BUNDLE_FORMAT_VERSION,
+            "files": file_digests,
+        }
+
+        bundle_filename = self.bundle_path(values_fingerprint(manifest))
+
+        if os.path.exists(bundle_filename):
+            logger.debug(f"Artifact bundle {bundle_filename} already exists in cache")
+            os.utime(bundle_filename)
+            return bundle_filename
+
+        with atomic_write(bundle_filename) as bundle_file:
+            json.dump(manifest, bundle_file, sort_keys=True, indent=4)
+
+        logger.info(f"Wrote artifact bundle {bundle_filename}")
+
+        return bundle_filename
+
+    def bundle_size(self, bundle_filename):
+        "Bytes used by the bundle manifest and the objects it references"
+
+        with ArtifactBundle(bundle_filename) as bundle:
+            object_paths = set([ self.object_path(digest) for digest in bundle.files.values() ])
+
+        return os.path.getsize(bundle_filename) + sum([ os.path.getsize(object_path) for object_path in object_paths ])
+
+    def _walk_files(self, directory):
+
+        for dir_path, dir_names, file_names in os.walk(directory):
+            for file_name in file_names:
+                if not file_name.startswith("."):
+                    yield os.path.join(dir_path, file_name)
+
+    def prune(self, max_age=DEFAULT_MAX_AGE, interval=PRUNE_INTERVAL):
+        """
+        Remove bundles not used for max_age seconds and the objects no remaining bundle references.
+        Objects newer than max_age are kept, as they may belong to a bundle being stored. Does nothing
+        if the cache was pruned less than interval seconds ago. Returns the number of files removed.
+        """
+
+        marker_filename = os.path.join(self.cache_directory, PRUNE_MARKER)
+        now = time.time()
+
+        try:
+            if now - os.path.getmtime(marker_filename) < interval:
+                return 0
+        except OSError:
+            pass
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        with open(marker_filename, "w"):
+            pass
+
+        removed = 0
+        referenced_digests = set()
+
+        def remove_expired(filename):
+            try:
+                if now - os.path.getmtime(filename) > max_age:
+                    os.remove(filename)
+                    return True
+            except OSError:
+                # Already removed by another process
+                pass
+
+            return False
+
+        for bundle_filename in self._walk_files(self.bundles_directory):
+            if remove_expired(bundle_filename):
+                removed += 1
+                continue
+
+            try:
+                with open(bundle_filename) as bundle_file:
+                    referenced_digests.update(json.load(bundle_file)["files"].values())
+            except (OSError, ValueError, KeyError, TypeError) as err:
+                logger.debug(f"Could not read artifact bundle {bundle_filename} while pruning: {err}")
+
+        for object_filename in self._walk_files(self.objects_directory):
+            if os.path.basename(object_filename) not in referenced_digests and remove_expired(object_filename):
+                removed += 1
+
+        if removed > 0:
+            logger.info(f"Removed {removed} unused files from artifact cache {self.cache_directory}")
+
+        return removed
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import logging
+
+from .locking import file_lock, atomic_write
+
+logger = logging.getLogger(__name__)
+
+def user_cache_directory():
+    "Location of caches shared by all state directories of the current user"
+
+    cache_base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+
+    return os.path.join(cache_base, "unity_app_generator")
+
+class JSONCache(object):
+    """
+    Small key/value cache persisted as a JSON file. Entries older than ttl seconds
+    are treated as missing. A ttl of None means entries never expire. mode optionally
+    sets the permissions of the cache file, for example for caches holding credentials.
+    """
+
+    def __init__(self, cache_name, ttl=None, cache_directory=None, mode=None):
+
+        if cache_directory is None:
+            cache_directory = user_cache_directory()
+
+        self.cache_directory = cache_directory
+        self.cache_filename = os.path.join(cache_directory, f"{cache_name}.json")
+        self.ttl = ttl
+        self.mode = mode
+
+    def _read(self):
+
+        if not os.path.exists(self.cache_filename):
+            return {}
+
+        try:
+            with open(self.cache_filename, "r") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError) as err:
+            # A corrupt or unreadable cache is the same as an empty one
+            logger.debug(f"Ignoring unreadable cache file {self.cache_filename}: {err}")
+            return {}
+
+    def _write(self, entries):
+
+        with atomic_write(self.cache_filename, mode=self.mode) as cache_file:
+            json.dump(entries, cache_file)
+
+    def get(self, key, default=None):
+
+        entry = self._read().get(key)
+
+        if entry is None:
+            return default
+
+        if self.ttl is not None and time.time() - entry["time"] > self.ttl:
+            return default
+
+        return entry["value"]
+
+    def get_many(self, keys):
+        "Dictionary of the values of those keys that are in the cache, reading the cache file once"
+
+        entries = self._read()
+
+        values = {}
+        for key in keys:
+            if (entry := entries.get(key)) is None:
+                continue
+
+            if self.ttl is not None and time.time() - entry["time"] > self.ttl:
+                continue
+
+            values[key] = entry["value"]
+
+        return values
+
+    def _locked(self):
+        "Lock held while reading and writing back entries so concurrent updates are not lost"
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        return file_lock(self.cache_filename + ".lock")
+
+    def update(self, values):
+
+        with self._locked():
+            entries = self._read()
+
+            now = time.time()
+            for key, value in values.items():
+                entries[key] = { "value": value, "time": now }
+
+            self._write(entries)
+
+    def set(self, key, value):
+
+        self.update({ key: value })
+
+    def delete(self, key):
+
+        with self._locked():
+            entries = self._read()
+
+            if entries.pop(key, None) is not None:
+                self._write(entries)
@@ -0,0 +1,13 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that runs each task in a copy of the context of the thread that submitted it,
+    so that context variables, such as the build server job used to route log records, carry over
+    to the worker threads of a stage.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,490 @@
+import os
+import re
+import json
+import time
+import queue
+import logging
+import tempfile
+import functools
+import threading
+import subprocess
+
+from app_pack_generator import DockerUtil
+from app_pack_generator.util import Util
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between push_progress events
+PUSH_PROGRESS_INTERVAL = 1.0
+
+# BuildKit plain progress output used by current versions of repo2docker
+BUILDKIT_STEP_RE = re.compile(r"^#(\d+) \[\s*(?:[\w.-]+\s+)?(\d+)/(\d+)\] (.*)$")
+BUILDKIT_CACHED_RE = re.compile(r"^#(\d+) CACHED$")
+BUILDKIT_DONE_RE = re.compile(r"^#(\d+) DONE ([\d.]+)s$")
+
+# Output of the classic Docker builder
+LEGACY_STEP_RE = re.compile(r"^Step (\d+)/(\d+) : (.*)$")
+LEGACY_CACHED_RE = re.compile(r"^\s*---> Using cache$")
+
+@functools.lru_cache(maxsize=None)
+def repo2docker_uses_buildkit():
+    "Whether the installed repo2docker builds with docker buildx, which supports inline cache metadata, or the classic builder"
+
+    try:
+        from repo2docker.docker import DockerEngine
+    except ImportError:
+        return False
+
+    return hasattr(DockerEngine, "extra_buildx_build_args")
+
+class DockerPushError(Exception):
+    pass
+
+class PushStalledError(DockerPushError):
+    pass
+
+class StreamingDockerUtil(DockerUtil):
+    """
+    DockerUtil that reports the progress of image builds and pushes as they happen.
+
+    event_callback is called with a dictionary for each event. Every event has an "event"
+    name and a "time", the other keys depend on the event:
+
+        build_start       image
+        build_step        step, total, instruction
+        build_step_cached step, total
+        build_step_done   step, total, elapsed
+        build_output      line
+        build_complete    image, elapsed, steps, cached_steps
+        push_start        destination
+        push_layer        layer, status, skipped
+        push_progress     bytes_pushed, bytes_total, bytes_per_sec, layers_done, layers_skipped, layers_total
+        push_complete     destination, digest, elapsed, bytes_pushed, layers_pushed, layers_skipped
+        manifest_complete destination, digest, sources
+        convert_complete  image, source, format
+
+    Builds and pushes of individual targets add a "target" name to their events.
+
+    A push that makes no progress for stall_timeout seconds is abandoned with PushStalledError. The
+    Docker Engine API has no way to cancel a push, so the push only ends on the daemon once the client
+    stops reading it: when more data arrives or the read times out after the Docker client timeout.
+    Until then later pushes to the same destination wait for it to end.
+    """
+
+    # Reader threads of stalled pushes that have not ended yet by destination, shared by all instances
+    _abandoned_pushes = {}
+    _abandoned_lock = threading.Lock()
+
+    def __init__(self, git_mgr, event_callback=None, stall_timeout=None, docker_client=None, **kwargs):
+
+        if docker_client is None:
+            super().__init__(git_mgr, **kwargs)
+        else:
+            # Use an existing client, such as one shared between jobs, instead of opening another
+            self._set_options(git_mgr, **kwargs)
+            self.docker_client = docker_client
+
+        self.event_callback = event_callback
+        self.stall_timeout = stall_timeout
+
+        # Digest reported by the registry for the last pushed image
+        self.last_push_digest = None
+
+        # Images whose layers the build may reuse when its own layer cache does not have them
+        self.cache_from = []
+
+        # Concurrent target builds share one download of a remote repo2docker config
+        self._repo_config_lock = threading.Lock()
+        self._repo_config_local = None
+
+    def _set_options(self, git_mgr, repo_config=None, do_prune=True, use_namespace=None, use_repository=None, use_tag=None):
+        "Set the same attributes as DockerUtil.__init__ without creating a Docker client"
+
+        self.git_mgr = git_mgr
+        self.repo_config = repo_config
+        self.do_prune = do_prune
+
+        self.use_namespace = use_namespace
+        self.use_repository = use_repository
+        self.use_tag = use_tag
+
+    def _emit(self, event_name, **fields):
+
+        if self.event_callback is not None:
+            self.event_callback({ "event": event_name, "time": time.time(), **fields })
+
+    def _prune(self):
+        "Prune dangling containers and images to reclaim space as DockerUtil does"
+        import requests
+
+        try:
+            self.docker_client.containers.prune()
+            self.docker_client.images.prune()
+        except requests.exceptions.ReadTimeout as err:
+            logger.error(f"An error occurred while pruning: {err}")
+
+    def _local_repo_config(self):
+        "Path of the repo2docker config file, downloading it into the repository when it is a URL"
+
+        with self._repo_config_lock:
+            if self._repo_config_local is not None:
+                return self._repo_config_local
+
+            # If the repo2docker config file does not exist inside the repo already, assume it is a URL
+            # and try to download it
+            if not os.path.exists(self.repo_config):
+                repo_config_local = os.path.join(self.git_mgr.directory, os.path.basename(self.repo_config))
+
+                response = Util.DownloadLink(self.repo_config)
+                if response is not None:
+                    with open(repo_config_local, 'w') as f:
+                        f.write(response.text)
+                else:
+                    raise RuntimeError('Failed to download the specified configuration file: ' + self.repo_config)
+            else:
+                repo_config_local = self.repo_config
+
+            self._repo_config_local = repo_config_local
+
+        return repo_config_local
+
+    def repo2docker_command(self, image_reference=None, extra_args=[]):
+        "Command line arguments used to run repo2docker, matching DockerUtil.repo2docker"
+
+        if image_reference is None:
+            image_reference = self.image_reference
+
+        cmd = ['jupyter-repo2docker', '--user-id', '1000', '--user-name', 'jovyan',
+               '--no-run', '--debug', '--image-name', image_reference]
+
+        if self.repo_config is not None:
+            cmd += ['--config', self._local_repo_config()]
+
+        cmd += extra_args
+
+        # The repository must be the last argument to repo2docker
+        cmd += [self.git_mgr.directory]
+
+        return cmd
+
+    def repo2docker(self):
+        "Run repo2docker reading its output line by line to report each build step"
+
+        if self.do_prune:
+            self._prune()
+
+        return self._run_repo2docker(self.image_reference, self._cache_args(self.cache_from))
+
+    def _cache_args(self, cache_from):
+        "repo2docker arguments for using cache_from images as layer cache sources"
+
+        cache_args = []
+
+        # Builds chained from earlier images store cache metadata in the image so that it can serve as a
+        # cache source for the next build. Only BuildKit reads it, the classic builder would warn about it.
+        if len(cache_from) > 0 and repo2docker_uses_buildkit():
+            cache_args += ["--build-arg", "BUILDKIT_INLINE_CACHE=1"]
+
+        for cache_image in cache_from:
+            cache_args += ["--cache-from", cache_image]
+
+        return cache_args
+
+    def build_target(self, image_reference, platform=None, base_image=None, target_name=None, cache_from=[]):
+        "Build the image for a single target platform and base image under its own reference"
+
+        extra_args = self._cache_args(cache_from)
+
+        if platform is not None:
+            extra_args.append(f"--Repo2Docker.platform={platform}")
+
+        if base_image is not None:
+            extra_args.append(f"--Repo2Docker.base_image={base_image}")
+
+        return self._run_repo2docker(image_reference, extra_args, event_fields={ "target": target_name })
+
+    def _run_repo2docker(self, image_reference, extra_args=[], event_fields={}):
+
+        logger.info(f"Building Docker image named {image_reference}")
+
+        cmd = self.repo2docker_command(image_reference, extra_args)
+
+        logger.debug("Executing repo2docker with command line:")
+        logger.debug(" ".join(cmd))
+
+        # Events from concurrent target builds are told apart by the extra fields
+        emit = lambda event_name, **fields: self._emit(event_name, **event_fields, **fields)
+
+        emit("build_start", image=image_reference)
+        start_time = time.perf_counter()
+
+        # BuildKit identifies steps by vertex number, the classic builder prints them in order
+        vertex_steps = {}
+        current_step = None
+        cached_steps = set()
+        num_steps = 0
+
+        output_lines = []
+
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+        for line in process.stdout:
+            line = line.rstrip()
+            output_lines.append(line)
+
+            logger.debug(line)
+            emit("build_output", line=line)
+
+            if (match := BUILDKIT_STEP_RE.match(line)) is not None:
+                vertex, step, total, instruction = match.groups()
+                vertex_steps[vertex] = (int(step), int(total))
+                num_steps = int(total)
+                emit("build_step", step=int(step), total=int(total), instruction=instruction)
+
+            elif (match := LEGACY_STEP_RE.match(line)) is not None:
+                step, total, instruction = match.groups()
+                current_step = (int(step), int(total))
+                num_steps = int(total)
+                emit("build_step", step=int(step), total=int(total), instruction=instruction)
+
+            elif (match := BUILDKIT_CACHED_RE.match(line)) is not None and match.group(1) in vertex_steps:
+                step, total = vertex_steps[match.group(1)]
+                cached_steps.add(step)
+                emit("build_step_cached", step=step, total=total)
+
+            elif LEGACY_CACHED_RE.match(line) is not None and current_step is not None:
+                step, total = current_step
+                cached_steps.add(step)
+                emit("build_step_cached", step=step, total=total)
+
+            elif (match := BUILDKIT_DONE_RE.match(line)) is not None and match.group(1) in vertex_steps:
+                step, total = vertex_steps[match.group(1)]
+                emit("build_step_done", step=step, total=total, elapsed=float(match.group(2)))
+
+        return_code = process.wait()
+
+        if return_code != 0:
+            r2d_output = "\n".join(output_lines)
+            logger.error(r2d_output)
+            raise subprocess.CalledProcessError(return_code, cmd, output=r2d_output)
+
+        emit("build_complete", image=image_reference, elapsed=time.perf_counter() - start_time,
+                   steps=num_steps, cached_steps=len(cached_steps))
+
+        return image_reference
+
+    def _push_messages(self, reg_image_dest):
+        """
+        Yield the decoded messages of a push. The stream is read in a separate thread so that
+        a push that goes silent can be detected instead of waiting for the client timeout.
+        """
+
+        cls = self.__class__
+
+        # Pushing again while a stalled push is still running would have two pushes of the same image
+        with cls._abandoned_lock:
+            stalled_reader = cls._abandoned_pushes.get(reg_image_dest)
+
+        if stalled_reader is not None:
+            logger.info(f"Waiting for the stalled earlier push of {reg_image_dest} to end")
+            stalled_reader.join()
+
+            with cls._abandoned_lock:
+                if cls._abandoned_pushes.get(reg_image_dest) is stalled_reader:
+                    del cls._abandoned_pushes[reg_image_dest]
+
+        messages = queue.Queue()
+        end_of_stream = object()
+        abandoned = threading.Event()
+
+        def read_stream():
+            try:
+                push_stream = self.docker_client.images.push(reg_image_dest, stream=True, decode=True)
+
+                for message in push_stream:
+                    # Closing the stream drops the connection, which ends the push on the daemon
+                    if abandoned.is_set():
+                        push_stream.close()
+                        break
+
+                    messages.put(message)
+            except Exception as err:
+                messages.put(err)
+            finally:
+                with cls._abandoned_lock:
+                    if cls._abandoned_pushes.get(reg_image_dest) is threading.current_thread():
+                        del cls._abandoned_pushes[reg_image_dest]
+
+            messages.put(end_of_stream)
+
+        reader = threading.Thread(target=read_stream, daemon=True)
+        reader.start()
+
+        while True:
+            try:
+                message = messages.get(timeout=self.stall_timeout)
+            except queue.Empty:
+                abandoned.set()
+
+                with cls._abandoned_lock:
+                    if reader.is_alive():
+                        cls._abandoned_pushes[reg_image_dest] = reader
+
+                raise PushStalledError(f"Push of {reg_image_dest} received no data for {self.stall_timeout} seconds, abandoning it")
+
+            if message is end_of_stream:
+                return
+            elif isinstance(message, Exception):
+                raise message
+
+            yield message
+
+    def push_image(self, registry_url, image_reference=None, event_fields={}):
+        "Push the image like DockerUtil.push_image while reporting per layer progress"
+
+        if image_reference is None:
+            image_reference = self.image_reference
+
+        image = self.docker_client.images.get(image_reference)
+
+        reg_image_dest = f"{registry_url}/{image_reference}"
+
+        logger.info(f"Pushing {image_reference} to {reg_image_dest}")
+
+        # Use the two argument form of tag() for Podman compatibility
+        if image_reference.find(":") >= 0:
+            local_repo, local_tag = image_reference.split(":")
+            image.tag(f"{registry_url}/{local_repo}", local_tag)
+        else:
+            image.tag(reg_image_dest)
+
+        # Events from concurrent target pushes are told apart by the extra fields
+        emit = lambda event_name, **fields: self._emit(event_name, **event_fields, **fields)
+
+        emit("push_start", destination=reg_image_dest)
+
+        start_time = time.perf_counter()
+        last_progress_time = start_time
+        last_progress_bytes = 0
+
+        # layer id -> [current bytes, total bytes, status]
+        layers = {}
+
+        push_digest = None
+
+        for message in self._push_messages(reg_image_dest):
+            if 'errorDetail' in message:
+                raise DockerPushError(f"Error pushing {image_reference} to {reg_image_dest}: " + message['errorDetail']['message'])
+
+            if (aux := message.get('aux')) is not None and 'Digest' in aux:
+                push_digest = aux['Digest']
+
+            if (layer_id := message.get('id')) is None or 'status' not in message:
+                logger.debug(message)
+                continue
+
+            status = message['status']
+            layer = layers.setdefault(layer_id, [0, 0, None])
+
+            if status == "Pushing":
+                progress = message.get('progressDetail', {})
+                layer[0] = progress.get('current', layer[0])
+                layer[1] = progress.get('total', layer[1]) or layer[1]
+            elif status == "Pushed":
+                layer[0] = max(layer[0], layer[1])
+
+            if status != layer[2]:
+                layer[2] = status
+                logger.debug(f"Layer {layer_id}: {status}")
+                emit("push_layer", layer=layer_id, status=status, skipped=(status == "Layer already exists"))
+
+            now = time.perf_counter()
+            if now - last_progress_time >= PUSH_PROGRESS_INTERVAL:
+                bytes_pushed = sum([ l[0] for l in layers.values() ])
+
+                emit("push_progress",
+                    bytes_pushed=bytes_pushed,
+                    bytes_total=sum([ l[1] for l in layers.values() ]),
+                    bytes_per_sec=(bytes_pushed - last_progress_bytes) / (now - last_progress_time),
+                    layers_done=len([ l for l in layers.values() if l[2] in ("Pushed", "Layer already exists") ]),
+                    layers_skipped=len([ l for l in layers.values() if l[2] == "Layer already exists" ]),
+                    layers_total=len(layers))
+
+                last_progress_time = now
+                last_progress_bytes = bytes_pushed
+
+        emit("push_complete",
+            destination=reg_image_dest,
+            digest=push_digest,
+            elapsed=time.perf_counter() - start_time,
+            bytes_pushed=sum([ l[0] for l in layers.values() if l[2] == "Pushed" ]),
+            layers_pushed=len([ l for l in layers.values() if l[2] == "Pushed" ]),
+            layers_skipped=len([ l for l in layers.values() if l[2] == "Layer already exists" ]))
+
+        self.last_push_digest = push_digest
+
+        if self.do_prune:
+            self.docker_client.images.remove(image.id, force=True)
+            self._prune()
+
+        return reg_image_dest
+
+    def create_manifest_list(self, manifest_dest, source_images):
+        """
+        Create a manifest list in the registry combining already pushed images of different
+        platforms and return its digest. This uses the credentials of the docker command line
+        client since the Docker Engine API does not support manifest lists.
+        """
+
+        logger.info(f"Creating manifest list {manifest_dest} from: {', '.join(source_images)}")
+
+        try:
+            subprocess.run(['docker', 'buildx', 'imagetools', 'create', '--tag', manifest_dest] + source_images,
+                           check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        except subprocess.CalledProcessError as exc:
+            logger.error(exc.output)
+            raise
+
+        inspect_result = subprocess.run(['docker', 'buildx', 'imagetools', 'inspect', manifest_dest, '--format', '{{json .Manifest}}'],
+                                        check=True, stdout=subprocess.PIPE, universal_newlines=True)
+
+        manifest_digest = json.loads(inspect_result.stdout)["digest"]
+
+        self._emit("manifest_complete", destination=manifest_dest, digest=manifest_digest, sources=source_images)
+
+        return manifest_digest
+
+    def convert_image(self, image_reference, converted_reference, lazy_format, priority_paths=[]):
+        """
+        Convert a local image into a lazily pullable format, either estargz or zstdchunked, using
+        nerdctl. Files in priority_paths are placed first so they can be fetched before the rest
+        of the image. The converted image is only visible to Docker when it uses the containerd
+        image store, in which case converting in its namespace makes the image available to push.
+        """
+
+        cmd = ['nerdctl', '--namespace', 'moby', 'image', 'convert', f'--{lazy_format}', '--oci']
+
+        with tempfile.TemporaryDirectory(prefix="unity_app_gen_convert_") as tmp_dir:
+            if len(priority_paths) > 0:
+                record_filename = os.path.join(tmp_dir, "priority.json")
+
+                with open(record_filename, "w") as record_file:
+                    for path in priority_paths:
+                        record_file.write(json.dumps({ "path": path }) + "\n")
+
+                cmd += [f'--{lazy_format}-record-in', record_filename]
+
+            cmd += [image_reference, converted_reference]
+
+            logger.info(f"Converting {image_reference} to {lazy_format} image {converted_reference}")
+            logger.debug(" ".join(cmd))
+
+            try:
+                subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+            except subprocess.CalledProcessError as exc:
+                logger.error(exc.output)
+                raise
+
+        self._emit("convert_complete", image=converted_reference, source=image_reference, format=lazy_format)
+
+        return converted_reference
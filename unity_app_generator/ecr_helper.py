@@ -1,4 +1,9 @@
+import time
 import base64
+import hashlib
+import subprocess
+import threading
+import weakref
 
 import boto3
 from botocore.exceptions import ClientError
@@ -7,33 +12,110 @@ import logging
 
 from typing import TYPE_CHECKING
 
+from .cache import JSONCache
+
 if TYPE_CHECKING:
     from app_pack_generator import DockerUtil
 
 logger = logging.getLogger(__name__)
 
+# Seconds before the expiration of an ECR authorization token that it is no longer reused
+ECR_TOKEN_EXPIRY_MARGIN = 300
+
+# Seconds that the URI of an existing ECR repository is cached
+ECR_REPOSITORY_CACHE_TTL = 86400
+
 class ECRHelper(object):
 
+    # boto3 session and ECR client shared by all instances in a process
+    _shared_lock = threading.Lock()
+    _shared_session = None
+    _shared_client = None
+
+    # Authorization data per AWS identity, shared by all instances in a process
+    _auth_data = {}
+
+    # Registries each Docker client has been logged into along with the password used
+    _docker_logins = weakref.WeakKeyDictionary()
+
     def __init__(self, docker_util : 'DockerUtil'):
 
         self.docker_util = docker_util
-        self.ecr_client = boto3.client("ecr")
+        self.session, self.ecr_client = self.__class__._shared_ecr_client()
 
-    def create_repository(self):
+    @classmethod
+    def _shared_ecr_client(cls):
+
+        # Creating sessions and clients is not thread safe in boto3, using the client is
+        with cls._shared_lock:
+            if cls._shared_client is None:
+                cls._shared_session = boto3.session.Session()
+                cls._shared_client = cls._shared_session.client("ecr")
+
+        return cls._shared_session, cls._shared_client
+
+    @property
+    def _identity_key(self):
+        "Distinguishes cached values between AWS regions and credentials without storing the access key id"
+
+        credentials = self.session.get_credentials()
+        access_key = credentials.access_key if credentials is not None else ""
+
+        identity = f"{self.ecr_client.meta.region_name}|{access_key}"
+
+        return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+    @property
+    def repository_name(self):
+        "Name of the ECR repository corresponding to the Docker image namespace and repository"
 
         if self.docker_util.image_namespace is not None and self.docker_util.image_namespace != "":
-            aws_repo_name = f"{self.docker_util.image_namespace}/{self.docker_util.image_repository}"
+            return f"{self.docker_util.image_namespace}/{self.docker_util.image_repository}"
         else:
-            aws_repo_name = self.docker_util.image_repository
+            return self.docker_util.image_repository
+
+    @property
+    def _repository_cache_key(self):
+
+        return f"{self._identity_key}|{self.repository_name}"
+
+    def forget_repository(self):
+        "Remove the cached URI of the ECR repository, for example after the repository was deleted"
+
+        JSONCache("ecr_repositories", ttl=ECR_REPOSITORY_CACHE_TTL).delete(self._repository_cache_key)
+
+    def repository_exists(self):
+        "Check with ECR that the repository exists, regardless of the cached URI"
+
+        try:
+            self.ecr_client.describe_repositories(repositoryNames=[self.repository_name])
+        except ClientError as err:
+            if err.response["Error"]["Code"] == "RepositoryNotFoundException":
+                return False
+            else:
+                raise
+
+        return True
+
+    def create_repository(self):
+
+        aws_repo_name = self.repository_name
+
+        repository_cache = JSONCache("ecr_repositories", ttl=ECR_REPOSITORY_CACHE_TTL)
+        cache_key = self._repository_cache_key
+
+        if (repository_uri := repository_cache.get(cache_key)) is not None:
+            logger.debug(f"Using cached URI for AWS ECR repository {aws_repo_name}: {repository_uri}")
+            return repository_uri
 
         logger.info(f"Creating AWS ECR repository named: {aws_repo_name}")
-        
+
         try:
             response = self.ecr_client.create_repository(
                 repositoryName=aws_repo_name,
             )
 
-            return response["repository"]['repositoryUri']
+            repository_uri = response["repository"]['repositoryUri']
 
         except ClientError as err:
             if err.response["Error"]["Code"] == "RepositoryAlreadyExistsException":
@@ -41,31 +123,110 @@ class ECRHelper(object):
                 response = self.ecr_client.describe_repositories(
                     repositoryNames=[aws_repo_name]
                 )
-                
-                return response['repositories'][0]['repositoryUri']
+
+                repository_uri = response['repositories'][0]['repositoryUri']
             else:
                 logger.error(
                     "Error creating repository %s. Here's why %s",
-                    repository_name,
+                    aws_repo_name,
                     err.response["Error"]["Message"],
                 )
                 raise
 
+        repository_cache.set(cache_key, repository_uri)
+
+        return repository_uri
+
+    def _authorization_data(self):
+        """
+        Return the ECR authorization token and proxy endpoint, reusing a previously retrieved
+        token from this process or the user cache until it is close to expiring
+        """
+
+        identity_key = self._identity_key
+
+        # The cache file is only readable by the user since it holds credentials
+        token_cache = JSONCache("ecr_auth", mode=0o600)
+
+        auth_data = self.__class__._auth_data.get(identity_key)
+
+        if auth_data is None:
+            auth_data = token_cache.get(identity_key)
+
+        if auth_data is not None and auth_data["expires"] - ECR_TOKEN_EXPIRY_MARGIN > time.time():
+            logger.debug("Reusing cached ECR authorization token")
+        else:
+            response = self.ecr_client.get_authorization_token()
+
+            auth_data = {
+                "token": response['authorizationData'][0]['authorizationToken'],
+                "endpoint": response['authorizationData'][0]['proxyEndpoint'],
+                "expires": response['authorizationData'][0]['expiresAt'].timestamp(),
+            }
+
+            token_cache.set(identity_key, auth_data)
+
+        self.__class__._auth_data[identity_key] = auth_data
+
+        return auth_data
+
     def docker_login(self):
 
-        logger.info("Logging into Docker using ECR credentials")
+        auth_data = self._authorization_data()
 
-        token = self.ecr_client.get_authorization_token()
-        username, password = base64.b64decode(token['authorizationData'][0]['authorizationToken']).decode().split(':')
+        username, password = base64.b64decode(auth_data["token"]).decode().split(':')
 
         # Remove the protocol prefix for this to work
         # https://github.com/docker/docker-py/issues/2256
-        registry = token['authorizationData'][0]['proxyEndpoint'].replace("https://", "")
+        registry = auth_data["endpoint"].replace("https://", "")
+
+        docker_client = self.docker_util.docker_client
+        client_logins = self.__class__._docker_logins.setdefault(docker_client, {})
+
+        if client_logins.get(registry) == password:
+            logger.debug(f"Docker client already logged into {registry}")
+            return registry
 
-        response = self.docker_util.docker_client.login(
+        logger.info("Logging into Docker using ECR credentials")
+
+        response = docker_client.login(
             username=username,
             password=password,
             registry=registry
         )
 
-        return registry
\ No newline at end of file
+        client_logins[registry] = password
+
+        return registry
+
+    def docker_cli_login(self):
+        "Log the docker command line client into ECR for operations not available through the Docker Engine API"
+
+        auth_data = self._authorization_data()
+
+        username, password = base64.b64decode(auth_data["token"]).decode().split(':')
+
+        logger.info("Logging docker command line client into ECR")
+
+        subprocess.run(['docker', 'login', '--username', username, '--password-stdin', auth_data["endpoint"]],
+                       input=password, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def image_digest(self, image_tag):
+        "Return the digest of the image with the given tag in the ECR repository or None if it does not exist"
+
+        try:
+            response = self.ecr_client.describe_images(
+                repositoryName=self.repository_name,
+                imageIds=[{ "imageTag": image_tag }],
+            )
+        except ClientError as err:
+            if err.response["Error"]["Code"] == "ImageNotFoundException":
+                return None
+            elif err.response["Error"]["Code"] == "RepositoryNotFoundException":
+                # The repository was deleted since its URI was cached
+                self.forget_repository()
+                return None
+            else:
+                raise
+
+        return response["imageDetails"][0]["imageDigest"]
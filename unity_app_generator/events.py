@@ -0,0 +1,53 @@
+import sys
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class JSONEventWriter(object):
+    "Writes each build and push event as a line of JSON"
+
+    def __init__(self, stream=None):
+
+        self.stream = stream if stream is not None else sys.stdout
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+
+        with self._lock:
+            self.stream.write(json.dumps(event) + "\n")
+            self.stream.flush()
+
+class LogEventRenderer(object):
+    "Logs a human readable summary of build and push events"
+
+    def __call__(self, event):
+
+        event_name = event["event"]
+
+        if event_name == "build_step":
+            logger.info(f"Step {event['step']}/{event['total']}: {event['instruction']}")
+
+        elif event_name == "build_step_cached":
+            logger.info(f"Step {event['step']}/{event['total']}: using cache")
+
+        elif event_name == "build_output":
+            logger.debug(event["line"])
+
+        elif event_name == "build_complete":
+            logger.info(f"Built {event['image']} in {event['elapsed']:.1f} s, {event['cached_steps']} of {event['steps']} steps cached")
+
+        elif event_name == "push_layer" and event["skipped"]:
+            logger.info(f"Layer {event['layer']} already exists in registry, skipped")
+
+        elif event_name == "push_layer":
+            logger.debug(f"Layer {event['layer']}: {event['status']}")
+
+        elif event_name == "push_progress":
+            logger.info(f"Pushed {event['bytes_pushed'] / 1e6:.1f} of {event['bytes_total'] / 1e6:.1f} MB at {event['bytes_per_sec'] / 1e6:.1f} MB/s, " +
+                        f"{event['layers_done']} of {event['layers_total']} layers done, {event['layers_skipped']} skipped")
+
+        elif event_name == "push_complete":
+            logger.info(f"Pushed {event['destination']} in {event['elapsed']:.1f} s: {event['bytes_pushed'] / 1e6:.1f} MB in " +
+                        f"{event['layers_pushed']} layers, {event['layers_skipped']} layers skipped, digest {event['digest']}")
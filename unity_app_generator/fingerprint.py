@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Size of blocks read when hashing file contents
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_digest(filename):
+    "Return the SHA256 hex digest of the contents of a file"
+
+    hasher = hashlib.sha256()
+
+    with open(filename, "rb") as hash_file:
+        while block := hash_file.read(HASH_BLOCK_SIZE):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+def values_fingerprint(values):
+    "Return a SHA256 hex digest of a JSON serializable dictionary of values"
+
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+def _is_excluded(filename, exclude_paths):
+
+    for excl_path in exclude_paths:
+        if filename == excl_path or filename.startswith(excl_path.rstrip(os.sep) + os.sep):
+            return True
+
+    return False
+
+def source_fingerprint(git_mgr, extra_files=[], exclude_paths=[]):
+    """
+    Compute a fingerprint of a checked out repository from the current commit and the
+    contents of any modified or untracked files. The contents of extra_files, such as a
+    repo2docker config file, are included as well. Values in extra_files that are not
+    existing files (ie URLs) are included as strings.
+    """
+
+    repo = git_mgr.repo
+    work_dir = repo.working_tree_dir
+
+    exclude_paths = [ os.path.realpath(excl_path) for excl_path in exclude_paths ]
+
+    hasher = hashlib.sha256()
+    hasher.update(repo.head.commit.hexsha.encode())
+
+    # Tracked files with unstaged or staged changes as well as untracked files
+    changed_files = set([ diff.a_path for diff in repo.index.diff(None) ])
+    changed_files.update([ diff.a_path for diff in repo.index.diff("HEAD") ])
+    changed_files.update(repo.untracked_files)
+
+    for rel_path in sorted(changed_files):
+        full_path = os.path.realpath(os.path.join(work_dir, rel_path))
+
+        if _is_excluded(full_path, exclude_paths):
+            continue
+
+        hasher.update(rel_path.encode())
+
+        if os.path.isfile(full_path):
+            hasher.update(file_digest(full_path).encode())
+        else:
+            hasher.update(b"<deleted>")
+
+    for extra_filename in extra_files:
+        if extra_filename is None:
+            continue
+
+        if os.path.isfile(extra_filename):
+            hasher.update(file_digest(extra_filename).encode())
+        else:
+            hasher.update(extra_filename.encode())
+
+    fingerprint = hasher.hexdigest()
+
+    logger.debug(f"Source fingerprint for {work_dir}: {fingerprint}")
+
+    return fingerprint
+
+# Files repo2docker uses to set up the environment of an image before the rest of the repository is added
+ENVIRONMENT_FILES = [ "environment.yml", "environment.yaml", "requirements.txt", "requirements3.txt", "Pipfile", "Pipfile.lock",
+                      "setup.py", "pyproject.toml", "apt.txt", "runtime.txt", "install.R", "DESCRIPTION", "Project.toml",
+                      "JuliaProject.toml", "REQUIRE", "default.nix", "Dockerfile" ]
+
+def environment_fingerprint(directory, extra_values=[]):
+    """
+    Compute a fingerprint of the environment files of a repository in the same locations repo2docker
+    looks for them, either a binder or .binder subdirectory or the top of the repository. Values such
+    as the repo2docker config or the target platform are included from extra_values.
+    """
+
+    binder_dir = directory
+    for binder_name in [".binder", "binder"]:
+        if os.path.isdir(os.path.join(directory, binder_name)):
+            binder_dir = os.path.join(directory, binder_name)
+            break
+
+    hasher = hashlib.sha256()
+
+    for env_filename in ENVIRONMENT_FILES:
+        env_path = os.path.join(binder_dir, env_filename)
+
+        if os.path.isfile(env_path):
+            hasher.update(env_filename.encode())
+            hasher.update(file_digest(env_path).encode())
+
+    for extra_value in extra_values:
+        if extra_value is None:
+            continue
+
+        if os.path.isfile(extra_value):
+            hasher.update(file_digest(extra_value).encode())
+        else:
+            hasher.update(str(extra_value).encode())
+
+    fingerprint = hasher.hexdigest()
+
+    logger.debug(f"Environment fingerprint for {directory}: {fingerprint}")
+
+    return fingerprint
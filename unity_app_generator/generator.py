@@ -1,26 +1,74 @@
 import os
 import sys
+import json
+import shutil
+import hashlib
 import tempfile
 import logging
 from glob import glob
 
 from .state import ApplicationState
-from .ecr_helper import ECRHelper
+from .fingerprint import source_fingerprint, environment_fingerprint, values_fingerprint, file_digest
+from .cache import JSONCache
+from .instrumentation import StageInstrumentation, instrumented
+from .targets import BuildTarget, BuildTargetError, parse_build_targets
+from .build_cache import EnvironmentImageStore
+from .bundle import ArtifactCache, ArtifactBundle, BundleError
+from .image_optimize import LAZY_PULL_FORMATS, ImageSlimmer, ImageOptimizationError, layer_report, format_layer_report, \
+    build_only_paths, startup_paths
+from .stages import PIPELINE_STAGES, checkpointed
+from .concurrency import ContextThreadPoolExecutor
+from .validation import PackageValidator, format_issues
 
-from app_pack_generator import GitManager, DockerUtil, ApplicationNotebook
-from app_pack_generator import ProcessCWL, DataStagingCWL, Descriptor
-
-from unity_sds_client.services.application_service import DockstoreAppCatalog
+# app_pack_generator, unity_sds_client, docker and boto3 take seconds to import so they
+# are imported inside the methods that use them to keep startup of the command line fast
 
 logger = logging.getLogger(__name__)
 
+# Seconds that Dockstore application name to id lookups are cached
+DOCKSTORE_APP_CACHE_TTL = 3600
+
+# Maximum number of notebooks whose CWL files are generated at the same time
+MAX_CWL_WORKERS = 8
+
+# Maximum number of notebook applications uploaded to Dockstore at the same time
+MAX_REGISTRY_WORKERS = 4
+
 class ApplicationGenerationError(Exception):
     pass
 
 class UnityApplicationGenerator(object):
 
+    # Callables used instead of StreamingDockerUtil and PooledDockstoreAppCatalog when set. A long
+    # running process can pass its own to each generator to share resources between them.
+    docker_util_factory = None
+    app_catalog_factory = None
+
+    # Callable used instead of QueueBuildExecutor to run builds and pushes on builder nodes when set,
+    # it is passed the build queue and a timeout in seconds
+    build_executor_factory = None
+
     def __init__(self, state_directory, source_repository=None, destination_directory=None, checkout=None,
-                 repo2docker_config=None, use_namespace=None, use_repository=None, use_tag=None):
+                 repo2docker_config=None, use_namespace=None, use_repository=None, use_tag=None, profile=False,
+                 shallow_clone=False, use_git_mirror=False, event_callback=None, stall_timeout=None,
+                 docker_util_factory=None, app_catalog_factory=None):
+
+        # Factories given to this generator take precedence over the class wide ones
+        self._docker_util_factory = docker_util_factory if docker_util_factory is not None else type(self).docker_util_factory
+        self._app_catalog_factory = app_catalog_factory if app_catalog_factory is not None else type(self).app_catalog_factory
+
+        # Receives build and push progress events, see StreamingDockerUtil for their contents
+        self.event_callback = event_callback
+        self.stall_timeout = stall_timeout
+
+        # How new clones of remote source repositories are made
+        if shallow_clone and use_git_mirror:
+            raise ApplicationGenerationError("A shallow clone can not be combined with a Git mirror, choose one of them")
+
+        self.shallow_clone = shallow_clone
+        self.use_git_mirror = use_git_mirror
+
+        self.instrumentation = StageInstrumentation(os.path.realpath(state_directory), profile=profile)
 
         if not ApplicationState.exists(state_directory):
             self.repo_info = self._localize_source(source_repository, destination_directory, checkout)
@@ -34,50 +82,653 @@ class UnityApplicationGenerator(object):
         image_repository = use_repository if use_repository is not None else self.app_state.docker_image_repository
         image_tag = use_tag if use_tag is not None else self.app_state.docker_image_tag
 
-        self.docker_util = DockerUtil(self.repo_info, do_prune=False,
-                                      repo_config=repo2docker_config,
-                                      use_namespace=image_namespace,
-                                      use_repository=image_repository,
-                                      use_tag=image_tag)
+        self._docker_util = None
+        self._docker_util_options = {
+            "repo_config": repo2docker_config,
+            "use_namespace": image_namespace,
+            "use_repository": image_repository,
+            "use_tag": image_tag,
+        }
+
+        # Write out localization timing for new state directories
+        self.instrumentation.save()
+
+    @property
+    def docker_util(self):
+        "DockerUtil is created on first use since it connects to the Docker daemon"
+
+        if self._docker_util is None:
+            if (docker_util_factory := self._docker_util_factory) is None:
+                from .docker_stream import StreamingDockerUtil as docker_util_factory
+
+            self._docker_util = docker_util_factory(self.repo_info, do_prune=False,
+                                                    event_callback=self._handle_event, stall_timeout=self.stall_timeout,
+                                                    **self._docker_util_options)
+
+        return self._docker_util
+
+    def _build_executor(self, build_queue, timeout=None):
+
+        if (build_executor_factory := type(self).build_executor_factory) is None:
+            from .build_queue import QueueBuildExecutor as build_executor_factory
+
+        return build_executor_factory(build_queue, timeout=timeout)
+
+    def _handle_event(self, event):
+        "Add build and push totals to the stage metrics before passing events on"
+
+        # Target builds and pushes run concurrently, each adds its own totals
+        if event["event"] == "build_complete":
+            self.instrumentation.add("build_steps", event["steps"])
+            self.instrumentation.add("cached_build_steps", event["cached_steps"])
+        elif event["event"] == "push_complete":
+            self.instrumentation.add("bytes_pushed", event["bytes_pushed"])
+            self.instrumentation.add("layers_pushed", event["layers_pushed"])
+            self.instrumentation.add("layers_skipped", event["layers_skipped"])
+
+        if self.event_callback is not None:
+            self.event_callback(event)
 
+    @instrumented(profile=True)
     def _localize_source(self, source, dest, checkout):
+        from app_pack_generator import GitManager
+        from .git_helper import clone_source, is_checked_out
+
+        # GitManager only does full clones, so make shallow or mirror referenced clones of
+        # remote repositories beforehand and let GitManager pick up the existing clone
+        if (self.shallow_clone or self.use_git_mirror) and dest is not None and not os.path.exists(source) and \
+           not (os.path.exists(dest) and len(os.listdir(dest)) > 0):
+
+            clone_source(source, dest, checkout, shallow=self.shallow_clone, use_mirror=self.use_git_mirror)
 
         # Check out original repository
         git_mgr = GitManager(source, dest)
     
         if checkout is not None:
-            logger.info(f"Checking out {checkout} in {dest}")
-            git_mgr.checkout(checkout)
+            if is_checked_out(git_mgr.repo, checkout):
+                logger.info(f"{git_mgr.directory} is already at {checkout}, skipping checkout")
+            else:
+                logger.info(f"Checking out {checkout} in {dest}")
+                git_mgr.checkout(checkout)
 
         return git_mgr
 
-    def create_docker_image(self):
- 
-        # These come either from the commandline or are generated by Docker util
-        self.app_state.docker_image_namespace = self.docker_util.image_namespace
-        self.app_state.docker_image_repository = self.docker_util.image_repository
-        self.app_state.docker_image_tag = self.docker_util.image_tag
+    def _local_image_exists(self, image_reference):
+        import docker.errors
+
+        try:
+            self.docker_util.docker_client.images.get(image_reference)
+        except docker.errors.NotFound:
+            return False
+
+        return True
+
+    def _build_targets(self, targets=None):
+        "BuildTargets from the argument or else those recorded by the last build"
+
+        if targets is None:
+            return [ BuildTarget.from_dict(t) for t in self.app_state.docker_targets.values() ]
+
+        try:
+            return parse_build_targets(targets)
+        except BuildTargetError as err:
+            raise ApplicationGenerationError(str(err))
+
+    def _cache_sources(self, cache_from, env_image_reference, target=None):
+        """
+        Images used as layer cache sources for building the image of target or the single image when
+        target is None. Unless cache_from is given these are the images of the previous build and push.
+        """
+
+        if cache_from is None:
+            if target is not None:
+                previous_target = self.app_state.docker_targets.get(target.name, {})
+                cache_from = [ previous_target.get("docker_url"), previous_target.get("image_reference") ]
+            elif not self.app_state.docker_targets:
+                cache_from = [ self.app_state.docker_url, self.app_state.docker_image_reference ]
+            else:
+                cache_from = []
+
+        cache_sources = []
+        for cache_image in cache_from + [env_image_reference]:
+            if cache_image is not None and cache_image not in cache_sources:
+                cache_sources.append(cache_image)
+
+        return cache_sources
+
+    def _build_target_images(self, targets, image_reference, target_cache_sources):
+        "Build the image of each target concurrently, the builds share the layer cache of the Docker daemon"
+
+        with ContextThreadPoolExecutor(max_workers=len(targets)) as executor:
+            target_futures = { target.name: executor.submit(self.docker_util.build_target,
+                                                            target.image_reference(image_reference),
+                                                            platform=target.platform,
+                                                            base_image=target.base_image,
+                                                            target_name=target.name,
+                                                            cache_from=target_cache_sources[target.name])
+                               for target in targets }
+
+            return { name: future.result() for name, future in target_futures.items() }
+
+    def _docker_build_fingerprint(self, targets, repo_config):
+        "Fingerprint of the checked out source, repo2docker config and targets that an image is built from"
+
+        exclude_paths = [self.app_state.state_directory]
+
+        # A repo2docker config given as a URL is downloaded into the repository by DockerUtil
+        if repo_config is not None and not os.path.exists(repo_config):
+            exclude_paths.append(os.path.join(self.repo_info.directory, os.path.basename(repo_config)))
+
+        extra_files = [repo_config]
+        if len(targets) > 0:
+            extra_files.append(json.dumps([ t.to_dict() for t in targets ]))
+
+        return source_fingerprint(self.repo_info, extra_files=extra_files, exclude_paths=exclude_paths)
+
+    def _layer_reports(self, image_references):
+        "Log and return the size of the layers of local images by image reference"
+
+        images = self.docker_util.docker_client.images
+
+        layer_reports = { ref: layer_report(images.get(ref)) for ref in image_references }
+
+        for image_reference, layers in layer_reports.items():
+            logger.info(format_layer_report(image_reference, layers))
+
+        return layer_reports
+
+    def _optimized_image_reference(self, image_reference, slim, lazy_format):
+
+        image_repository, _, image_tag = image_reference.rpartition(":")
+
+        suffixes = ([ "slim" ] if slim else []) + ([ lazy_format ] if lazy_format is not None else [])
+
+        return f"{image_repository}:{image_tag}-{'-'.join(suffixes)}"
+
+    def _optimize_image(self, slim=False, lazy_format=None, force=False):
+        """
+        Create an image optimized for pulling from the built image. With slim, content only needed to
+        build the image is removed from its layers. With lazy_format the image is converted to a format
+        that can be started before it is fully pulled. The optimized image is recorded so that it is
+        pushed and used in CWL files instead of the built image.
+        """
+
+        if not slim and lazy_format is None:
+            if self.app_state.docker_optimized_image is not None:
+                self.app_state.docker_optimized_image = None
+            return
+
+        if self.app_state.docker_targets:
+            raise ApplicationGenerationError("Image optimization is not supported for images built for multiple targets")
+
+        if lazy_format is not None and lazy_format not in LAZY_PULL_FORMATS:
+            raise ApplicationGenerationError(f"Unknown lazy pull format {lazy_format}, expected one of: {', '.join(LAZY_PULL_FORMATS)}")
+
+        images = self.docker_util.docker_client.images
+
+        image_reference = self.app_state.docker_image_reference
+        source_image = images.get(image_reference)
+
+        optimize_options = { "slim": slim, "lazy_format": lazy_format }
+        optimized_reference = self._optimized_image_reference(image_reference, slim, lazy_format)
+
+        previous = self.app_state.docker_optimized_image
+
+        if not force and previous is not None and \
+           previous["source_id"] == source_image.id and \
+           previous["options"] == optimize_options and \
+           self._local_image_exists(previous["image_reference"]):
+
+            logger.info(f"{image_reference} unchanged since it was optimized into {previous['image_reference']}, skipping optimization")
+            return
+
+        optimized_image = { "source_id": source_image.id, "options": optimize_options, "source_size": source_image.attrs["Size"] }
+
+        current_reference = image_reference
+
+        if slim:
+            slim_reference = optimized_reference if lazy_format is None else self._optimized_image_reference(image_reference, True, None)
+
+            # The state directory is part of the repository copied into the image
+            extra_repo_paths = []
+            state_rel_path = os.path.relpath(self.app_state.state_directory, self.repo_info.directory)
+            if not state_rel_path.startswith(os.pardir):
+                extra_repo_paths.append(state_rel_path)
+
+            logger.info(f"Removing build only content from {image_reference} into {slim_reference}")
+
+            try:
+                slim_result = ImageSlimmer(self.docker_util.docker_client).slim(image_reference, slim_reference,
+                                                                                build_only_paths(source_image, extra_repo_paths))
+            except ImageOptimizationError as err:
+                raise ApplicationGenerationError(str(err))
+
+            logger.info(f"Removed {slim_result['stripped_files']} build only files, {slim_result['stripped_bytes'] / 1e6:.1f} MB " +
+                        f"from {slim_result['layers_rewritten']} layers of {image_reference}")
+
+            optimized_image.update(slim_result)
+            current_reference = slim_reference
+
+        if lazy_format is not None:
+            notebook_paths = [ notebook_app.notebook_path for notebook_app in self._recorded_notebook_applications() ]
+
+            try:
+                self.docker_util.convert_image(current_reference, optimized_reference, lazy_format,
+                                               priority_paths=startup_paths(source_image, notebook_paths))
+            except FileNotFoundError:
+                raise ApplicationGenerationError(f"Converting images to {lazy_format} requires the nerdctl command")
+
+            if not self._local_image_exists(optimized_reference):
+                raise ApplicationGenerationError(f"Converted image {optimized_reference} is not visible to Docker, " +
+                                                 "lazy pull formats require Docker to use the containerd image store")
+
+        optimized_image["image_reference"] = optimized_reference
+        optimized_image["size"] = images.get(optimized_reference).attrs["Size"]
+
+        logger.info(f"Optimized image {optimized_reference}: {optimized_image['size'] / 1e6:.1f} MB, " +
+                    f"built image {optimized_image['source_size'] / 1e6:.1f} MB")
+
+        with self.app_state.batch():
+            self.app_state.docker_optimized_image = optimized_image
+            self.app_state.docker_layer_reports = { **self.app_state.docker_layer_reports, **self._layer_reports([optimized_reference]) }
+
+        self.instrumentation.record(optimized_image_bytes=optimized_image["size"], stripped_bytes=optimized_image.get("stripped_bytes", 0))
+
+    def _pushed_image_reference(self):
+        "Local reference of the image to push, the optimized image when there is one"
+
+        if (optimized_image := self.app_state.docker_optimized_image) is not None:
+            return optimized_image["image_reference"]
+
+        if self.app_state.docker_image_reference is not None:
+            return self.app_state.docker_image_reference
+
+        return self.docker_util.image_reference
+
+    def _remote_build_source(self):
+        "Source repository, commit and checkout directory name a builder node builds the image from"
+        from .git_helper import is_remote_source, commit_on_remote
+
+        source_repository = self.app_state.source_repository
+        repo = self.repo_info.repo
+
+        # A local path would be resolved on the builder node, where it is a different repository or does not exist
+        if not is_remote_source(source_repository):
+            raise ApplicationGenerationError(f"Source repository {source_repository} is not a Git URL, a build worker can not clone it")
+
+        # Builder nodes clone the source repository so changes that are not committed would be missing from the image
+        untracked_files = [ path for path in repo.untracked_files
+                            if not os.path.realpath(os.path.join(self.repo_info.directory, path)).startswith(self.app_state.state_directory + os.sep) ]
+
+        if repo.is_dirty() or len(untracked_files) > 0:
+            raise ApplicationGenerationError(f"{self.repo_info.directory} has changes that are not committed, they would not be part of an image built by a build worker")
+
+        commit = repo.head.commit.hexsha
+
+        if not commit_on_remote(repo, source_repository, commit):
+            raise ApplicationGenerationError(f"Commit {commit} of {self.repo_info.directory} is not pushed to {source_repository}, a build worker could not check it out")
 
-        # Create Docker image
-        self.app_state.docker_image_reference = self.docker_util.build_image()
+        return {
+            "source_repository": source_repository,
+            "checkout": commit,
+            "repo_name": self.repo_info.name,
+        }
 
-    def push_to_docker_registry(self, docker_registry):
+    def _remote_docker_image(self, build_queue, build_timeout, force, targets, cache_from, env_cache, slim, lazy_format):
+        """
+        Build the application Docker image on a builder node through build_queue and record the
+        image it built. Workers with a warm layer cache for the source repository or its environment
+        files are preferred.
+        """
+        from .build_queue import BuildQueueError
+
+        build_source = self._remote_build_source()
+
+        repo_config = self._docker_util_options["repo_config"]
+        build_fingerprint = self._docker_build_fingerprint(targets, repo_config)
+
+        affinity_keys = [ f"source:{build_source['source_repository']}" ]
+        for target in (targets if len(targets) > 0 else [None]):
+            target_values = [ target.platform, target.base_image ] if target is not None else []
+            affinity_keys.append(f"environment:{environment_fingerprint(self.repo_info.directory, extra_values=[repo_config] + target_values)}")
+
+        # A local repo2docker config file is sent along with the job, URLs are downloaded by the worker
+        config_file = repo_config
+        if repo_config is not None and os.path.exists(repo_config):
+            with open(repo_config, "r") as repo_config_file:
+                config_file = { "name": os.path.basename(repo_config), "contents": repo_config_file.read() }
+
+        job_args = {
+            **build_source,
+            "config_file": config_file,
+            "image_namespace": self._docker_util_options["use_namespace"],
+            "image_repository": self._docker_util_options["use_repository"],
+            "image_tag": self._docker_util_options["use_tag"],
+            "targets": [ t.to_dict() for t in targets ] if len(targets) > 0 else None,
+            "cache_from": cache_from,
+            "env_cache": env_cache,
+            "slim": slim,
+            "lazy_format": lazy_format,
+            "force": force,
+        }
+
+        build_executor = self._build_executor(build_queue, timeout=build_timeout)
+
+        try:
+            worker_id, build_values = build_executor.run("build", job_args, affinity_keys=affinity_keys)
+        except BuildQueueError as err:
+            raise ApplicationGenerationError(str(err))
+
+        with self.app_state.batch():
+            for name, value in build_values["state_values"].items():
+                setattr(self.app_state, name, value)
+
+            self.app_state.docker_build_fingerprint = build_fingerprint
+            self.app_state.docker_builder = { **build_source, "build_queue": build_executor.queue_directory, "timeout": build_timeout,
+                                              "worker_id": worker_id, "image_id": build_values["image_id"] }
+
+        for image_reference, layers in self.app_state.docker_layer_reports.items():
+            logger.info(format_layer_report(image_reference, layers))
+
+        self.instrumentation.record(build_worker=worker_id)
+
+    def _remote_push(self, container_registry=None, use_ecr=False, force=False):
+        "Push the image from the builder node that built it and record where it was pushed"
+        from .build_queue import BuildQueueError
+
+        docker_builder = self.app_state.docker_builder
+
+        job_args = {
+            "source_repository": docker_builder["source_repository"],
+            "checkout": docker_builder["checkout"],
+            "repo_name": docker_builder["repo_name"],
+            "image_id": docker_builder["image_id"],
+            "container_registry": container_registry,
+            "use_ecr": use_ecr,
+            "force": force,
+        }
+
+        build_executor = self._build_executor(docker_builder["build_queue"], timeout=docker_builder["timeout"])
+
+        try:
+            worker_id, push_values = build_executor.run("push", job_args, pinned_worker=docker_builder["worker_id"])
+        except BuildQueueError as err:
+            raise ApplicationGenerationError(str(err))
+
+        with self.app_state.batch():
+            for name, value in push_values["state_values"].items():
+                setattr(self.app_state, name, value)
+
+        self.instrumentation.record(build_worker=worker_id)
+
+    @checkpointed("build_docker", ["targets", "cache_from", "env_cache", "slim", "lazy_format", "build_queue", "build_timeout"])
+    @instrumented()
+    def create_docker_image(self, force=False, targets=None, cache_from=None, env_cache=True, slim=False, lazy_format=None,
+                            build_queue=None, build_timeout=None):
+        """
+        Build the application Docker image. targets optionally lists BuildTarget objects or
+        specification strings to build one image per platform or base image instead of one
+        image for the host platform. Without targets those of the previous build are used.
+
+        cache_from lists images to use as layer cache sources instead of the images from the
+        previous build and push. When env_cache is enabled, images previously built from the
+        same environment files are also used as cache sources.
+
+        The size of each layer of the built image is reported. slim and lazy_format create an
+        optimized image for pushing, see _optimize_image.
+
+        With build_queue the image is built by a builder node serving that queue directory
+        and later pushed from there, see unity_app_generator.build_queue. build_timeout limits
+        the seconds to wait for the worker.
+        """
+
+        targets = self._build_targets(targets)
+
+        if build_queue is not None:
+            return self._remote_docker_image(build_queue, build_timeout, force, targets, cache_from, env_cache, slim, lazy_format)
+
+        # Skip the build when the checked out source and repo2docker config are unchanged since
+        # the image was last built and that image is still present in the local Docker daemon
+        repo_config = self.docker_util.repo_config
+        build_fingerprint = self._docker_build_fingerprint(targets, repo_config)
+
+        image_reference = self.docker_util.image_reference
+
+        if len(targets) > 0:
+            local_references = [ t.image_reference(image_reference) for t in targets ]
+        else:
+            local_references = [ image_reference ]
+
+        if not force and \
+           build_fingerprint == self.app_state.docker_build_fingerprint and \
+           image_reference == self.app_state.docker_image_reference and \
+           self.app_state.docker_builder is None and \
+           all([ self._local_image_exists(ref) for ref in local_references ]):
+
+            logger.info(f"Source unchanged since {image_reference} was built, skipping Docker image build")
+            self.instrumentation.record(cache_hit=True)
+
+            self._optimize_image(slim, lazy_format)
+            return
+
+        self.instrumentation.record(cache_hit=False)
+
+        env_store = EnvironmentImageStore(self.docker_util.docker_client)
+
+        # Environment fingerprints and cache sources by target name, the single image has no target name
+        env_fingerprints = {}
+        cache_sources = {}
+        env_cache_hits = 0
+        for target in (targets if len(targets) > 0 else [None]):
+            target_name = target.name if target is not None else None
+            target_values = [ target.platform, target.base_image ] if target is not None else []
+
+            env_fingerprints[target_name] = environment_fingerprint(self.repo_info.directory, extra_values=[repo_config] + target_values)
+
+            env_image_reference = env_store.find(env_fingerprints[target_name]) if env_cache else None
+            if env_image_reference is not None:
+                logger.info(f"Using {env_image_reference} built from the same environment files as a layer cache source")
+                env_cache_hits += 1
+
+            cache_sources[target_name] = self._cache_sources(cache_from, env_image_reference, target)
+
+        self.instrumentation.record(env_cache_hits=env_cache_hits)
+
+        with self.app_state.batch():
+            # These come either from the commandline or are generated by Docker util
+            self.app_state.docker_image_namespace = self.docker_util.image_namespace
+            self.app_state.docker_image_repository = self.docker_util.image_repository
+            self.app_state.docker_image_tag = self.docker_util.image_tag
+
+            # Create Docker image, with multiple targets the image reference names their manifest list once pushed
+            if len(targets) > 0:
+                target_references = self._build_target_images(targets, image_reference, cache_sources)
+
+                self.app_state.docker_image_reference = image_reference
+                self.app_state.docker_targets = { t.name: { **t.to_dict(), "image_reference": target_references[t.name] } for t in targets }
+            else:
+                self.docker_util.cache_from = cache_sources[None]
+
+                self.app_state.docker_image_reference = self.docker_util.build_image()
+                self.app_state.docker_targets = {}
+                target_references = { None: self.app_state.docker_image_reference }
+
+            self.app_state.docker_build_fingerprint = build_fingerprint
+            self.app_state.docker_builder = None
+
+            self.app_state.docker_layer_reports = self._layer_reports(local_references)
+
+        if env_cache:
+            for target_name, target_reference in target_references.items():
+                env_store.store(env_fingerprints[target_name], target_reference)
+
+        self.instrumentation.record(image_bytes=sum([ self.docker_util.docker_client.images.get(ref).attrs["Size"] for ref in local_references ]))
+
+        self._optimize_image(slim, lazy_format, force=force)
+
+    def _registry_image_dest(self, registry_url):
+
+        return f"{registry_url}/{self._pushed_image_reference()}"
+
+    def _registry_image_digest(self, reg_image_dest):
+        import docker.errors
+
+        try:
+            return self.docker_util.docker_client.images.get_registry_data(reg_image_dest).id
+        except docker.errors.APIError as err:
+            logger.debug(f"Could not retrieve registry digest for {reg_image_dest}: {err}")
+            return None
+
+    def _local_image_id(self):
+        "Id of the local image, or a combined id of the target images when built for multiple targets"
+        import docker.errors
+
+        images = self.docker_util.docker_client.images
+
+        try:
+            if not self.app_state.docker_targets:
+                return images.get(self._pushed_image_reference()).id
+
+            return values_fingerprint({ name: images.get(target["image_reference"]).id for name, target in self.app_state.docker_targets.items() })
+        except docker.errors.NotFound:
+            return None
+
+    def _push_is_current(self, reg_image_dest, remote_digest_func):
+        "Check if the local image was already pushed to reg_image_dest and the registry still has the same digest"
+
+        if self.app_state.docker_url != reg_image_dest or self.app_state.docker_image_digest is None:
+            return False
+
+        local_image_id = self._local_image_id()
+
+        if local_image_id is None or local_image_id != self.app_state.docker_pushed_image_id:
+            return False
+
+        # Only contact the registry once all local checks pass
+        return remote_digest_func() == self.app_state.docker_image_digest
+
+    def _push_target_images(self, registry_url):
+        """
+        Push the images of all targets concurrently then combine the images using the default base
+        image into a manifest list under the application image reference. Returns the manifest list
+        URL and digest.
+        """
+
+        targets = self.app_state.docker_targets
+
+        with ContextThreadPoolExecutor(max_workers=len(targets)) as executor:
+            target_futures = { name: executor.submit(self.docker_util.push_image, registry_url, target["image_reference"],
+                                                     event_fields={ "target": name })
+                               for name, target in targets.items() }
+
+            target_urls = { name: future.result() for name, future in target_futures.items() }
+
+        docker_url = self._registry_image_dest(registry_url)
+        manifest_sources = [ target_urls[name] for name, target in targets.items() if target["base_image"] is None ]
+
+        image_digest = self.docker_util.create_manifest_list(docker_url, manifest_sources)
+
+        self.app_state.docker_targets = { name: { **target, "docker_url": target_urls[name] } for name, target in targets.items() }
+
+        image_bytes = sum([ self.docker_util.docker_client.images.get(target["image_reference"]).attrs["Size"] for target in targets.values() ])
+        self.instrumentation.record(cache_hit=False, image_bytes=image_bytes)
+
+        return docker_url, image_digest
+
+    def _push_image(self, registry_url, remote_digest_func):
+
+        if self.app_state.docker_targets:
+            with self.app_state.batch():
+                docker_url, image_digest = self._push_target_images(registry_url)
+
+                self.app_state.docker_url = docker_url
+                self.app_state.docker_pushed_image_id = self._local_image_id()
+                self.app_state.docker_image_digest = image_digest
+
+            return
 
         # Push to remote repository
-        self.app_state.docker_url = self.docker_util.push_image(docker_registry, self.app_state.docker_image_reference)
+        docker_url = self.docker_util.push_image(registry_url, self._pushed_image_reference())
+
+        local_image = self.docker_util.docker_client.images.get(docker_url)
+
+        self.instrumentation.record(cache_hit=False, image_bytes=local_image.attrs["Size"])
 
-    def push_to_aws_ecr(self):
+        # The registry reports the digest at the end of a streamed push, otherwise ask for it
+        image_digest = getattr(self.docker_util, "last_push_digest", None)
+        if image_digest is None:
+            image_digest = remote_digest_func()
+
+        with self.app_state.batch():
+            self.app_state.docker_url = docker_url
+            self.app_state.docker_pushed_image_id = local_image.id
+            self.app_state.docker_image_digest = image_digest
+
+    @checkpointed("push_docker", ["docker_registry"])
+    @instrumented()
+    def push_to_docker_registry(self, docker_registry, force=False):
+
+        # Images built by a build worker are only present in the Docker daemon of that worker
+        if self.app_state.docker_builder is not None:
+            self._remote_push(container_registry=docker_registry, force=force)
+            return
+
+        reg_image_dest = self._registry_image_dest(docker_registry)
+        remote_digest_func = lambda: self._registry_image_digest(reg_image_dest)
+
+        if not force and self._push_is_current(reg_image_dest, remote_digest_func):
+            logger.info(f"Registry already contains {reg_image_dest} with digest {self.app_state.docker_image_digest}, skipping push")
+            self.instrumentation.record(cache_hit=True)
+            return
+
+        self._push_image(docker_registry, remote_digest_func)
+
+    @checkpointed("push_ecr")
+    @instrumented()
+    def push_to_aws_ecr(self, force=False):
+        from .ecr_helper import ECRHelper
+
+        if self.app_state.docker_builder is not None:
+            self._remote_push(use_ecr=True, force=force)
+            return
 
         ecr_helper = ECRHelper(self.docker_util)
 
         # Create an ECR registry if it doesn't already exist
-        ecr_helper.create_repository()
+        repository_uri = ecr_helper.create_repository()
+
+        # ECR can be queried for the image digest without logging into Docker
+        image_tag = self._pushed_image_reference().rpartition(":")[2]
+
+        reg_image_dest = self._registry_image_dest(repository_uri.split("/")[0])
+        remote_digest_func = lambda: ecr_helper.image_digest(image_tag)
+
+        if not force and self._push_is_current(reg_image_dest, remote_digest_func):
+            logger.info(f"ECR already contains {reg_image_dest} with digest {self.app_state.docker_image_digest}, skipping push")
+            self.instrumentation.record(cache_hit=True)
+            return
 
         # Log in to ECR via Docker
         registry_url = ecr_helper.docker_login()
 
+        # Manifest lists of multiple targets are created with the docker command line client
+        if self.app_state.docker_targets:
+            ecr_helper.docker_cli_login()
+
         # Push docker image into ECR
-        self.push_to_docker_registry(registry_url)
+        try:
+            self._push_image(registry_url, remote_digest_func)
+        except Exception:
+            # The cached repository URI outlives a repository deleted since it was cached
+            if ecr_helper.repository_exists():
+                raise
+
+            logger.warning(f"AWS ECR repository {ecr_helper.repository_name} no longer exists, creating it again")
+
+            ecr_helper.forget_repository()
+            ecr_helper.create_repository()
+
+            self._push_image(registry_url, remote_digest_func)
 
     def _generate_dockstore_cwl(self, cwl_output_path, target_cwl_filename):
 
@@ -98,14 +749,137 @@ step:
         with open(dockstore_cwl_filename, "w") as cwl_file:
             cwl_file.write(template.lstrip())
 
-    def create_cwl(self, cwl_output_path=None, docker_url=None, monolithic=False):
+        return dockstore_cwl_filename
+
+    def _cwl_outputs_current(self, cwl_output_path):
+        "Check that the files recorded from the last CWL generation exist with the same contents"
+
+        output_hashes = self.app_state.cwl_output_hashes
+
+        if not output_hashes:
+            return False
+
+        for output_basename, output_digest in output_hashes.items():
+            output_filename = os.path.join(cwl_output_path, output_basename)
+
+            if not os.path.exists(output_filename) or file_digest(output_filename) != output_digest:
+                return False
+
+        return True
+
+    def _cwl_bundle_current(self):
+        "Check that the bundle recorded from the last CWL generation exists with the recorded files"
+
+        if self.app_state.cwl_bundle_path is None or not os.path.exists(self.app_state.cwl_bundle_path):
+            return False
+
+        try:
+            with ArtifactBundle(self.app_state.cwl_bundle_path) as bundle:
+                return bundle.files == self.app_state.cwl_output_hashes
+        except BundleError as err:
+            logger.debug(str(err))
+            return False
+
+    def _store_cwl_bundle(self, artifact_cache, generated_filenames, generate_path, input_fingerprint, cwl_applications):
+        "Store generated files as a bundle in the artifact cache in place of the CWL output directory"
+
+        bundle_filename = artifact_cache.store_bundle(generated_filenames, base_directory=generate_path)
+
+        with ArtifactBundle(bundle_filename) as bundle:
+            output_hashes = bundle.files
+
+        files_rewritten = [ bundle_filename ] if bundle_filename != self.app_state.cwl_bundle_path else []
+
+        with self.app_state.batch():
+            self.app_state.cwl_input_fingerprint = input_fingerprint
+            self.app_state.cwl_output_hashes = output_hashes
+            self.app_state.cwl_bundle_path = bundle_filename
+            self.app_state.cwl_applications = cwl_applications
+
+        self.instrumentation.record(files_rewritten=len(files_rewritten), bundle_bytes=artifact_cache.bundle_size(bundle_filename))
+
+        artifact_cache.prune()
+
+        if len(files_rewritten) > 0:
+            logger.info(f"Wrote CWL files into bundle {bundle_filename}: " + ", ".join(sorted(output_hashes.keys())))
+        else:
+            logger.info(f"Generated CWL files are unchanged in bundle {bundle_filename}")
+
+        return files_rewritten
+
+    def _notebook_applications(self, notebooks=None):
+        "NotebookApplications for the notebooks paths or patterns given, or else those discovered in the repository"
+        from app_pack_generator.application import ApplicationError
+        from .notebook import notebook_applications
+
+        try:
+            return notebook_applications(self.repo_info.directory, self.repo_info.name, notebooks,
+                                         exclude_paths=[self.app_state.state_directory])
+        except ApplicationError as err:
+            raise ApplicationGenerationError(str(err))
+
+    def _recorded_notebook_applications(self):
+        "NotebookApplications that the last CWL generation produced files for"
+        from .notebook import NotebookApplication, DEFAULT_NOTEBOOK
+
+        # Files generated before multiple notebooks were supported are from the default notebook
+        if not self.app_state.cwl_applications:
+            return [ NotebookApplication(DEFAULT_NOTEBOOK, self.repo_info.name) ]
+
+        return [ NotebookApplication.from_dict(name, values) for name, values in self.app_state.cwl_applications.items() ]
+
+    def _generate_application_cwl(self, notebook_app, descriptor_repository, generate_path, docker_url, monolithic):
+        "Generate the CWL files and descriptor of one notebook application into its subdirectory of generate_path"
+        from app_pack_generator import ProcessCWL, DataStagingCWL, Descriptor
+        from .notebook import load_notebook
+
+        app = load_notebook(os.path.join(self.repo_info.directory, notebook_app.notebook_path), self.app_state.state_directory)
+
+        logger.info(f"Parameters of {notebook_app.notebook_path}:\n" + app.parameter_summary())
+
+        app_path = os.path.join(generate_path, notebook_app.subdirectory)
+        os.makedirs(app_path, exist_ok=True)
+
+        # Create CWL files depending on the mode of production
+        cwl_generators = [ ProcessCWL(app) ]
+
+        if monolithic:
+            cwl_generators.append( DataStagingCWL(app) )
+
+        files_created = []
+        for cwl_gen in cwl_generators:
+            files_created += cwl_gen.generate_all(app_path, dockerurl=docker_url)
+
+        # Add the JSON descriptor file
+        desc = Descriptor(app, descriptor_repository)
+        files_created.append(desc.generate_descriptor(app_path, docker_url))
+
+        # Add Dockstore.cwl, point it to the appropriate entry point
+        if monolithic:
+            files_created.append(self._generate_dockstore_cwl(app_path, "workflow.cwl"))
+        else:
+            files_created.append(self._generate_dockstore_cwl(app_path, "process.cwl"))
+
+        return files_created
+
+    @checkpointed("build_cwl", ["cwl_output_path", "docker_url", "monolithic", "bundle", "artifact_cache", "notebooks"])
+    @instrumented(profile=True)
+    def create_cwl(self, cwl_output_path=None, docker_url=None, monolithic=False, force=False, bundle=False, artifact_cache=None, notebooks=None):
+        """
+        Generate the CWL files and application descriptor of each notebook application. notebooks
+        lists notebook paths or glob patterns relative to the repository, without it those last used
+        are used or else the notebooks are discovered. With multiple notebooks the files of each are
+        generated in parallel into its own subdirectory. With bundle the files are stored in the
+        artifact_cache directory, recorded by a single bundle manifest, instead of in cwl_output_path.
+        """
+        from app_pack_generator import __version__ as app_pack_generator_version
 
         # Fall through using docker_image_reference if docker_url does not exist because no push has occurred
         # Or if docker_url is supplied as an argument use that
         if docker_url is None and self.app_state.docker_url is not None:
             docker_url = self.app_state.docker_url
         elif docker_url is None and self.app_state.docker_image_reference is not None:
-            docker_url = self.app_state.docker_image_reference
+            docker_url = self._pushed_image_reference()
         elif docker_url is None:
             raise ApplicationGenerationError("Cannot create CWL files when Docker image tag or URL has not yet been registered through building and/or pushing Docker image")
         
@@ -116,76 +890,477 @@ step:
         else:
             cwl_output_path = self.app_state.cwl_output_path
 
-        if not os.path.exists(cwl_output_path):
+        if not bundle and not os.path.exists(cwl_output_path):
             os.makedirs(cwl_output_path)
-    
-        notebook_filename = os.path.join(self.repo_info.directory, "process.ipynb")
 
-        app = ApplicationNotebook(notebook_filename)
+        # Declared notebooks are kept for later runs like the CWL output path
+        if notebooks is not None:
+            self.app_state.cwl_notebooks = notebooks
+        else:
+            notebooks = self.app_state.cwl_notebooks
 
-        logger.info("Parameters:\n" + app.parameter_summary())
-            
-        # Create CWL files depending on the mode of production
-        cwl_generators = [ ProcessCWL(app) ]
+        notebook_apps = self._notebook_applications(notebooks)
 
-        if monolithic:
-            cwl_generators.append( DataStagingCWL(app) )
+        # Everything that goes into the generated files, if none of it changed
+        # and the files are intact there is nothing to regenerate
+        cwl_inputs = {
+            "notebooks": { notebook_app.name: [ notebook_app.notebook_path, notebook_app.subdirectory,
+                                                file_digest(os.path.join(self.repo_info.directory, notebook_app.notebook_path)) ]
+                           for notebook_app in notebook_apps },
+            "commit": self.repo_info.repo.head.commit.hexsha,
+            "repo_name": self.repo_info.name,
+            "repo_owner": self.repo_info.owner,
+            "docker_url": docker_url,
+            "monolithic": monolithic,
+            "cwl_output_path": os.path.realpath(cwl_output_path),
+            "app_pack_generator_version": app_pack_generator_version,
+        }
 
-        files_created = []
-        for cwl_gen in cwl_generators:
-            files_created += cwl_gen.generate_all(cwl_output_path, dockerurl=docker_url)
-        
-        # Add the JSON descriptor file
-        desc = Descriptor(app, self.repo_info)
-        files_created.append(desc.generate_descriptor(cwl_output_path, docker_url))
+        if bundle:
+            artifact_cache = ArtifactCache(artifact_cache)
+            cwl_inputs["artifact_cache"] = artifact_cache.cache_directory
 
-        # Add Dockstore.cwl, point it to the appropriate entry point
-        if monolithic:
-            self._generate_dockstore_cwl(cwl_output_path, "workflow.cwl")
+        input_fingerprint = values_fingerprint(cwl_inputs)
+
+        outputs_current = self._cwl_bundle_current() if bundle else self._cwl_outputs_current(cwl_output_path)
+
+        if not force and \
+           input_fingerprint == self.app_state.cwl_input_fingerprint and \
+           outputs_current:
+
+            logger.info(f"Inputs unchanged since CWL files were generated, skipping CWL generation")
+            self.instrumentation.record(cache_hit=True)
+            return []
+
+        self.instrumentation.record(cache_hit=False, notebooks=len(notebook_apps))
+
+        cwl_applications = { notebook_app.name: notebook_app.to_dict() for notebook_app in notebook_apps }
+
+        # Generate into a temporary directory so that only files whose contents
+        # changed are moved into the output directory. Bundles are assembled on local disk.
+        with tempfile.TemporaryDirectory(prefix=".generate_", dir=(cwl_output_path if not bundle else None)) as generate_path:
+
+            with ContextThreadPoolExecutor(max_workers=min(len(notebook_apps), MAX_CWL_WORKERS)) as executor:
+                app_futures = [ executor.submit(self._generate_application_cwl, notebook_app, notebook_app.descriptor_repository(self.repo_info),
+                                                generate_path, docker_url, monolithic)
+                                for notebook_app in notebook_apps ]
+
+                files_created = [ filename for future in app_futures for filename in future.result() ]
+
+            if bundle:
+                return self._store_cwl_bundle(artifact_cache, files_created, generate_path, input_fingerprint, cwl_applications)
+
+            previous_hashes = self.app_state.cwl_output_hashes
+            output_hashes = {}
+            files_rewritten = []
+
+            # Files are identified by their path relative to the output directory
+            for generated_filename in files_created:
+                output_relpath = os.path.relpath(generated_filename, generate_path)
+                output_filename = os.path.join(cwl_output_path, output_relpath)
+
+                output_hashes[output_relpath] = file_digest(generated_filename)
+
+                if not os.path.exists(output_filename) or previous_hashes.get(output_relpath) != output_hashes[output_relpath]:
+                    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+                    shutil.move(generated_filename, output_filename)
+                    files_rewritten.append(output_filename)
+
+        # Remove files from a previous generation that are no longer produced, such as
+        # the staging CWL files when switching away from monolithic mode or of removed notebooks
+        for old_relpath in previous_hashes.keys() - output_hashes.keys():
+            old_filename = os.path.join(cwl_output_path, old_relpath)
+            if os.path.exists(old_filename):
+                logger.info(f"Removing no longer generated file: {old_filename}")
+                os.remove(old_filename)
+
+            old_directory = os.path.dirname(old_filename)
+            if os.path.dirname(old_relpath) != "" and os.path.isdir(old_directory) and len(os.listdir(old_directory)) == 0:
+                os.rmdir(old_directory)
+
+        with self.app_state.batch():
+            self.app_state.cwl_input_fingerprint = input_fingerprint
+            self.app_state.cwl_output_hashes = output_hashes
+            self.app_state.cwl_bundle_path = None
+            self.app_state.cwl_applications = cwl_applications
+
+        self.instrumentation.record(files_rewritten=len(files_rewritten))
+
+        if len(files_rewritten) > 0:
+            logger.info("Rewrote CWL files:\n" + "\n".join(files_rewritten))
         else:
-            self._generate_dockstore_cwl(cwl_output_path, "process.cwl")
+            logger.info("Generated CWL files are unchanged")
+
+        return files_rewritten
+
+    @instrumented(profile=True)
+    def notebook_parameters(self, notebooks=None):
+        from .notebook import load_notebook
+
+        if notebooks is None:
+            notebooks = self.app_state.cwl_notebooks
+
+        params_strs = []
+        for notebook_app in self._notebook_applications(notebooks):
+            nb = load_notebook(os.path.join(self.repo_info.directory, notebook_app.notebook_path), self.app_state.state_directory)
+
+            params_str = f"Parsed Notebook Parameters of {notebook_app.notebook_path}:\n"
+            params_str += nb.parameter_summary()
 
-    def notebook_parameters(self):
+            params_strs.append(params_str)
 
-        notebook_filename = os.path.join(self.repo_info.directory, "process.ipynb")
+        return "\n\n".join(params_strs)
 
-        nb = ApplicationNotebook(notebook_filename)
+    def _app_cache_key(self, app_catalog, app_name):
 
-        params_str = "Parsed Notebook Parameters:\n"
-        params_str += nb.parameter_summary()
+        # Applications are only visible per account so key on the token without storing it
+        token_hash = hashlib.sha256(app_catalog.token.encode()).hexdigest()[:16]
 
-        return params_str
+        return f"{app_catalog.api_url}|{token_hash}|{app_name}"
 
-    def _find_existing_app(self, app_catalog, app_name):
+    def _find_existing_apps(self, app_catalog, app_names):
+        "Return a dictionary of the registered applications of the user named in app_names by name"
+        from unity_sds_client.services.application_service import ApplicationCatalogAccessError
 
+        app_cache = JSONCache("dockstore_apps", ttl=DOCKSTORE_APP_CACHE_TTL)
+
+        # Retrieving a single application by a cached id avoids listing every application of the user
+        found_apps = {}
+        for app_name in app_names:
+            if (cached_app_id := app_cache.get(self._app_cache_key(app_catalog, app_name))) is None:
+                continue
+
+            try:
+                app_info = app_catalog.application(cached_app_id)
+            except ApplicationCatalogAccessError as err:
+                logger.debug(f"Cached Dockstore application id {cached_app_id} for {app_name} is no longer valid: {err}")
+            else:
+                if app_info.dockstore_info['mode'] and app_info.name == app_name:
+                    found_apps[app_name] = app_info
+
+        missing_names = [ app_name for app_name in app_names if app_name not in found_apps ]
+
+        self.instrumentation.record(app_id_cache_hit=len(missing_names) == 0)
+
+        if len(missing_names) == 0:
+            return found_apps
+
+        # A single listing finds all of the applications missing from the cache
+        cache_values = {}
         for app_info in app_catalog.application_list(for_user=True):
-            if app_info.dockstore_info['mode'] and app_info.name == app_name:
-                return app_info
+            if app_info.dockstore_info['mode']:
+                cache_values[self._app_cache_key(app_catalog, app_info.name)] = app_info.id
+
+                if app_info.name in missing_names:
+                    found_apps[app_info.name] = app_info
+
+        app_cache.update(cache_values)
+
+        return found_apps
+
+    def _registry_files(self, notebook_apps):
+        """
+        Return the digests of the files to register by their path relative to the CWL output path
+        and a function returning the upload contents of a list of those paths. Files are read from
+        the CWL bundle when the last generation produced one, otherwise from the CWL output directory.
+        """
+
+        if (bundle_filename := self.app_state.cwl_bundle_path) is not None:
+            try:
+                with ArtifactBundle(bundle_filename) as bundle:
+                    file_hashes = dict(bundle.files)
+            except BundleError as err:
+                raise ApplicationGenerationError(str(err))
 
-    def push_to_application_registry(self, dockstore_api_url, dockstore_token):
+            def read_contents(relpaths):
+                with ArtifactBundle(bundle_filename) as bundle:
+                    return { relpath: bundle.read(relpath).decode() for relpath in relpaths }
 
-        if self.app_state.cwl_output_path is None or not os.path.exists(self.app_state.cwl_output_path):
+            return file_hashes, read_contents
+
+        cwl_output_path = self.app_state.cwl_output_path
+
+        if cwl_output_path is None or not os.path.exists(cwl_output_path):
             raise ApplicationGenerationError("Can not register into application registry before CWL generation step")
 
-        app_catalog = DockstoreAppCatalog(dockstore_api_url, dockstore_token) 
+        param_files = []
+        for notebook_app in notebook_apps:
+            app_path = os.path.join(cwl_output_path, notebook_app.subdirectory)
+            param_files += sorted(glob(os.path.join(app_path, "*.cwl")) + glob(os.path.join(app_path, "*.json")))
+
+        file_hashes = { os.path.relpath(filename, cwl_output_path): file_digest(filename) for filename in param_files }
+
+        def read_contents(relpaths):
+            contents = {}
+            for relpath in relpaths:
+                with open(os.path.join(cwl_output_path, relpath), "r") as param_file:
+                    contents[relpath] = param_file.read()
+            return contents
+
+        return file_hashes, read_contents
+
+    def _push_application_files(self, app_catalog, notebook_app, reg_app, file_hashes, read_contents, previous_id, force):
+        """
+        Register or update the Dockstore entry of one notebook application. Returns the registered
+        application and the number of bytes uploaded.
+        """
 
-        app_name = self.repo_info.name
-        cwl_param_files = glob(os.path.join(self.app_state.cwl_output_path, "*.cwl"))
-        json_param_files = glob(os.path.join(self.app_state.cwl_output_path, "*.json"))
+        app_name = notebook_app.name
 
-        print(json_param_files)
+        app_relpaths = [ relpath for relpath in file_hashes if os.path.dirname(relpath) == notebook_app.subdirectory ]
+
+        cwl_param_files = sorted([ relpath for relpath in app_relpaths if relpath.endswith(".cwl") ])
+        json_param_files = sorted([ relpath for relpath in app_relpaths if relpath.endswith(".json") ])
+
+        logger.debug(f"CWL files of {app_name}: {cwl_param_files}")
+        logger.debug(f"JSON files of {app_name}: {json_param_files}")
 
         if len(cwl_param_files) == 0:
-            raise ApplicationGenerationError("No application package CWL files found")
+            raise ApplicationGenerationError(f"No application package CWL files found for {app_name}")
 
         if len(json_param_files) == 0:
-            raise ApplicationGenerationError("No JSON parameter file found")
+            raise ApplicationGenerationError(f"No JSON parameter file found for {app_name}")
+
+        # Dockstore paths are the basenames within the directory of the application
+        def upload_contents(relpaths):
+            return { os.path.basename(relpath): contents for relpath, contents in read_contents(relpaths).items() }
+
+        if reg_app is not None:
+
+            # Only send files that changed since they were last uploaded to this application,
+            # Dockstore creates a new version for every upload
+            if not force and reg_app.id == previous_id:
+                previous_hashes = self.app_state.app_registry_file_hashes
+                is_changed = lambda relpath: previous_hashes.get(relpath) != file_hashes[relpath]
 
-        if (reg_app := self._find_existing_app(app_catalog, app_name)) is not None:
+                cwl_param_files = list(filter(is_changed, cwl_param_files))
+                json_param_files = list(filter(is_changed, json_param_files))
+
+            if len(cwl_param_files) == 0 and len(json_param_files) == 0:
+                logger.info(f"Files for application {app_name} unchanged since last upload to application registry, skipping upload")
+                return reg_app, 0
+
+            logger.info(f"Uploading files to application {app_name}: " + ", ".join(cwl_param_files + json_param_files))
+
+            cwl_contents = upload_contents(cwl_param_files)
+            json_contents = upload_contents(json_param_files)
 
             # Upload updated JSON and CWL files
-            reg_app = app_catalog.upload_files(reg_app, cwl_files=cwl_param_files, json_files=json_param_files)
+            app_catalog.upload_contents(reg_app, cwl_contents=cwl_contents, json_contents=json_contents)
 
         else:
+            cwl_contents = upload_contents(cwl_param_files)
+            json_contents = upload_contents(json_param_files)
+
             # Register a new application with the CWL and JSON files
-            reg_app = app_catalog.register(app_name=app_name, cwl_files=cwl_param_files, json_files=json_param_files, publish=True)
+            reg_app = app_catalog.register_contents(app_name=app_name, cwl_contents=cwl_contents, json_contents=json_contents, publish=True)
+
+            JSONCache("dockstore_apps", ttl=DOCKSTORE_APP_CACHE_TTL).set(self._app_cache_key(app_catalog, app_name), reg_app.id)
+
+        return reg_app, sum([ len(c.encode()) for c in list(cwl_contents.values()) + list(json_contents.values()) ])
+
+    @checkpointed("validate_cwl")
+    @instrumented()
+    def validate_cwl(self, force=False):
+        """
+        Check the generated CWL files and application descriptors locally before they are uploaded
+        to the application registry. Raises an error listing the problems found, warnings are logged.
+        Returns the issues found.
+        """
+
+        if not self.app_state.cwl_output_hashes:
+            raise ApplicationGenerationError("CWL files have not been generated, run build_cwl first")
+
+        file_hashes, read_contents = self._registry_files(self._recorded_notebook_applications())
+
+        if not force and file_hashes == self.app_state.cwl_validated_hashes:
+            logger.info("CWL files unchanged since they were last validated, skipping validation")
+            self.instrumentation.record(cache_hit=True)
+            return []
+
+        issues, num_memoized = PackageValidator().validate(file_hashes, read_contents)
+
+        errors = [ issue for issue in issues if issue["severity"] == "error" ]
+        warnings = [ issue for issue in issues if issue["severity"] == "warning" ]
+
+        self.instrumentation.record(cache_hit=num_memoized == len(file_hashes), files_checked=len(file_hashes),
+                                    files_memoized=num_memoized, validation_errors=len(errors), validation_warnings=len(warnings))
+
+        if len(warnings) > 0:
+            logger.warning("Validation warnings for generated CWL files:\n" + format_issues(warnings))
+
+        if len(errors) > 0:
+            raise ApplicationGenerationError("Generated CWL files failed validation:\n" + format_issues(errors))
+
+        logger.info(f"Validated {len(file_hashes)} CWL and descriptor files, {num_memoized} unchanged since checked before")
+
+        self.app_state.cwl_validated_hashes = file_hashes
+
+        return issues
+
+    @checkpointed("push_app_registry", ["dockstore_api_url"])
+    @instrumented(profile=True)
+    def push_to_application_registry(self, dockstore_api_url, dockstore_token, force=False):
+        """
+        Register the CWL files of each notebook application as its own Dockstore entry. Existing
+        applications are looked up together and the applications are uploaded concurrently.
+        """
+
+        notebook_apps = self._recorded_notebook_applications()
+
+        file_hashes, read_contents = self._registry_files(notebook_apps)
+
+        if (app_catalog_factory := self._app_catalog_factory) is None:
+            from .app_catalog import PooledDockstoreAppCatalog as app_catalog_factory
+
+        app_catalog = app_catalog_factory(dockstore_api_url, dockstore_token)
+
+        reg_apps = self._find_existing_apps(app_catalog, [ notebook_app.name for notebook_app in notebook_apps ])
+
+        previous_ids = self.app_state.app_registry_ids
+
+        # Ids recorded before multiple notebooks were supported belong to the application of the repository
+        if not previous_ids and self.app_state.app_registry_id is not None:
+            previous_ids = { self.repo_info.name: self.app_state.app_registry_id }
+
+        with ContextThreadPoolExecutor(max_workers=min(len(notebook_apps), MAX_REGISTRY_WORKERS)) as executor:
+            app_futures = { notebook_app.name: executor.submit(self._push_application_files, app_catalog, notebook_app,
+                                                               reg_apps.get(notebook_app.name), file_hashes, read_contents,
+                                                               previous_ids.get(notebook_app.name), force)
+                            for notebook_app in notebook_apps }
+
+            app_results = { app_name: future.result() for app_name, future in app_futures.items() }
+
+        upload_bytes = sum([ uploaded for _, uploaded in app_results.values() ])
+        self.instrumentation.record(cache_hit=upload_bytes == 0, upload_bytes=upload_bytes)
+
+        registry_ids = { app_name: reg_app.id for app_name, (reg_app, _) in app_results.items() }
+
+        with self.app_state.batch():
+            self.app_state.app_registry_ids = registry_ids
+            self.app_state.app_registry_id = list(registry_ids.values())[0] if len(registry_ids) == 1 else None
+            self.app_state.app_registry_file_hashes = file_hashes
+
+    def _stage_arguments(self, stage_name, arguments):
+        "Arguments recorded for a stage so that it can be run again on resume"
+
+        if stage_name == "build_docker":
+            if arguments["targets"] is not None:
+                arguments["targets"] = [ t.to_dict() for t in self._build_targets(arguments["targets"]) ]
+
+            arguments["config_file"] = self._docker_util_options["repo_config"]
+
+        return arguments
+
+    def _update_stage_record(self, stage_name, **values):
+
+        stage_records = self.app_state.stage_records
+        self.app_state.stage_records = { **stage_records, stage_name: { **stage_records.get(stage_name, {}), **values } }
+
+    def _stage_input_fingerprint(self, stage_name, arguments, recorded=False):
+        """
+        Fingerprint of the arguments of a stage and the inputs it takes from the source repository or
+        earlier stages. build_docker fingerprints the source unless the fingerprint recorded by the
+        last build is requested.
+        """
+
+        if stage_name == "build_docker":
+            if recorded:
+                inputs = self.app_state.docker_build_fingerprint
+            else:
+                targets = [ BuildTarget.from_dict(t) for t in arguments["targets"] ] if arguments["targets"] is not None else None
+                inputs = self._docker_build_fingerprint(self._build_targets(targets), arguments["config_file"])
+
+        elif stage_name in ("push_docker", "push_ecr"):
+            inputs = [ self.app_state.docker_build_fingerprint, self.app_state.docker_image_reference ]
+
+            if self.app_state.docker_optimized_image is not None:
+                inputs.append(self.app_state.docker_optimized_image["source_id"])
+                inputs.append(self.app_state.docker_optimized_image["image_reference"])
+
+        elif stage_name == "build_cwl":
+            # Missing notebooks fail once the stage runs again
+            try:
+                notebook_apps = self._notebook_applications(arguments.get("notebooks") or self.app_state.cwl_notebooks)
+                notebook_digests = { notebook_app.notebook_path: file_digest(os.path.join(self.repo_info.directory, notebook_app.notebook_path))
+                                     for notebook_app in notebook_apps }
+            except ApplicationGenerationError:
+                notebook_digests = None
+
+            inputs = [
+                notebook_digests,
+                self.repo_info.repo.head.commit.hexsha,
+                arguments["docker_url"] or self.app_state.docker_url or self.app_state.docker_image_reference,
+            ]
+
+        elif stage_name in ("validate_cwl", "push_app_registry"):
+            inputs = self.app_state.cwl_output_hashes
+
+        return values_fingerprint({ "inputs": inputs, "arguments": arguments })
+
+    def _run_stage(self, stage_name, arguments, dockstore_token=None):
+
+        if stage_name == "build_docker":
+            # The config file is only used once the Docker utility is created
+            if self._docker_util is None and self._docker_util_options["repo_config"] is None:
+                self._docker_util_options["repo_config"] = arguments["config_file"]
+
+            targets = [ BuildTarget.from_dict(t) for t in arguments["targets"] ] if arguments["targets"] is not None else None
+            self.create_docker_image(targets=targets, cache_from=arguments["cache_from"], env_cache=arguments["env_cache"],
+                                     slim=arguments.get("slim", False), lazy_format=arguments.get("lazy_format"),
+                                     build_queue=arguments.get("build_queue"), build_timeout=arguments.get("build_timeout"))
+
+        elif stage_name == "push_docker":
+            self.push_to_docker_registry(arguments["docker_registry"])
+
+        elif stage_name == "push_ecr":
+            self.push_to_aws_ecr()
+
+        elif stage_name == "build_cwl":
+            self.create_cwl(cwl_output_path=arguments["cwl_output_path"], docker_url=arguments["docker_url"], monolithic=arguments["monolithic"],
+                            bundle=arguments.get("bundle", False), artifact_cache=arguments.get("artifact_cache"),
+                            notebooks=arguments.get("notebooks"))
+
+        elif stage_name == "validate_cwl":
+            self.validate_cwl()
+
+        elif stage_name == "push_app_registry":
+            if dockstore_token is None:
+                raise ApplicationGenerationError("A Dockstore token is required to resume the push_app_registry stage")
+
+            self.push_to_application_registry(arguments["dockstore_api_url"], dockstore_token)
+
+    def resume(self, dockstore_token=None):
+        """
+        Run again the recorded stages that did not finish successfully or whose inputs changed since
+        they did, using the arguments they were last run with. Stages after one that runs again are
+        checked against the new outputs. Returns the names of the stages that were run.
+        """
+
+        stage_records = self.app_state.stage_records
+
+        if not stage_records:
+            raise ApplicationGenerationError(f"No stages have been recorded in {self.app_state.state_directory}, nothing to resume")
+
+        stages_run = []
+        for stage_name in PIPELINE_STAGES:
+            if (stage_record := stage_records.get(stage_name)) is None:
+                continue
+
+            arguments = stage_record["arguments"]
+
+            if stage_record["status"] != "success":
+                logger.info(f"Resuming stage {stage_name} since its last run ended with status: {stage_record['status']}")
+            elif stage_record["input_fingerprint"] != self._stage_input_fingerprint(stage_name, arguments):
+                logger.info(f"Resuming stage {stage_name} since its inputs changed")
+            else:
+                logger.info(f"Stage {stage_name} is complete and its inputs are unchanged, skipping")
+                continue
+
+            self._run_stage(stage_name, arguments, dockstore_token=dockstore_token)
+            stages_run.append(stage_name)
+
+        if len(stages_run) == 0:
+            logger.info("All recorded stages are complete")
+
+        return stages_run
@@ -0,0 +1,136 @@
+import os
+import re
+import shutil
+import hashlib
+import logging
+
+from .cache import user_cache_directory
+from .locking import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Matches scp like Git URLs such as git@github.com:owner/repo.git
+SCP_URL_RE = re.compile(r"^[\w.-]+@[\w.-]+:")
+
+def is_remote_source(source):
+    "Whether a source repository is a Git URL rather than a local path"
+
+    return "://" in source or SCP_URL_RE.match(source) is not None
+
+def commit_on_remote(repo, source, commit):
+    """
+    Whether commit is on a remote tracking branch of repo, or is the tip of a branch or tag
+    that the source repository advertises, so that a clone of source can check it out
+    """
+    import git
+
+    if repo.git.branch("-r", "--contains", commit).strip() != "":
+        return True
+
+    try:
+        advertised_refs = repo.git.ls_remote(source)
+    except git.GitCommandError as err:
+        logger.debug(f"Could not list the refs of {source}: {err}")
+        return False
+
+    return any([ line.split()[0] == commit for line in advertised_refs.splitlines() if line.strip() != "" ])
+
+def mirror_directory():
+    "Location of bare mirrors of source repositories shared by all state directories"
+
+    return os.path.join(user_cache_directory(), "git_mirrors")
+
+def update_mirror(source):
+    "Create or update a bare mirror of a remote source repository and return its path"
+    import git
+
+    os.makedirs(mirror_directory(), exist_ok=True)
+
+    mirror_name = hashlib.sha256(source.encode()).hexdigest()[:16]
+    mirror_path = os.path.join(mirror_directory(), f"{mirror_name}.git")
+
+    # Concurrent builds of the same source share the mirror
+    with file_lock(mirror_path + ".lock"):
+        if os.path.exists(mirror_path):
+            logger.info(f"Updating Git mirror of {source} in {mirror_path}")
+            git.Repo(mirror_path).git.fetch("--prune", "origin")
+        else:
+            logger.info(f"Creating Git mirror of {source} in {mirror_path}")
+            git.Repo.clone_from(source, mirror_path, mirror=True)
+
+    return mirror_path
+
+def _shallow_clone(source, dest, checkout):
+    import git
+
+    clone_options = ["--depth=1"]
+    if checkout is not None:
+        clone_options.append(f"--branch={checkout}")
+
+    try:
+        return git.Repo.clone_from(source, dest, multi_options=clone_options)
+    except git.GitCommandError as err:
+        # --branch only accepts branch and tag names
+        if checkout is None:
+            raise
+        logger.debug(f"Shallow clone of {checkout} by name failed: {err}")
+
+    # Try fetching the commit directly, not all servers allow fetching unadvertised commits
+    try:
+        repo = git.Repo.init(dest)
+        repo.create_remote("origin", source)
+        repo.git.fetch("--depth=1", "origin", checkout)
+        repo.git.checkout("FETCH_HEAD")
+    except git.GitCommandError:
+        shutil.rmtree(os.path.join(dest, ".git"), ignore_errors=True)
+        raise
+
+    return repo
+
+def clone_source(source, dest, checkout=None, shallow=False, use_mirror=False):
+    """
+    Clone a remote source repository into dest either using a local mirror as a reference
+    to avoid transferring objects already fetched for another state directory, or as a
+    shallow clone of only the requested checkout, but not both. Submodules are initialized
+    when checkout is supplied to match GitManager.checkout.
+    """
+    import git
+
+    if use_mirror and shallow:
+        raise ValueError("A shallow clone can not use a Git mirror as a reference")
+
+    if use_mirror:
+        mirror_path = update_mirror(source)
+
+        logger.info(f"Cloning Git repository from {source} to {dest} using reference {mirror_path}")
+        repo = git.Repo.clone_from(source, dest, multi_options=[f"--reference-if-able={mirror_path}", "--dissociate"])
+
+    elif shallow:
+        try:
+            logger.info(f"Shallow cloning Git repository from {source} to {dest}")
+            repo = _shallow_clone(source, dest, checkout)
+
+        except git.GitCommandError as err:
+            logger.info(f"Shallow clone failed, falling back to a full clone: {err}")
+
+            if os.path.exists(dest) and len(os.listdir(dest)) == 0:
+                os.rmdir(dest)
+
+            repo = git.Repo.clone_from(source, dest)
+
+    else:
+        repo = git.Repo.clone_from(source, dest)
+
+    if checkout is not None and is_checked_out(repo, checkout):
+        repo.git.submodule('update', '--init')
+
+    return repo
+
+def is_checked_out(repo, checkout):
+    "Check if the working tree of a repository is already at the commit referred to by checkout"
+    import git
+
+    try:
+        return repo.commit(checkout).hexsha == repo.head.commit.hexsha
+    except (git.BadName, git.GitCommandError, ValueError):
+        return False
@@ -0,0 +1,265 @@
+import io
+import os
+import json
+import hashlib
+import logging
+import tarfile
+import tempfile
+import posixpath
+
+logger = logging.getLogger(__name__)
+
+# Lazy pull image formats supported by nerdctl image convert
+LAZY_PULL_FORMATS = [ "estargz", "zstdchunked" ]
+
+# Paths relative to the repository directory in the image that are only needed to build it
+BUILD_ONLY_REPO_PATHS = [ ".git", ".ipynb_checkpoints" ]
+
+# Paths relative to the home directory in the image left behind by package installs
+BUILD_ONLY_HOME_PATHS = [ ".cache/pip", ".cache/yarn" ]
+
+# Locations used by repo2docker when the image configuration does not say otherwise
+DEFAULT_REPO_DIR = "/home/jovyan"
+DEFAULT_PYTHON_PREFIX = "/srv/conda/envs/notebook"
+
+# Number of layers listed by the layer report, largest first
+REPORT_LAYERS = 10
+
+# Characters of the instruction that created a layer kept in the report
+REPORT_INSTRUCTION_LENGTH = 120
+
+# Size of blocks copied between layer archives
+COPY_BLOCK_SIZE = 1024 * 1024
+
+class ImageOptimizationError(Exception):
+    pass
+
+def image_environment(image):
+    "Environment variables of the image configuration as a dictionary"
+
+    env_list = image.attrs.get("Config", {}).get("Env") or []
+
+    return dict([ env_str.split("=", 1) for env_str in env_list if "=" in env_str ])
+
+def layer_report(image):
+    """
+    Return the layers of an image that add content, oldest first, as dictionaries with the size
+    in bytes and the instruction that created the layer
+    """
+
+    layers = []
+    for entry in reversed(image.history()):
+        if entry.get("Size", 0) == 0:
+            continue
+
+        created_by = " ".join((entry.get("CreatedBy") or "").split())
+
+        layers.append({
+            "size": entry["Size"],
+            "created_by": created_by[:REPORT_INSTRUCTION_LENGTH],
+        })
+
+    return layers
+
+def format_layer_report(image_reference, layers, num_layers=REPORT_LAYERS):
+
+    total_size = sum([ layer["size"] for layer in layers ])
+
+    report_str = f"Layers of {image_reference}: {len(layers)} layers, {total_size / 1e6:.1f} MB\n"
+    report_str += f"    {'layer':>5} {'MB':>10} {'share':>6}  instruction\n"
+
+    largest = sorted(enumerate(layers), key=lambda l: l[1]["size"], reverse=True)[:num_layers]
+
+    for index, layer in largest:
+        share = layer["size"] / total_size if total_size > 0 else 0
+        report_str += f"    {index:5d} {layer['size'] / 1e6:10.1f} {share:6.1%}  {layer['created_by']}\n"
+
+    return report_str.rstrip()
+
+def build_only_paths(image, extra_repo_paths=[]):
+    """
+    Paths inside a repo2docker image, without the leading slash as in layer archives, of content
+    only needed to build the image. extra_repo_paths are relative to the repository directory.
+    """
+
+    env = image_environment(image)
+
+    repo_dir = env.get("REPO_DIR", DEFAULT_REPO_DIR)
+    home_dir = env.get("HOME", DEFAULT_REPO_DIR)
+
+    strip_paths = [ posixpath.join(repo_dir, rel_path) for rel_path in BUILD_ONLY_REPO_PATHS + extra_repo_paths ]
+    strip_paths += [ posixpath.join(home_dir, rel_path) for rel_path in BUILD_ONLY_HOME_PATHS ]
+
+    return sorted(set([ posixpath.normpath(path).lstrip("/") for path in strip_paths ]))
+
+def startup_paths(image, notebook_paths=[]):
+    """
+    Paths inside a repo2docker image read when a notebook starts, fetched first by lazy pulling.
+    notebook_paths are relative to the repository directory.
+    """
+
+    env = image_environment(image)
+
+    repo_dir = env.get("REPO_DIR", DEFAULT_REPO_DIR)
+    python_prefix = env.get("NB_PYTHON_PREFIX", DEFAULT_PYTHON_PREFIX)
+
+    paths = [
+        "/usr/local/bin/repo2docker-entrypoint",
+        "/usr/local/bin/python3-login",
+        posixpath.join(python_prefix, "bin", "python"),
+        posixpath.join(python_prefix, "bin", "papermill"),
+    ]
+
+    paths += [ posixpath.join(repo_dir, notebook_path.replace(os.sep, "/")) for notebook_path in notebook_paths ]
+
+    return paths
+
+def _member_path(member_name):
+
+    return posixpath.normpath(member_name).lstrip("/")
+
+def _is_stripped(path, strip_paths):
+
+    for strip_path in strip_paths:
+        if path == strip_path or path.startswith(strip_path + "/"):
+            return True
+
+    return False
+
+class ImageSlimmer(object):
+    """
+    Removes build only content from the layers of a local image and loads the result under a
+    new reference. Each layer is rewritten on its own instead of flattening the image, so layers
+    without build only content keep their digests and are still shared with other images in the
+    Docker daemon and registries.
+    """
+
+    def __init__(self, docker_client, work_directory=None):
+
+        self.docker_client = docker_client
+        self.work_directory = work_directory
+
+    def _stripped_members(self, layer_tar, strip_paths):
+        "Names of the members of a layer to remove, hard link targets are kept to not break the links"
+
+        stripped = set()
+        link_targets = set()
+
+        for member in layer_tar.getmembers():
+            path = _member_path(member.name)
+
+            if _is_stripped(path, strip_paths):
+                stripped.add(member.name)
+            elif member.islnk():
+                link_targets.add(member.linkname)
+
+        return stripped - link_targets
+
+    def _rewrite_layer(self, layer_tar, stripped, layer_filename):
+        "Write the layer without the stripped members and return its SHA256 digest and the bytes removed"
+
+        stripped_bytes = 0
+
+        with tarfile.open(layer_filename, "w", format=layer_tar.format, pax_headers=layer_tar.pax_headers) as out_tar:
+            for member in layer_tar.getmembers():
+                if member.name in stripped:
+                    stripped_bytes += member.size
+                    continue
+
+                out_tar.addfile(member, layer_tar.extractfile(member) if member.isfile() else None)
+
+        hasher = hashlib.sha256()
+        with open(layer_filename, "rb") as layer_file:
+            while block := layer_file.read(COPY_BLOCK_SIZE):
+                hasher.update(block)
+
+        return hasher.hexdigest(), stripped_bytes
+
+    def slim(self, image_reference, slim_reference, strip_paths):
+        """
+        Create slim_reference from image_reference without the files under strip_paths. Returns a
+        dictionary with the number of files and bytes removed and the number of layers rewritten.
+        """
+
+        image = self.docker_client.images.get(image_reference)
+
+        with tempfile.TemporaryDirectory(prefix="unity_app_gen_slim_", dir=self.work_directory) as tmp_dir:
+            saved_filename = os.path.join(tmp_dir, "saved.tar")
+            load_filename = os.path.join(tmp_dir, "load.tar")
+
+            logger.debug(f"Saving {image_reference} to {saved_filename}")
+
+            with open(saved_filename, "wb") as saved_file:
+                for chunk in image.save(named=False):
+                    saved_file.write(chunk)
+
+            result = { "stripped_files": 0, "stripped_bytes": 0, "layers_rewritten": 0 }
+
+            with tarfile.open(saved_filename, "r:") as saved_tar, tarfile.open(load_filename, "w") as load_tar:
+                manifest = json.load(saved_tar.extractfile("manifest.json"))
+
+                if len(manifest) != 1:
+                    raise ImageOptimizationError(f"Expected a single image when saving {image_reference}, found {len(manifest)}")
+
+                config = json.load(saved_tar.extractfile(manifest[0]["Config"]))
+                diff_ids = config["rootfs"]["diff_ids"]
+
+                if len(diff_ids) != len(manifest[0]["Layers"]):
+                    raise ImageOptimizationError(f"Layers of saved image {image_reference} do not match its configuration")
+
+                layer_names = []
+                for layer_index, saved_layer_name in enumerate(manifest[0]["Layers"]):
+                    saved_layer_member = saved_tar.getmember(saved_layer_name)
+
+                    # Layers may be compressed when saved from the containerd image store
+                    with tarfile.open(fileobj=saved_tar.extractfile(saved_layer_member), mode="r:*") as layer_tar:
+                        stripped = self._stripped_members(layer_tar, strip_paths)
+
+                        if len(stripped) > 0:
+                            layer_filename = os.path.join(tmp_dir, f"layer_{layer_index}.tar")
+                            layer_digest, stripped_bytes = self._rewrite_layer(layer_tar, stripped, layer_filename)
+
+                            diff_ids[layer_index] = f"sha256:{layer_digest}"
+
+                            result["stripped_files"] += len(stripped)
+                            result["stripped_bytes"] += stripped_bytes
+                            result["layers_rewritten"] += 1
+
+                            logger.debug(f"Removed {len(stripped)} files, {stripped_bytes} bytes from layer {layer_index} of {image_reference}")
+
+                    layer_name = f"{diff_ids[layer_index].split(':')[-1]}/layer.tar"
+                    layer_names.append(layer_name)
+
+                    # Unchanged layers are copied as they are so their digests stay the same
+                    if len(stripped) > 0:
+                        load_tar.add(layer_filename, layer_name)
+                        os.remove(layer_filename)
+                    else:
+                        layer_info = tarfile.TarInfo(layer_name)
+                        layer_info.size = saved_layer_member.size
+                        load_tar.addfile(layer_info, saved_tar.extractfile(saved_layer_member))
+
+                config_bytes = json.dumps(config).encode()
+                config_name = f"{hashlib.sha256(config_bytes).hexdigest()}.json"
+
+                load_manifest = [{ "Config": config_name, "RepoTags": [slim_reference], "Layers": layer_names }]
+
+                for member_name, member_bytes in ((config_name, config_bytes), ("manifest.json", json.dumps(load_manifest).encode())):
+                    member_info = tarfile.TarInfo(member_name)
+                    member_info.size = len(member_bytes)
+                    load_tar.addfile(member_info, io.BytesIO(member_bytes))
+
+            os.remove(saved_filename)
+
+            # Without build only content the image is the same
+            if result["layers_rewritten"] == 0:
+                slim_repository, _, slim_tag = slim_reference.rpartition(":")
+                image.tag(slim_repository, slim_tag)
+                return result
+
+            logger.debug(f"Loading {slim_reference} from {load_filename}")
+
+            with open(load_filename, "rb") as load_file:
+                self.docker_client.images.load(load_file)
+
+        return result
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+TIMELINE_BASENAME = "timeline.jsonl"
+PROFILE_DIRNAME = "profile"
+
+logger = logging.getLogger(__name__)
+
+class StageInstrumentation(object):
+    """
+    Records wall time and metrics such as bytes transferred and cache hits for generator stages.
+    Each finished stage is appended as a JSON line to a timeline file in the state directory.
+    When profiling is enabled, stages marked as profiled also write cProfile statistics
+    into the profile subdirectory of the state directory.
+    """
+
+    def __init__(self, state_directory, profile=False):
+
+        self.state_directory = state_directory
+        self.timeline_filename = os.path.join(state_directory, TIMELINE_BASENAME)
+        self.profile = profile
+
+        # Records not yet written because the state directory does not exist yet
+        self.pending_records = []
+
+        # Profiles waiting along with their records for the state directory to exist
+        self.pending_profiles = []
+
+        # Records of stages currently running, innermost last
+        self.active_records = []
+
+        self._profiler = None
+
+        # Stages record metrics from the worker threads they start
+        self._lock = threading.Lock()
+
+    def record(self, **metrics):
+        "Add metrics to the innermost running stage"
+
+        with self._lock:
+            if len(self.active_records) > 0:
+                self.active_records[-1].update(metrics)
+
+    def add(self, name, amount):
+        "Add to a numeric metric of the innermost running stage"
+
+        with self._lock:
+            if len(self.active_records) > 0:
+                self.active_records[-1][name] = self.active_records[-1].get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, stage_name, profile=False):
+
+        stage_record = {
+            "stage": stage_name,
+            "start": time.time(),
+            "pid": os.getpid(),
+        }
+
+        # Only one profiler can be active, nested stages are covered by the outer profile
+        profiler = None
+        with self._lock:
+            self.active_records.append(stage_record)
+
+            if self.profile and profile and self._profiler is None:
+                profiler = self._profiler = cProfile.Profile()
+                profiler.enable()
+
+        start_time = time.perf_counter()
+        try:
+            yield stage_record
+        except BaseException as err:
+            stage_record["status"] = "error"
+            stage_record["error"] = str(err)
+            raise
+        else:
+            stage_record["status"] = "success"
+        finally:
+            stage_record["elapsed"] = time.perf_counter() - start_time
+
+            with self._lock:
+                if profiler is not None:
+                    profiler.disable()
+                    self._profiler = None
+                    self.pending_profiles.append( (stage_record, profiler) )
+
+                # Stages of other threads may have started since, so remove this one by identity
+                self.active_records = [ r for r in self.active_records if r is not stage_record ]
+                self.pending_records.append(stage_record)
+
+            self.save()
+
+    def _dump_profile(self, stage_record, profiler):
+
+        profile_dir = os.path.join(self.state_directory, PROFILE_DIRNAME)
+        os.makedirs(profile_dir, exist_ok=True)
+
+        # Named by start time and process so that timeline records of earlier runs keep their profile
+        stage_name = stage_record["stage"].lstrip('_')
+        start_str = time.strftime("%Y%m%dT%H%M%S", time.gmtime(stage_record["start"])) + f"{int(stage_record['start'] * 1000) % 1000:03d}"
+
+        profile_filename = os.path.join(profile_dir, f"{stage_name}-{start_str}-{stage_record['pid']}.prof")
+        profiler.dump_stats(profile_filename)
+
+        logger.info(f"Wrote profile of {stage_record['stage']} to {profile_filename}")
+
+        return profile_filename
+
+    def save(self):
+        "Append pending records to the timeline file once the state directory exists"
+
+        with self._lock:
+            if len(self.pending_records) == 0 or not os.path.exists(self.state_directory):
+                return
+
+            for stage_record, profiler in self.pending_profiles:
+                stage_record["profile"] = self._dump_profile(stage_record, profiler)
+
+            self.pending_profiles = []
+
+            with open(self.timeline_filename, "a") as timeline_file:
+                for stage_record in self.pending_records:
+                    timeline_file.write(json.dumps(stage_record) + "\n")
+
+            self.pending_records = []
+
+def instrumented(profile=False):
+    "Decorator for UnityApplicationGenerator methods that records the method as a stage"
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.instrumentation.stage(method.__name__, profile=profile):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
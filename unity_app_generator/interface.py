@@ -5,9 +5,15 @@ Provides a programmatic interface mirroring the command line interface of build_
 DEFAULT_STATE_DIRECTORY = ".unity_app_gen"
 
 import os
+import time
+import inspect
 import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 from unity_app_generator.generator import UnityApplicationGenerator, ApplicationGenerationError
+from unity_app_generator.git_helper import is_remote_source
 
 logger = logging.getLogger()
 
@@ -33,17 +39,29 @@ def check_state_directory(state_dir):
 
     return state_dir
 
-def init(state_directory, source_repository, destination_directory=None, checkout=None, **kwargs):
+# Generator arguments that a long running process, such as the build server, passes to every command
+GENERATOR_OPTIONS = [ "docker_util_factory", "app_catalog_factory" ]
+
+def generator_options(kwargs):
+    "Generator arguments from the keyword arguments of a command"
+
+    return { name: kwargs[name] for name in GENERATOR_OPTIONS if kwargs.get(name) is not None }
+
+def init(state_directory, source_repository, destination_directory=None, checkout=None, shallow=False, git_mirror=False, profile=False, **kwargs):
     "Initialize a Git repository for use by subsequent commands"
 
     state_dir = state_directory_path(state_directory, destination_directory)
 
-    app_gen = UnityApplicationGenerator(state_dir, source_repository, destination_directory, checkout)
+    app_gen = UnityApplicationGenerator(state_dir, source_repository, destination_directory, checkout,
+                                        shallow_clone=shallow, use_git_mirror=git_mirror, profile=profile,
+                                        **generator_options(kwargs))
 
     return app_gen
 
-def build_docker(state_directory, image_namespace=None, image_repository=None, image_tag=None, config_file=None, **kwargs):
-    "Build a Docker image from the initialized application directory"
+def build_docker(state_directory, image_namespace=None, image_repository=None, image_tag=None, config_file=None, targets=None,
+                 cache_from=None, env_cache=True, slim=False, lazy_format=None, build_queue=None, build_timeout=None,
+                 force=False, profile=False, event_callback=None, **kwargs):
+    "Build a Docker image from the initialized application directory, or on a build worker when build_queue is supplied"
 
     state_dir = check_state_directory(state_directory_path(state_directory))
 
@@ -51,55 +69,367 @@ def build_docker(state_directory, image_namespace=None, image_repository=None, i
                                         repo2docker_config=config_file,
                                         use_namespace=image_namespace,
                                         use_repository=image_repository,
-                                        use_tag=image_tag)
+                                        use_tag=image_tag,
+                                        profile=profile,
+                                        event_callback=event_callback,
+                                        **generator_options(kwargs))
 
-    app_gen.create_docker_image()
+    app_gen.create_docker_image(force=force, targets=targets, cache_from=cache_from, env_cache=env_cache, slim=slim, lazy_format=lazy_format,
+                                build_queue=build_queue, build_timeout=build_timeout)
 
     return app_gen
 
-def push_docker(state_directory, container_registry, **kwargs):
+def push_docker(state_directory, container_registry, force=False, profile=False, event_callback=None, stall_timeout=None, **kwargs):
     state_dir = check_state_directory(state_directory_path(state_directory))
 
-    app_gen = UnityApplicationGenerator(state_dir)
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, event_callback=event_callback, stall_timeout=stall_timeout, **generator_options(kwargs))
 
-    app_gen.push_to_docker_registry(container_registry)
+    app_gen.push_to_docker_registry(container_registry, force=force)
 
     return app_gen
 
-def push_ecr(state_directory, **kwargs):
+def push_ecr(state_directory, force=False, profile=False, event_callback=None, stall_timeout=None, **kwargs):
     state_dir = check_state_directory(state_directory_path(state_directory))
 
-    app_gen = UnityApplicationGenerator(state_dir)
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, event_callback=event_callback, stall_timeout=stall_timeout, **generator_options(kwargs))
 
-    app_gen.push_to_aws_ecr()
+    app_gen.push_to_aws_ecr(force=force)
 
     return app_gen
 
-def notebook_parameters(state_directory, **kwargs):
+def notebook_parameters(state_directory, notebooks=None, profile=False, **kwargs):
 
     state_dir = check_state_directory(state_directory_path(state_directory))
 
-    app_gen = UnityApplicationGenerator(state_dir)
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, **generator_options(kwargs))
 
     print()
-    print(app_gen.notebook_parameters())
+    print(app_gen.notebook_parameters(notebooks=notebooks))
+
+    return app_gen
+
+def build_cwl(state_directory, cwl_output_path=None, image_url=None, monolithic=False, bundle=False, artifact_cache=None, notebooks=None,
+              force=False, profile=False, **kwargs):
+    state_dir = check_state_directory(state_directory_path(state_directory))
+
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, **generator_options(kwargs))
+
+    app_gen.create_cwl(cwl_output_path=cwl_output_path, docker_url=image_url, monolithic=monolithic,
+                       bundle=bundle, artifact_cache=artifact_cache, notebooks=notebooks, force=force)
+
+    return app_gen
+
+def validate_cwl(state_directory, force=False, profile=False, **kwargs):
+    state_dir = check_state_directory(state_directory_path(state_directory))
+
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, **generator_options(kwargs))
+
+    app_gen.validate_cwl(force=force)
 
     return app_gen
 
-def build_cwl(state_directory, cwl_output_path=None, image_url=None, monolithic=False, **kwargs):
+def push_app_registry(state_directory, dockstore_api_url, dockstore_token, force=False, profile=False, **kwargs):
     state_dir = check_state_directory(state_directory_path(state_directory))
 
-    app_gen = UnityApplicationGenerator(state_dir)
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, **generator_options(kwargs))
 
-    app_gen.create_cwl(cwl_output_path=cwl_output_path, docker_url=image_url, monolithic=monolithic)
+    app_gen.push_to_application_registry(dockstore_api_url, dockstore_token, force=force)
 
     return app_gen
 
-def push_app_registry(state_directory, dockstore_api_url, dockstore_token, **kwargs):
+def resume(state_directory, dockstore_token=None, profile=False, event_callback=None, stall_timeout=None, **kwargs):
+    "Run the recorded stages that failed or whose inputs changed since they last succeeded"
+
     state_dir = check_state_directory(state_directory_path(state_directory))
 
-    app_gen = UnityApplicationGenerator(state_dir)
+    app_gen = UnityApplicationGenerator(state_dir, profile=profile, event_callback=event_callback, stall_timeout=stall_timeout, **generator_options(kwargs))
+
+    app_gen.resume(dockstore_token=dockstore_token)
+
+    return app_gen
+
+def run_pipeline(state_directory, source_repository, destination_directory=None, checkout=None, shallow=False, git_mirror=False,
+                 image_namespace=None, image_repository=None, image_tag=None, config_file=None, targets=None,
+                 cache_from=None, env_cache=True, slim=False, lazy_format=None, build_queue=None, build_timeout=None,
+                 container_registry=None, use_ecr=False,
+                 cwl_output_path=None, monolithic=False, bundle=False, artifact_cache=None, notebooks=None, validate=True,
+                 dockstore_api_url=None, dockstore_token=None,
+                 stage_limits=None, stage_times=None, profile=False, event_callback=None, stall_timeout=None, **kwargs):
+    """
+    Run init, build_docker, push_docker or push_ecr, build_cwl, validate_cwl and push_app_registry in
+    sequence using a single generator instance. The push stages are skipped when no registry is supplied.
+
+    stage_limits optionally maps stage names to a semaphore held while that stage runs. Builds
+    sent to build workers through build_queue are not held to the local build limit.
+    (stage name, seconds) pairs are appended to stage_times if a list is supplied.
+    event_callback receives build and push progress events.
+    """
+
+    state_dir = state_directory_path(state_directory, destination_directory)
+
+    if stage_limits is None:
+        stage_limits = {}
+
+    if stage_times is None:
+        stage_times = []
+
+    if build_queue is not None:
+        stage_limits = { stage_name: limit for stage_name, limit in stage_limits.items() if stage_name not in BATCH_BUILD_STAGES }
+
+    def run_stage(stage_name, stage_func, *args, **kwargs):
+        with stage_limits.get(stage_name, nullcontext()):
+            logger.info(f"Running stage: {stage_name}")
+            start_time = time.perf_counter()
+            try:
+                return stage_func(*args, **kwargs)
+            finally:
+                stage_times.append( (stage_name, time.perf_counter() - start_time) )
+
+    try:
+        app_gen = run_stage("init", UnityApplicationGenerator, state_dir, source_repository, destination_directory, checkout,
+                            repo2docker_config=config_file,
+                            use_namespace=image_namespace,
+                            use_repository=image_repository,
+                            use_tag=image_tag,
+                            shallow_clone=shallow,
+                            use_git_mirror=git_mirror,
+                            profile=profile,
+                            event_callback=event_callback,
+                            stall_timeout=stall_timeout,
+                            **generator_options(kwargs))
+
+        run_stage("build_docker", app_gen.create_docker_image, targets=targets, cache_from=cache_from, env_cache=env_cache,
+                  slim=slim, lazy_format=lazy_format, build_queue=build_queue, build_timeout=build_timeout)
+
+        if use_ecr:
+            run_stage("push_ecr", app_gen.push_to_aws_ecr)
+        elif container_registry is not None:
+            run_stage("push_docker", app_gen.push_to_docker_registry, container_registry)
+
+        run_stage("build_cwl", app_gen.create_cwl, cwl_output_path=cwl_output_path, monolithic=monolithic,
+                  bundle=bundle, artifact_cache=artifact_cache, notebooks=notebooks)
+
+        if validate:
+            run_stage("validate_cwl", app_gen.validate_cwl)
+
+        if dockstore_api_url is not None:
+            run_stage("push_app_registry", app_gen.push_to_application_registry, dockstore_api_url, dockstore_token)
+
+    finally:
+        timing_str = "Stage timing:\n"
+        for stage_name, elapsed in stage_times:
+            timing_str += f"    {stage_name:<20} {elapsed:10.2f} s\n"
+        timing_str += f"    {'total':<20} {sum([ t for _, t in stage_times ]):10.2f} s"
+
+        logger.info(timing_str)
+
+    return app_gen
+
+# Stages limited by the number of concurrent Docker builds versus the number of concurrent network transfers
+BATCH_BUILD_STAGES = [ "build_docker" ]
+BATCH_TRANSFER_STAGES = [ "push_docker", "push_ecr", "push_app_registry" ]
+
+# run_pipeline arguments that batch sets for every application, the others may be given in the manifest
+BATCH_CONTROLLED_ARGUMENTS = [ "stage_limits", "stage_times", "profile", "event_callback" ]
+
+BATCH_APPLICATION_ARGUMENTS = [ name for name, param in inspect.signature(run_pipeline).parameters.items()
+                                if param.kind is not param.VAR_KEYWORD and name not in BATCH_CONTROLLED_ARGUMENTS ]
+
+# Batch manifest arguments that hold local paths
+BATCH_PATH_ARGUMENTS = [ "state_directory", "destination_directory", "config_file", "cwl_output_path", "artifact_cache", "build_queue" ]
+
+def _resolve_manifest_paths(app_args, manifest_directory):
+    "Resolve relative paths of manifest arguments against the directory of the manifest"
+
+    resolved_args = dict(app_args)
+
+    for arg_name in BATCH_PATH_ARGUMENTS:
+        if isinstance(resolved_args.get(arg_name), str):
+            resolved_args[arg_name] = os.path.normpath(os.path.join(manifest_directory, resolved_args[arg_name]))
+
+    source = resolved_args.get("source_repository")
+    if isinstance(source, str) and not is_remote_source(source):
+        resolved_args["source_repository"] = os.path.normpath(os.path.join(manifest_directory, source))
+
+    return resolved_args
+
+def check_batch_manifest(manifest, manifest_name="Batch manifest"):
+    "Check that a loaded batch manifest has the expected structure and only known argument names"
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("applications"), list):
+        raise ApplicationGenerationError(f"{manifest_name} must contain an applications list")
+
+    if not isinstance(manifest.get("defaults") or {}, dict):
+        raise ApplicationGenerationError(f"{manifest_name} defaults must be a dictionary of arguments")
+
+    unknown_keys = set(manifest.keys()) - set(["applications", "defaults"])
+    if len(unknown_keys) > 0:
+        raise ApplicationGenerationError(f"{manifest_name} has unknown keys: {', '.join(sorted(unknown_keys))}")
+
+    entries = [ ("defaults", manifest.get("defaults") or {}) ] + \
+              [ (f"application entry {index + 1}", app_args) for index, app_args in enumerate(manifest["applications"]) ]
+
+    for entry_name, app_args in entries:
+        if not isinstance(app_args, dict):
+            raise ApplicationGenerationError(f"{manifest_name} {entry_name} must be a dictionary of arguments, not: {app_args!r}")
 
-    app_gen.push_to_application_registry(dockstore_api_url, dockstore_token)
+        unknown_args = [ name for name in app_args.keys() if name not in BATCH_APPLICATION_ARGUMENTS ]
+        if len(unknown_args) > 0:
+            raise ApplicationGenerationError(f"{manifest_name} {entry_name} has unknown arguments: {', '.join(map(str, unknown_args))}")
 
-    return app_gen
\ No newline at end of file
+def load_batch_manifest(manifest_filename):
+    """
+    Load a YAML or JSON batch manifest. The manifest contains an "applications" list where each item
+    holds run_pipeline arguments for one application and an optional "defaults" dictionary of
+    arguments shared by all applications. Relative paths in the manifest are relative to the
+    directory of the manifest file.
+    """
+
+    if not os.path.exists(manifest_filename):
+        raise ApplicationGenerationError(f"Batch manifest file does not exist: {manifest_filename}")
+
+    import yaml
+
+    with open(manifest_filename, "r") as manifest_file:
+        manifest = yaml.safe_load(manifest_file)
+
+    check_batch_manifest(manifest, f"Batch manifest {manifest_filename}")
+
+    manifest_directory = os.path.dirname(os.path.realpath(manifest_filename))
+
+    manifest["defaults"] = _resolve_manifest_paths(manifest.get("defaults") or {}, manifest_directory)
+    manifest["applications"] = [ _resolve_manifest_paths(app_args, manifest_directory) for app_args in manifest["applications"] ]
+
+    return manifest
+
+def batch(manifest, max_workers=4, max_builds=1, max_transfers=4, raise_on_failure=False, state_directory=None, profile=False,
+          event_callback=None, stall_timeout=None, **kwargs):
+    """
+    Run the full pipeline for multiple applications concurrently. manifest is either the filename
+    of a batch manifest or an already loaded manifest dictionary. Docker builds and network transfers
+    have their own concurrency limits. A failure in one application does not stop the others.
+
+    Returns a list of result dictionaries, one per application in manifest order.
+    """
+
+    if state_directory is not None:
+        raise ApplicationGenerationError("A global state directory can not be used with batch, set state_directory per application in the manifest instead")
+
+    if not isinstance(manifest, dict):
+        manifest = load_batch_manifest(manifest)
+    else:
+        check_batch_manifest(manifest)
+
+    defaults = manifest.get("defaults") or {}
+    app_args_list = [ { **defaults, **app_args } for app_args in manifest["applications"] ]
+
+    # Applications sharing a state directory would overwrite each other's state
+    state_dirs = set()
+    for app_args in app_args_list:
+        if "source_repository" not in app_args:
+            raise ApplicationGenerationError(f"Batch manifest application entry is missing source_repository: {app_args}")
+
+        app_args.setdefault("state_directory", None)
+
+        state_dir = state_directory_path(app_args["state_directory"], app_args.get("destination_directory"))
+        if state_dir in state_dirs:
+            raise ApplicationGenerationError(f"Multiple batch manifest applications use the state directory {state_dir}")
+        state_dirs.add(state_dir)
+
+    build_limit = threading.BoundedSemaphore(max_builds)
+    transfer_limit = threading.BoundedSemaphore(max_transfers)
+
+    stage_limits = { stage_name: build_limit for stage_name in BATCH_BUILD_STAGES }
+    stage_limits.update({ stage_name: transfer_limit for stage_name in BATCH_TRANSFER_STAGES })
+
+    def run_app(app_args):
+        app_name = app_args.get("destination_directory") or app_args["source_repository"]
+        stage_times = []
+
+        result = {
+            "name": app_name,
+            "success": False,
+            "error": None,
+            "stage_times": stage_times,
+            "docker_url": None,
+        }
+
+        logger.info(f"Starting batch application: {app_name}")
+
+        # Tag events with the application they belong to since they are interleaved
+        app_event_callback = None
+        if event_callback is not None:
+            app_event_callback = lambda event: event_callback({ **event, "application": app_name })
+
+        try:
+            app_gen = run_pipeline(**{ "stall_timeout": stall_timeout, **app_args, **generator_options(kwargs) },
+                                   stage_limits=stage_limits, stage_times=stage_times, profile=profile, event_callback=app_event_callback)
+        except Exception as err:
+            logger.exception(f"Batch application {app_name} failed")
+            result["error"] = str(err)
+        else:
+            result["success"] = True
+            result["docker_url"] = app_gen.app_state.docker_url or app_gen.app_state.docker_image_reference
+
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run_app, app_args_list))
+
+    summary_str = "Batch summary:\n"
+    for result in results:
+        elapsed = sum([ t for _, t in result["stage_times"] ])
+        status = "ok" if result["success"] else "FAILED: " + result["error"].strip().split("\n")[0]
+        summary_str += f"    {result['name']:<40} {elapsed:10.2f} s  {status}\n"
+
+    num_failed = len([ r for r in results if not r["success"] ])
+    summary_str += f"{len(results) - num_failed} succeeded, {num_failed} failed"
+
+    logger.info(summary_str)
+
+    if raise_on_failure and num_failed > 0:
+        raise ApplicationGenerationError(f"{num_failed} of {len(results)} batch applications failed")
+
+    return results
+
+def serve(host=None, port=None, socket_path=None, max_workers=4, max_builds=1, max_transfers=4, max_finished_jobs=None,
+          auth_token_file=None, state_directory=None, **kwargs):
+    "Run a build server that accepts jobs for the functions in this module over a local HTTP API"
+    from .server import run_server, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_MAX_FINISHED_JOBS
+
+    if state_directory is not None:
+        raise ApplicationGenerationError("A global state directory can not be used with serve, set state_directory in the arguments of each job instead")
+
+    auth_token = None
+    if auth_token_file is not None:
+        try:
+            with open(auth_token_file, "r") as token_file:
+                auth_token = token_file.read().strip()
+        except OSError as err:
+            raise ApplicationGenerationError(f"Could not read auth token file {auth_token_file}: {err}")
+
+        if auth_token == "":
+            raise ApplicationGenerationError(f"Auth token file {auth_token_file} is empty")
+
+    run_server(host=host or DEFAULT_HOST, port=port or DEFAULT_PORT, socket_path=socket_path,
+               max_workers=max_workers, max_builds=max_builds, max_transfers=max_transfers,
+               max_finished_jobs=max_finished_jobs if max_finished_jobs is not None else DEFAULT_MAX_FINISHED_JOBS,
+               auth_token=auth_token)
+
+def build_worker(queue_directory, work_directory=None, worker_id=None, max_jobs=1, affinity_wait=None, shallow=False, git_mirror=False,
+                 state_directory=None, event_callback=None, **kwargs):
+    "Run build and push jobs from a build queue directory on this host until interrupted"
+    from .build_queue import BuildWorker, BuildQueueError, AFFINITY_WAIT
+
+    if state_directory is not None:
+        raise ApplicationGenerationError("A global state directory can not be used with build_worker, each job uses a workspace in the work directory")
+
+    try:
+        worker = BuildWorker(queue_directory, work_directory=work_directory, worker_id=worker_id, max_jobs=max_jobs,
+                             affinity_wait=affinity_wait if affinity_wait is not None else AFFINITY_WAIT,
+                             shallow=shallow, git_mirror=git_mirror, event_callback=event_callback)
+        worker.run()
+    except BuildQueueError as err:
+        raise ApplicationGenerationError(str(err))
+    except KeyboardInterrupt:
+        logger.info("Build worker interrupted")
@@ -0,0 +1,54 @@
+import os
+import logging
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def file_lock(lock_filename, shared=False):
+    """
+    Hold an advisory lock on lock_filename for the duration of the block. The lock file
+    is created if needed. On platforms without fcntl no locking is performed.
+    """
+
+    if fcntl is None:
+        logger.debug(f"File locking not supported on this platform, not locking {lock_filename}")
+        yield
+        return
+
+    lock_fd = os.open(lock_filename, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+@contextmanager
+def atomic_write(filename, mode=0o644, binary=False):
+    """
+    Open a temporary file in the directory of filename for writing and rename it over filename
+    at the end of the block, so that readers, including other hosts sharing the directory, never
+    see a partially written file. The file gets the permissions in mode, or stays only accessible
+    by the user with a mode of None. Nothing is written if the block raises.
+    """
+
+    file_dir = os.path.dirname(filename)
+    os.makedirs(file_dir, exist_ok=True)
+
+    tmp_fd, tmp_filename = tempfile.mkstemp(dir=file_dir, prefix=f".{os.path.basename(filename)}.")
+    try:
+        if mode is not None:
+            os.chmod(tmp_filename, mode)
+        with os.fdopen(tmp_fd, "wb" if binary else "w") as tmp_file:
+            yield tmp_file
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
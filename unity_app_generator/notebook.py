@@ -0,0 +1,489 @@
+import os
+import re
+import json
+import logging
+import tempfile
+import functools
+from glob import glob, has_magic
+
+from app_pack_generator import ApplicationNotebook
+from app_pack_generator.application import ApplicationInterface, ApplicationParameter, ApplicationError, SCHEMA_LIST
+
+from .cache import JSONCache
+from .fingerprint import file_digest
+
+logger = logging.getLogger(__name__)
+
+# Name of the cache of introspected notebook parameters kept in the state directory
+PARAMETER_CACHE_NAME = "notebook_parameters"
+
+# Notebook used when a repository does not declare its notebooks and registered under the repository name
+DEFAULT_NOTEBOOK = "process.ipynb"
+
+# Directories not searched when discovering notebooks, besides hidden directories
+SKIPPED_NOTEBOOK_DIRECTORIES = [ "__pycache__", "node_modules" ]
+
+APPLICATION_NAME_RE = re.compile(r'[^A-Za-z0-9]+')
+
+# Characters read from a notebook at a time by the streaming parser
+NOTEBOOK_READ_SIZE = 1024 * 1024
+
+# Cell values that can hold large rendered outputs and are never needed for introspection
+SKIPPED_CELL_KEYS = [ "outputs", "attachments" ]
+
+STRUCTURE_RE = re.compile(r'["\[\]{}]')
+STRING_SPECIAL_RE = re.compile(r'["\\]')
+SCALAR_END_RE = re.compile(r'[\s,\]}]')
+
+class _JSONStreamReader(object):
+    """
+    Reads a JSON document from a file incrementally. Values can either be parsed or skipped,
+    skipped values are scanned without keeping their text in memory.
+    """
+
+    def __init__(self, json_file):
+
+        self.json_file = json_file
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self):
+        "Read more of the file, discarding the consumed part of the buffer"
+
+        data = self.json_file.read(NOTEBOOK_READ_SIZE)
+
+        if not data:
+            raise ValueError("Unexpected end of JSON document")
+
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        "Return the next non whitespace character without consuming it"
+
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            self._fill()
+
+    def expect(self, expected):
+
+        if (found := self.peek()) != expected:
+            raise ValueError(f"Expected '{expected}' in JSON document, found '{found}'")
+
+        self.pos += 1
+
+    def _scan_string(self, captured):
+        "Scan the rest of a string whose opening quote was already consumed"
+
+        while True:
+            if (match := STRING_SPECIAL_RE.search(self.buf, self.pos)) is None:
+                if captured is not None:
+                    captured.append(self.buf[self.pos:])
+                self.pos = len(self.buf)
+                self._fill()
+                continue
+
+            end = match.end()
+
+            # Escaped characters may be split across reads
+            if match.group() == "\\":
+                while end + 1 > len(self.buf):
+                    if captured is not None:
+                        captured.append(self.buf[self.pos:match.start()])
+                    self.pos = match.start()
+                    self._fill()
+                    match = STRING_SPECIAL_RE.search(self.buf, self.pos)
+                    end = match.end()
+
+                end += 1
+
+            if captured is not None:
+                captured.append(self.buf[self.pos:end])
+            self.pos = end
+
+            if match.group() == '"':
+                return
+
+    def _scan_value(self, captured):
+
+        first_char = self.peek()
+
+        if first_char == '"':
+            self.pos += 1
+            if captured is not None:
+                captured.append('"')
+            self._scan_string(captured)
+
+        elif first_char in "{[":
+            depth = 0
+            while True:
+                if (match := STRUCTURE_RE.search(self.buf, self.pos)) is None:
+                    if captured is not None:
+                        captured.append(self.buf[self.pos:])
+                    self.pos = len(self.buf)
+                    self._fill()
+                    continue
+
+                if captured is not None:
+                    captured.append(self.buf[self.pos:match.end()])
+                self.pos = match.end()
+
+                if match.group() == '"':
+                    self._scan_string(captured)
+                elif match.group() in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return
+
+        else:
+            # Numbers, true, false and null
+            while (match := SCALAR_END_RE.search(self.buf, self.pos)) is None:
+                if captured is not None:
+                    captured.append(self.buf[self.pos:])
+                self.pos = len(self.buf)
+                self._fill()
+
+            if captured is not None:
+                captured.append(self.buf[self.pos:match.start()])
+            self.pos = match.start()
+
+    def read_value(self):
+
+        captured = []
+        self._scan_value(captured)
+
+        return json.loads("".join(captured))
+
+    def skip_value(self):
+
+        self._scan_value(None)
+
+    def object_keys(self):
+        "Yield the keys of an object, the caller must read or skip each value"
+
+        self.expect("{")
+
+        while (next_char := self.peek()) != "}":
+            if next_char == ",":
+                self.pos += 1
+
+            key = self.read_value()
+            self.expect(":")
+
+            yield key
+
+        self.pos += 1
+
+    def array_items(self):
+        "Yield once for each item of an array, the caller must read or skip each item"
+
+        self.expect("[")
+
+        while (next_char := self.peek()) != "]":
+            if next_char == ",":
+                self.pos += 1
+
+            yield
+
+        self.pos += 1
+
+def read_parameters_notebook(notebook_filename):
+    """
+    Return a notebook dictionary holding only the metadata and the first cell tagged
+    parameters of a notebook. Cell outputs are skipped while reading so memory use does
+    not depend on the size of rendered plots or other outputs saved into the notebook.
+    """
+
+    notebook = {}
+    parameters_cell = None
+
+    with open(notebook_filename, "r", encoding="utf-8") as notebook_file:
+        reader = _JSONStreamReader(notebook_file)
+
+        for key in reader.object_keys():
+            if key != "cells":
+                notebook[key] = reader.read_value()
+                continue
+
+            for _ in reader.array_items():
+                if parameters_cell is not None:
+                    reader.skip_value()
+                    continue
+
+                cell = {}
+                for cell_key in reader.object_keys():
+                    if cell_key in SKIPPED_CELL_KEYS:
+                        reader.skip_value()
+                    else:
+                        cell[cell_key] = reader.read_value()
+
+                if "parameters" in cell.get("metadata", {}).get("tags", []):
+                    parameters_cell = cell
+
+    if notebook.get("nbformat") != 4:
+        raise ApplicationError(f"{notebook_filename} is not a version 4 Jupyter notebook")
+
+    if parameters_cell is not None:
+        parameters_cell["outputs"] = []
+        notebook["cells"] = [ parameters_cell ]
+    else:
+        notebook["cells"] = []
+
+    return notebook
+
+@functools.lru_cache(maxsize=None)
+def _notebook_validators():
+    "Validators for the nbformat v4.x schemas shipped with app_pack_generator, created once per process"
+    import jsonschema
+
+    validators = []
+    for schema_filename in SCHEMA_LIST:
+        if not os.path.exists(schema_filename):
+            logger.error(f'Validation file "{schema_filename}" does not exist.')
+            continue
+
+        with open(schema_filename, "r") as schema_file:
+            schema = json.load(schema_file)
+
+        validators.append(jsonschema.validators.validator_for(schema)(schema))
+
+    return validators
+
+def validate_notebook(notebook_filename):
+    "Validate the full notebook against the same nbformat schemas as ApplicationNotebook"
+
+    with open(notebook_filename, "r", encoding="utf-8") as notebook_file:
+        notebook = json.load(notebook_file)
+
+    if not any([ validator.is_valid(notebook) for validator in _notebook_validators() ]):
+        raise ApplicationError(f'Failed to validate "{notebook_filename}" as a v4.0 - v4.5 Jupyter Notebook...')
+
+def inspect_notebook_parameters(notebook_filename):
+    "Introspect notebook parameters with papermill using only the parameters cell of the notebook"
+    import papermill
+
+    notebook = read_parameters_notebook(notebook_filename)
+
+    # papermill only inspects notebook files, give it one without the other cells
+    with tempfile.TemporaryDirectory(prefix="unity_app_gen_nb_") as tmp_dir:
+        params_filename = os.path.join(tmp_dir, os.path.basename(notebook_filename))
+
+        with open(params_filename, "w", encoding="utf-8") as params_file:
+            json.dump(notebook, params_file)
+
+        return list(papermill.inspect_notebook(params_filename).values())
+
+class ParsedApplicationNotebook(ApplicationNotebook):
+    "ApplicationNotebook built from already introspected papermill parameters"
+
+    def __init__(self, notebook_filename, papermill_params):
+
+        ApplicationInterface.__init__(self)
+
+        # The class level default list of ApplicationInterface is shared between instances
+        self.arguments = []
+
+        self.notebook = {}
+        self.notebook_parameters = []
+        self.filename = notebook_filename
+
+        for papermill_param in papermill_params:
+            app_param = ApplicationParameter(papermill_param)
+            self.notebook_parameters.append(app_param)
+
+            inferred_type = app_param.inferred_type
+
+            if inferred_type in ['stage-in', 'stage_in']:
+                if self.stage_in_param is None:
+                    self.stage_in_param = app_param
+                else:
+                    raise ApplicationError(f"Only one stage-in parameter allowed per notebook")
+
+            elif inferred_type in ['stage-out', 'stage_out']:
+                if self.stage_out_param is None:
+                    self.stage_out_param = app_param
+                else:
+                    raise ApplicationError(f"Only one stage-out parameter allowed per notebook")
+            else:
+                self.arguments.append(app_param)
+
+def load_notebook(notebook_filename, cache_directory):
+    """
+    Return an ApplicationNotebook for notebook_filename using parameters cached in cache_directory
+    when the notebook is unchanged. The modification time and size identify an unchanged notebook,
+    falling back to comparing a hash of the contents when they differ, for example after a checkout.
+    Notebooks are validated against the nbformat schemas before their parameters are cached.
+    """
+
+    if not os.path.exists(notebook_filename):
+        raise ApplicationError(f"Could not find notebook file: {notebook_filename}")
+
+    parameter_cache = JSONCache(PARAMETER_CACHE_NAME, cache_directory=cache_directory)
+    cache_key = os.path.realpath(notebook_filename)
+
+    notebook_stat = os.stat(notebook_filename)
+    cached = parameter_cache.get(cache_key)
+
+    if cached is not None and cached["mtime_ns"] == notebook_stat.st_mtime_ns and cached["size"] == notebook_stat.st_size:
+        logger.debug(f"Using cached parameters for unchanged notebook {notebook_filename}")
+        return ParsedApplicationNotebook(notebook_filename, cached["parameters"])
+
+    notebook_digest = file_digest(notebook_filename)
+
+    if cached is not None and cached["sha256"] == notebook_digest:
+        logger.debug(f"Using cached parameters for notebook {notebook_filename} with unchanged contents")
+        papermill_params = cached["parameters"]
+    else:
+        logger.info(f'Reading notebook parameters: "{notebook_filename}"')
+
+        try:
+            validate_notebook(notebook_filename)
+            papermill_params = inspect_notebook_parameters(notebook_filename)
+        except ValueError as err:
+            # Let the full parser report what is wrong with the notebook
+            logger.debug(f"Streaming parse of {notebook_filename} failed, parsing full notebook: {err}")
+            return ApplicationNotebook(notebook_filename)
+
+    parameter_cache.set(cache_key, {
+        "mtime_ns": notebook_stat.st_mtime_ns,
+        "size": notebook_stat.st_size,
+        "sha256": notebook_digest,
+        "parameters": papermill_params,
+    })
+
+    return ParsedApplicationNotebook(notebook_filename, papermill_params)
+
+class NotebookApplication(object):
+    """
+    A notebook of the source repository generated and registered as its own application. The
+    default notebook is named after the repository and others after the repository and the path
+    of the notebook. Generated files are placed in subdirectory of the CWL output path, which is
+    empty when the repository has a single notebook.
+    """
+
+    def __init__(self, notebook_path, repo_name, subdirectory=""):
+
+        # Path relative to the repository directory
+        self.notebook_path = notebook_path
+        self.subdirectory = subdirectory
+
+        if notebook_path == DEFAULT_NOTEBOOK:
+            self.name = repo_name
+        else:
+            self.name = f"{repo_name}-{notebook_slug(notebook_path)}"
+
+    def descriptor_repository(self, repo_info):
+        "Repository information for the application descriptor, whose id is made from the repository name"
+
+        return _DescriptorRepository(self.name, repo_info.owner, repo_info.commit_identifier, repo_info.commit_message)
+
+    def to_dict(self):
+
+        return { "notebook": self.notebook_path, "subdirectory": self.subdirectory }
+
+    @classmethod
+    def from_dict(cls, name, values):
+
+        notebook_app = cls(values["notebook"], "", values["subdirectory"])
+        notebook_app.name = name
+
+        return notebook_app
+
+class _DescriptorRepository(object):
+    """
+    GitManager stand in holding the values used by Descriptor, read beforehand since GitPython
+    objects can not be used from multiple threads
+    """
+
+    def __init__(self, name, owner, commit_identifier, commit_message):
+
+        self.name = name
+        self.owner = owner
+        self.commit_identifier = commit_identifier
+        self.commit_message = commit_message
+
+def notebook_slug(notebook_path):
+    "Notebook path without extension and with other characters than letters and numbers replaced by dashes"
+
+    return APPLICATION_NAME_RE.sub("-", os.path.splitext(notebook_path)[0]).strip("-")
+
+def has_parameters_cell(notebook_filename):
+
+    try:
+        return len(read_parameters_notebook(notebook_filename)["cells"]) > 0
+    except (OSError, ValueError, ApplicationError) as err:
+        logger.debug(f"Not using {notebook_filename} as an application notebook: {err}")
+        return False
+
+def discover_notebooks(repo_directory, exclude_paths=[]):
+    """
+    Return the paths relative to repo_directory of the notebooks to generate applications from
+    when none are declared: the default notebook when it exists, otherwise every notebook with
+    a cell tagged parameters.
+    """
+
+    if os.path.exists(os.path.join(repo_directory, DEFAULT_NOTEBOOK)):
+        return [ DEFAULT_NOTEBOOK ]
+
+    exclude_paths = [ os.path.realpath(excl_path) for excl_path in exclude_paths ]
+
+    notebook_paths = []
+    for dir_path, dir_names, filenames in os.walk(repo_directory):
+        dir_names[:] = sorted([ d for d in dir_names if not d.startswith(".") and d not in SKIPPED_NOTEBOOK_DIRECTORIES and
+                                os.path.realpath(os.path.join(dir_path, d)) not in exclude_paths ])
+
+        for filename in sorted(filenames):
+            notebook_filename = os.path.join(dir_path, filename)
+
+            if filename.endswith(".ipynb") and has_parameters_cell(notebook_filename):
+                notebook_paths.append(os.path.relpath(notebook_filename, repo_directory))
+
+    logger.debug(f"Discovered notebooks in {repo_directory}: {notebook_paths}")
+
+    return notebook_paths
+
+def notebook_applications(repo_directory, repo_name, notebooks=None, exclude_paths=[]):
+    """
+    Return NotebookApplication objects for the notebooks of a repository. notebooks lists paths
+    or glob patterns relative to repo_directory, without it the notebooks are discovered.
+    """
+
+    if notebooks is None:
+        notebook_paths = discover_notebooks(repo_directory, exclude_paths)
+    else:
+        notebook_paths = []
+        for notebook_pattern in notebooks:
+            matches = sorted(glob(os.path.join(repo_directory, notebook_pattern), recursive=True))
+
+            if len(matches) == 0 and not has_magic(notebook_pattern):
+                raise ApplicationError(f"Could not find notebook file: {os.path.join(repo_directory, notebook_pattern)}")
+
+            for notebook_filename in matches:
+                notebook_path = os.path.relpath(notebook_filename, repo_directory)
+
+                if notebook_path.startswith(os.pardir + os.sep):
+                    raise ApplicationError(f"Notebook {notebook_pattern} is outside of the repository directory {repo_directory}")
+
+                if notebook_path not in notebook_paths:
+                    notebook_paths.append(notebook_path)
+
+    if len(notebook_paths) == 0:
+        raise ApplicationError(f"Could not find any notebook files in {repo_directory}, declare them or add a {DEFAULT_NOTEBOOK} notebook")
+
+    if len(notebook_paths) == 1:
+        return [ NotebookApplication(notebook_paths[0], repo_name) ]
+
+    notebook_apps = [ NotebookApplication(notebook_path, repo_name, notebook_slug(notebook_path)) for notebook_path in notebook_paths ]
+
+    subdirectories = [ notebook_app.subdirectory for notebook_app in notebook_apps ]
+    if (duplicates := set([ s for s in subdirectories if subdirectories.count(s) > 1 ])):
+        raise ApplicationError("Notebooks would share the application names: " + ", ".join([ f"{repo_name}-{d}" for d in sorted(duplicates) ]))
+
+    return notebook_apps
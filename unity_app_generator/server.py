@@ -0,0 +1,434 @@
+"""
+Long running build server exposing the programmatic interface over a local HTTP API
+
+Endpoints:
+    GET  /health              Server status
+    POST /jobs                Queue a job, body: {"operation": "<name>", "args": {...}}
+    GET  /jobs                Status of all jobs
+    GET  /jobs/<id>           Status of a job
+    GET  /jobs/<id>/log       Log of a job, streamed until the job finishes when ?follow=1
+    GET  /jobs/<id>/events    Docker build and push progress events of a job as JSON lines, also supports ?follow=1
+
+Operation names are the build_ogc_app subcommand names and args are the keyword
+arguments of the corresponding function in unity_app_generator.interface.
+
+When the server has an auth token every request must send it in an
+"Authorization: Bearer <token>" header. Listening on an address other than
+loopback or a Unix socket requires a token.
+"""
+
+import os
+import hmac
+import json
+import uuid
+import time
+import asyncio
+import logging
+import ipaddress
+import threading
+import importlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from urllib.parse import urlsplit, parse_qs
+
+from . import interface
+from .generator import UnityApplicationGenerator, ApplicationGenerationError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Modules imported when the server starts so that the first job does not pay for them
+WARM_IMPORTS = [ "app_pack_generator", "unity_sds_client.services.application_service", "boto3" ]
+
+# Seconds between checks for new log lines when following a job log
+LOG_FOLLOW_INTERVAL = 0.2
+
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# Number of finished jobs kept for status and log requests, older ones are removed
+DEFAULT_MAX_FINISHED_JOBS = 100
+
+# Log and event lines kept per job, later lines are dropped
+MAX_JOB_LINES = 100000
+
+# Job whose operation is running in the current context, copied into the worker threads of its stages
+current_job = contextvars.ContextVar("current_job", default=None)
+
+def is_loopback_host(host):
+    "Whether host only accepts connections from the local machine"
+
+    if host == "localhost":
+        return True
+
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def _notebook_parameters(state_directory, notebooks=None, **kwargs):
+    "Return the parameter summary instead of printing it"
+
+    state_dir = interface.check_state_directory(interface.state_directory_path(state_directory))
+
+    return UnityApplicationGenerator(state_dir, **interface.generator_options(kwargs)).notebook_parameters(notebooks=notebooks)
+
+OPERATIONS = {
+    "init": interface.init,
+    "build_docker": interface.build_docker,
+    "push_docker": interface.push_docker,
+    "push_ecr": interface.push_ecr,
+    "parameters": _notebook_parameters,
+    "build_cwl": interface.build_cwl,
+    "validate_cwl": interface.validate_cwl,
+    "push_app_registry": interface.push_app_registry,
+    "all": interface.run_pipeline,
+    "resume": interface.resume,
+}
+
+class BuildJob(object):
+
+    def __init__(self, operation, args):
+
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.args = args
+
+        self.status = "queued"
+        self.result = None
+        self.error = None
+
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+        self.log_lines = []
+        self.event_lines = []
+
+    def _add_line(self, lines, line, truncated_line):
+
+        if len(lines) < MAX_JOB_LINES:
+            lines.append(line)
+        elif len(lines) == MAX_JOB_LINES:
+            lines.append(truncated_line)
+
+    def add_log(self, line):
+        self._add_line(self.log_lines, line, f"Log truncated after {MAX_JOB_LINES} lines")
+
+    def add_event(self, event):
+        self._add_line(self.event_lines, json.dumps(event), json.dumps({ "event": "truncated", "lines": MAX_JOB_LINES }))
+
+    @property
+    def done(self):
+        return self.status in ("success", "failed")
+
+    def info(self):
+
+        return {
+            "id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+class JobLogHandler(logging.Handler):
+    "Routes log records to the job running in the context of the thread that emitted them"
+
+    def emit(self, record):
+
+        if (job := current_job.get()) is not None:
+            job.add_log(self.format(record))
+
+class BuildServer(object):
+    """
+    Runs jobs from a queue on a pool of worker threads. Docker builds and network transfers
+    have their own concurrency limits as in interface.batch. A single Docker client is shared
+    by all jobs and the heavy dependencies are imported once at startup.
+    """
+
+    def __init__(self, max_workers=4, max_builds=1, max_transfers=4, docker_util_factory=None, app_catalog_factory=None,
+                 max_finished_jobs=DEFAULT_MAX_FINISHED_JOBS, auth_token=None):
+
+        self.auth_token = auth_token
+
+        self.jobs = {}
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs_lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        build_limit = threading.BoundedSemaphore(max_builds)
+        transfer_limit = threading.BoundedSemaphore(max_transfers)
+
+        self.stage_limits = { stage_name: build_limit for stage_name in interface.BATCH_BUILD_STAGES }
+        self.stage_limits.update({ stage_name: transfer_limit for stage_name in interface.BATCH_TRANSFER_STAGES })
+
+        self._docker_client = None
+        self._docker_lock = threading.Lock()
+
+        # Passed to the generators of each job
+        self.docker_util_factory = docker_util_factory if docker_util_factory is not None else self._shared_docker_util
+        self.app_catalog_factory = app_catalog_factory
+
+        self.log_handler = JobLogHandler()
+        self.log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logging.getLogger().addHandler(self.log_handler)
+
+    def _shared_docker_client(self):
+        "Docker client opened for the first job and used by every later one"
+        import docker
+        from app_pack_generator.docker import DOCKER_CLIENT_TIMEOUT
+
+        with self._docker_lock:
+            if self._docker_client is None:
+                self._docker_client = docker.from_env(timeout=DOCKER_CLIENT_TIMEOUT)
+
+        return self._docker_client
+
+    def _shared_docker_util(self, git_mgr, **kwargs):
+        from .docker_stream import StreamingDockerUtil
+
+        return StreamingDockerUtil(git_mgr, docker_client=self._shared_docker_client(), **kwargs)
+
+    def warm_imports(self):
+
+        for module_name in WARM_IMPORTS:
+            try:
+                importlib.import_module(module_name)
+            except ImportError as err:
+                logger.warning(f"Could not preload {module_name}: {err}")
+
+    def submit(self, operation, args):
+
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}, must be one of: {', '.join(OPERATIONS.keys())}")
+
+        if not isinstance(args, dict):
+            raise ValueError("Job args must be a JSON object")
+
+        job = BuildJob(operation, args)
+
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+
+        self.executor.submit(self._run_job, job)
+
+        logger.info(f"Queued job {job.id}: {operation}")
+
+        return job
+
+    def job_list(self):
+
+        with self._jobs_lock:
+            return list(self.jobs.values())
+
+    def _remove_finished_jobs(self):
+        "Remove the oldest finished jobs beyond the number kept"
+
+        with self._jobs_lock:
+            finished_jobs = sorted([ job for job in self.jobs.values() if job.done ], key=lambda job: job.finished)
+
+            for job in finished_jobs[:max(0, len(finished_jobs) - self.max_finished_jobs)]:
+                del self.jobs[job.id]
+
+    def _run_job(self, job):
+
+        # Executor threads are reused, so each job runs in its own context
+        contextvars.copy_context().run(self._run_job_in_context, job)
+
+    def _run_job_in_context(self, job):
+
+        current_job.set(job)
+
+        job.status = "running"
+        job.started = time.time()
+
+        job_args = { **job.args, "event_callback": job.add_event,
+                     "docker_util_factory": self.docker_util_factory, "app_catalog_factory": self.app_catalog_factory }
+
+        try:
+            if job.operation == "all":
+                result = OPERATIONS[job.operation](stage_limits=self.stage_limits, **job_args)
+            else:
+                with self.stage_limits.get(job.operation, nullcontext()):
+                    result = OPERATIONS[job.operation](**job_args)
+
+        except Exception as err:
+            logger.exception(f"Job {job.id} failed")
+            job.error = str(err)
+            job.status = "failed"
+
+        else:
+            if isinstance(result, UnityApplicationGenerator):
+                job.result = dict(result.app_state.state_values)
+            else:
+                job.result = result
+            job.status = "success"
+
+        finally:
+            job.finished = time.time()
+
+        self._remove_finished_jobs()
+
+    async def _follow_lines(self, job, lines, writer):
+
+        line_index = 0
+        while True:
+            # Check for completion before reading lines so no lines are missed at the end
+            job_done = job.done
+
+            new_lines = lines[line_index:]
+            line_index += len(new_lines)
+
+            if len(new_lines) > 0:
+                await self._write_chunk(writer, "".join([ line + "\n" for line in new_lines ]))
+
+            if job_done:
+                break
+
+            await asyncio.sleep(LOG_FOLLOW_INTERVAL)
+
+        await self._write_chunk(writer, "")
+
+    async def _write_chunk(self, writer, text):
+
+        data = text.encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+    async def _send(self, writer, status, body, content_type="application/json"):
+
+        if content_type == "application/json":
+            body = json.dumps(body, indent=4)
+
+        data = body.encode()
+
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode())
+        writer.write(data)
+        await writer.drain()
+
+    async def _read_request(self, reader):
+
+        header_data = await reader.readuntil(b"\r\n\r\n")
+
+        request_line, *header_lines = header_data.decode().split("\r\n")
+        method, target, _ = request_line.split(" ", 2)
+
+        headers = {}
+        for header_line in header_lines:
+            if ":" in header_line:
+                name, value = header_line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        content_length = int(headers.get("content-length", 0))
+        if content_length > MAX_REQUEST_SIZE:
+            raise ValueError("Request body too large")
+
+        body = await reader.readexactly(content_length) if content_length > 0 else b""
+
+        return method, target, headers, body
+
+    def _authorized(self, headers):
+
+        if self.auth_token is None:
+            return True
+
+        return hmac.compare_digest(headers.get("authorization", "").encode(), f"Bearer {self.auth_token}".encode())
+
+    async def handle_connection(self, reader, writer):
+
+        try:
+            try:
+                method, target, headers, body = await self._read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as err:
+                await self._send(writer, "400 Bad Request", { "error": f"Malformed request: {err}" })
+                return
+
+            if not self._authorized(headers):
+                await self._send(writer, "401 Unauthorized", { "error": "Missing or invalid auth token" })
+                return
+
+            url = urlsplit(target)
+            path_parts = [ p for p in url.path.split("/") if p != "" ]
+            query = parse_qs(url.query)
+
+            if method == "GET" and path_parts == ["health"]:
+                await self._send(writer, "200 OK", { "status": "ok", "jobs": len(self.job_list()) })
+
+            elif method == "POST" and path_parts == ["jobs"]:
+                try:
+                    request = json.loads(body or b"{}")
+                    job = self.submit(request.get("operation"), request.get("args", {}))
+                except ValueError as err:
+                    await self._send(writer, "400 Bad Request", { "error": str(err) })
+                else:
+                    await self._send(writer, "202 Accepted", job.info())
+
+            elif method == "GET" and path_parts == ["jobs"]:
+                await self._send(writer, "200 OK", [ job.info() for job in self.job_list() ])
+
+            elif method == "GET" and len(path_parts) in (2, 3) and path_parts[0] == "jobs" and \
+                 (job := self.jobs.get(path_parts[1])) is not None:
+
+                if len(path_parts) == 2:
+                    await self._send(writer, "200 OK", job.info())
+
+                elif path_parts[2] in ("log", "events"):
+                    lines = job.log_lines if path_parts[2] == "log" else job.event_lines
+
+                    if query.get("follow", ["0"])[0] not in ("0", "false"):
+                        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+                        await self._follow_lines(job, lines, writer)
+                    else:
+                        await self._send(writer, "200 OK", "".join([ line + "\n" for line in lines ]), content_type="text/plain")
+
+                else:
+                    await self._send(writer, "404 Not Found", { "error": f"Unknown path {url.path}" })
+
+            else:
+                await self._send(writer, "404 Not Found", { "error": f"Unknown path {url.path}" })
+
+        except ConnectionError:
+            logger.debug("Client disconnected")
+
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            logger.info(f"Build server listening on unix socket {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+            logger.info(f"Build server listening on http://{host}:{port}")
+
+        async with server:
+            await server.serve_forever()
+
+def run_server(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, max_workers=4, max_builds=1, max_transfers=4,
+               max_finished_jobs=DEFAULT_MAX_FINISHED_JOBS, auth_token=None):
+
+    # Jobs run commands with the permissions of the server, so only local clients may use it without a token
+    if socket_path is None and not is_loopback_host(host) and auth_token is None:
+        raise ApplicationGenerationError(f"The build server can only listen on {host} with an auth token, jobs run with the permissions of the server")
+
+    build_server = BuildServer(max_workers=max_workers, max_builds=max_builds, max_transfers=max_transfers,
+                               max_finished_jobs=max_finished_jobs, auth_token=auth_token)
+    build_server.warm_imports()
+
+    try:
+        asyncio.run(build_server.serve(host=host, port=port, socket_path=socket_path))
+    except KeyboardInterrupt:
+        logger.info("Build server stopped")
+    finally:
+        build_server.executor.shutdown(wait=False, cancel_futures=True)
+
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
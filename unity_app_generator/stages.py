@@ -0,0 +1,46 @@
+import time
+import inspect
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+# Stages in the order the pipeline runs them. init has no record, it is complete once the state directory exists.
+PIPELINE_STAGES = [ "build_docker", "push_docker", "push_ecr", "build_cwl", "validate_cwl", "push_app_registry" ]
+
+def checkpointed(stage_name, recorded_arguments=[]):
+    """
+    Decorator for UnityApplicationGenerator methods that run a pipeline stage. A record of the
+    stage is kept in the application state with its status, the values of the recorded_arguments
+    of the method and, once it succeeds, a fingerprint of its inputs. Resuming uses the records
+    to run only the stages that failed or whose inputs changed.
+    """
+
+    def decorator(method):
+
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            bound_args = signature.bind(self, *args, **kwargs)
+            bound_args.apply_defaults()
+
+            arguments = self._stage_arguments(stage_name, { name: bound_args.arguments[name] for name in recorded_arguments })
+
+            self.app_state.stage_records = { **self.app_state.stage_records,
+                stage_name: { "status": "running", "arguments": arguments, "started": time.time() } }
+
+            try:
+                result = method(self, *args, **kwargs)
+            except BaseException as err:
+                self._update_stage_record(stage_name, status="error", error=str(err), finished=time.time())
+                raise
+
+            self._update_stage_record(stage_name, status="success", finished=time.time(),
+                                      input_fingerprint=self._stage_input_fingerprint(stage_name, arguments, recorded=True))
+
+            return result
+
+        return wrapper
+
+    return decorator
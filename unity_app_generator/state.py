@@ -1,18 +1,40 @@
 import os
+import copy
 import json
 import logging
+from contextlib import contextmanager
+
+from .locking import file_lock, atomic_write
 
 STORE_BASENAME = "app_state.json"
+LOCK_BASENAME = "app_state.json.lock"
+
+# Key in the store file holding the number of times it has been written
+VERSION_KEY = "state_version"
+
+# Markers used while merging values changed concurrently
+_CONFLICT = object()
+_MISSING = object()
 
 logger = logging.getLogger(__name__)
 
 class ApplicationStateError(Exception):
     pass
 
-class ApplicationState(object):
+class ApplicationStateConflictError(ApplicationStateError):
+    pass
 
+class ApplicationState(object):
+    """
+    Values recorded in the store file of a state directory. Each write holds an advisory
+    lock on the state directory and increments the version number in the store file. When
+    another process or instance wrote the store file since it was read, values it changed
+    are merged in before writing, unless both changed the same value, or the same key of a
+    dictionary value, differently.
+    """
 
-    state_values = {
+    # Default values, each instance works on its own copy
+    default_values = {
         "app_base_path": "",
         "cwl_output_path": "",
 
@@ -21,14 +43,44 @@ class ApplicationState(object):
         "docker_image_repository": None,
         "docker_image_tag": None,
         "docker_image_reference": None,
+        "docker_build_fingerprint": None,
+        "docker_targets": {},
+        "docker_layer_reports": {},
+        "docker_optimized_image": None,
+        "docker_builder": None,
         "docker_url": None,
+        "docker_pushed_image_id": None,
+        "docker_image_digest": None,
         "app_registry_id": None,
+        "app_registry_ids": {},
+        "app_registry_file_hashes": {},
+        "cwl_notebooks": None,
+        "cwl_applications": {},
+        "cwl_input_fingerprint": None,
+        "cwl_output_hashes": {},
+        "cwl_bundle_path": None,
+        "cwl_validated_hashes": {},
+        "stage_records": {},
     }
 
     def __init__(self, state_directory, app_base_path=None, source_repository=None):
 
+        # Set directly since attribute assignment looks up state_values
+        self.__dict__["state_values"] = copy.deepcopy(self.__class__.default_values)
+
         self.state_directory = os.path.realpath(state_directory)
         self.values_store_filename = os.path.join(self.state_directory, STORE_BASENAME)
+        self.lock_filename = os.path.join(self.state_directory, LOCK_BASENAME)
+
+        # Tracks unwritten changes and nesting of batch() blocks
+        self._dirty = False
+        self._batch_depth = 0
+
+        # Version of the store file and its values when last read or written, along with
+        # the names of values changed since then
+        self._version = 0
+        self._stored_values = copy.deepcopy(self.state_values)
+        self._changed = set()
 
         # Initialize state directory and store file
         if self.__class__.exists(self.state_directory):
@@ -41,27 +93,96 @@ class ApplicationState(object):
     def _init_new(self, app_base_path, source_repository=None):
 
         if app_base_path is None:
-            raise ApplicationStateError(f"app_base_path must be supplied when state directory or store file does not already exist. State directory: {state_directory}, Store filename: {self.values_store_filename}")
+            raise ApplicationStateError(f"app_base_path must be supplied when state directory or store file does not already exist. State directory: {self.state_directory}, Store filename: {self.values_store_filename}")
 
-        self.state_values["app_base_path"] = app_base_path
+        with self.batch():
+            self.state_values["app_base_path"] = app_base_path
 
-        if os.path.exists(source_repository):
-            self.state_values["source_repository"] = os.path.realpath(source_repository)
-        else:
-            self.state_values["source_repository"] = source_repository
+            if os.path.exists(source_repository):
+                self.state_values["source_repository"] = os.path.realpath(source_repository)
+            else:
+                self.state_values["source_repository"] = source_repository
+
+            # Default path
+            self.cwl_output_path = os.path.join(self.state_directory, "cwl")
+
+            # Always write out a new store file
+            self._changed.update(["app_base_path", "source_repository"])
+            self._dirty = True
+
+    def _load_store(self):
+        "Return the values and version in the store file"
 
-        # Default path
-        self.cwl_output_path = os.path.join(self.state_directory, "cwl")
+        with open(self.values_store_filename, "r") as dump_file:
+            stored_values = json.load(dump_file)
 
-        self._write_state()
+        return stored_values, stored_values.pop(VERSION_KEY, 0)
 
     def _read_state(self):
 
         if not os.path.exists(self.values_store_filename):
             raise ApplicationStateError(f"Values store file does not exist: {self.values_store_filename}")
 
-        with open(self.values_store_filename, "r") as dump_file:
-            self.state_values.update(json.load(dump_file))
+        with file_lock(self.lock_filename, shared=True):
+            stored_values, self._version = self._load_store()
+
+        self.state_values.update(stored_values)
+
+        self._stored_values = copy.deepcopy(self.state_values)
+        self._changed = set()
+
+    @staticmethod
+    def _merge_value(stored_value, base_value, local_value):
+        """
+        Combine a value changed locally with the value written by others since base_value was
+        read. Dictionaries are merged key by key. Returns _CONFLICT if both changed it differently.
+        """
+
+        if stored_value == base_value or stored_value == local_value:
+            return local_value
+
+        if not all([ isinstance(v, dict) for v in (stored_value, base_value, local_value) ]):
+            return _CONFLICT
+
+        merged_value = {}
+        for key in set(stored_value) | set(base_value) | set(local_value):
+            stored_item, base_item, local_item = [ v.get(key, _MISSING) for v in (stored_value, base_value, local_value) ]
+
+            if stored_item == base_item or stored_item == local_item:
+                merged_item = local_item
+            elif local_item == base_item:
+                merged_item = stored_item
+            else:
+                return _CONFLICT
+
+            if merged_item is not _MISSING:
+                merged_value[key] = merged_item
+
+        return merged_value
+
+    def _merge_stored(self, stored_values, stored_version):
+        "Take values written by others since this instance last read or wrote the store file"
+
+        merged_values = {}
+        conflicts = []
+        for name in self._changed:
+            if name not in stored_values:
+                continue
+
+            merged_value = self._merge_value(stored_values[name], self._stored_values.get(name), self.state_values[name])
+
+            if merged_value is _CONFLICT:
+                conflicts.append(name)
+            else:
+                merged_values[name] = merged_value
+
+        if len(conflicts) > 0:
+            raise ApplicationStateConflictError(f"State values {', '.join(sorted(conflicts))} in {self.values_store_filename} were changed " +
+                                                f"by another process since version {self._version} was read, now at version {stored_version}")
+
+        logger.debug(f"Merging changes from version {stored_version} of {self.values_store_filename} into version {self._version}")
+
+        self.state_values.update({ **stored_values, **merged_values })
 
     def _write_state(self):
 
@@ -69,11 +190,68 @@ class ApplicationState(object):
         if not os.path.exists(state_parent_dir):
             raise ApplicationStateError(f"Can not create {self.state_directory} since parent directory {state_parent_dir} does not exist.")
 
-        if not os.path.exists(self.state_directory):
-            os.mkdir(self.state_directory)
+        os.makedirs(self.state_directory, exist_ok=True)
+
+        with file_lock(self.lock_filename):
+            stored_version = self._version
+
+            if os.path.exists(self.values_store_filename):
+                stored_values, stored_version = self._load_store()
+
+                if stored_version != self._version:
+                    self._merge_stored(stored_values, stored_version)
+
+            new_version = stored_version + 1
+
+            with atomic_write(self.values_store_filename) as dump_file:
+                json.dump({ **self.state_values, VERSION_KEY: new_version }, dump_file, sort_keys=True, indent=4)
+
+        self._version = new_version
+        self._stored_values = copy.deepcopy(self.state_values)
+        self._changed = set()
+        self._dirty = False
+
+    def reload(self):
+        "Read values written by others since the store file was last read, keeping unwritten changes"
+
+        if not os.path.exists(self.values_store_filename):
+            return
+
+        with file_lock(self.lock_filename, shared=True):
+            stored_values, stored_version = self._load_store()
+
+        if stored_version != self._version:
+            self._merge_stored(stored_values, stored_version)
+
+            self._version = stored_version
+            self._stored_values.update(copy.deepcopy(stored_values))
+            self._changed = set([ name for name in self._changed if self.state_values[name] != self._stored_values.get(name) ])
 
-        with open(self.values_store_filename, "w") as dump_file:
-            json.dump(self.state_values, dump_file, sort_keys=True, indent=4)
+    @property
+    def version(self):
+        "Version of the store file when last read or written by this instance"
+        return self._version
+
+    def flush(self):
+        "Write state values to disk if any have changed since the last write"
+
+        if self._dirty:
+            self._write_state()
+
+    @contextmanager
+    def batch(self):
+        """
+        Defer writing of state values until the end of the block so that multiple
+        assignments result in a single write of the store file
+        """
+
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
 
     @classmethod
     def exists(cls, state_directory):
@@ -84,6 +262,10 @@ class ApplicationState(object):
 
     def __getattr__(self, name):
 
+        # Only reached for state_values before __init__ has run, such as when copying
+        if name == "state_values":
+            raise AttributeError(name)
+
         if not name in self.state_values:
             raise ApplicationStateError(f"{name} is not a valid state value name")
 
@@ -92,7 +274,14 @@ class ApplicationState(object):
     def __setattr__(self, name, new_value):
 
         if name in self.state_values:
+            if self.state_values[name] == new_value:
+                return
+
             self.state_values[name] = new_value
-            self._write_state()
+            self._changed.add(name)
+            self._dirty = True
+
+            if self._batch_depth == 0:
+                self.flush()
         else:
             self.__dict__[name] = new_value
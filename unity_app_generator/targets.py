@@ -0,0 +1,77 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BuildTargetError(Exception):
+    pass
+
+class BuildTarget(object):
+    """
+    One image built for an application. Targets are described by specification strings of the form:
+
+        [name=]platform[@base_image]
+
+    For example "linux/arm64" or "gpu=linux/amd64@nvidia/cuda:12.4.1-runtime-ubuntu22.04". The name
+    defaults to the architecture part of the platform and is appended to the image tag.
+
+    Targets using the default base image are combined into a multi-architecture manifest list.
+    Targets with their own base image are variants that are only available under their own tag.
+    """
+
+    def __init__(self, name, platform, base_image=None):
+
+        self.name = name
+        self.platform = platform
+        self.base_image = base_image
+
+    @classmethod
+    def from_spec(cls, spec):
+
+        name = None
+        if "=" in spec.split("@", 1)[0]:
+            name, spec = spec.split("=", 1)
+
+        platform, _, base_image = spec.partition("@")
+
+        if not platform.startswith("linux/") or len(platform.split("/")) not in (2, 3):
+            raise BuildTargetError(f"Build target platform must be of the form linux/<architecture>[/<variant>]: {spec}")
+
+        if name is None:
+            name = "".join(platform.split("/")[1:])
+
+        return cls(name, platform, base_image or None)
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["name"], values["platform"], values.get("base_image"))
+
+    def to_dict(self):
+        return { "name": self.name, "platform": self.platform, "base_image": self.base_image }
+
+    @property
+    def in_manifest_list(self):
+        return self.base_image is None
+
+    def image_reference(self, image_reference):
+        "Reference of the image for this target derived from the application image reference"
+
+        return f"{image_reference}-{self.name}"
+
+def parse_build_targets(target_specs):
+    "Convert a list of specification strings or BuildTarget objects into BuildTargets"
+
+    targets = [ BuildTarget.from_spec(t) if isinstance(t, str) else t for t in target_specs ]
+
+    target_names = [ t.name for t in targets ]
+    if len(set(target_names)) != len(target_names):
+        raise BuildTargetError(f"Build target names must be unique: {', '.join(target_names)}")
+
+    manifest_platforms = [ t.platform for t in targets if t.in_manifest_list ]
+
+    if len(targets) > 0 and len(manifest_platforms) == 0:
+        raise BuildTargetError("At least one build target must use the default base image")
+
+    if len(set(manifest_platforms)) != len(manifest_platforms):
+        raise BuildTargetError(f"Only one target per platform can use the default base image: {', '.join(manifest_platforms)}")
+
+    return targets
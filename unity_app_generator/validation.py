@@ -0,0 +1,358 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import functools
+
+from .cache import JSONCache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "schemas")
+
+CWL_SCHEMA = "cwl.schema.json"
+DESCRIPTOR_SCHEMA = "application_descriptor.schema.json"
+
+# File generated for Dockstore that only points to the entry point of an application
+DOCKSTORE_CWL = "Dockstore.cwl"
+
+# Name of the user cache of file check results by file digest
+VALIDATION_CACHE_NAME = "cwl_validation"
+
+# Increment when the checks change so that memoized results from earlier checks are not used
+VALIDATOR_VERSION = 1
+
+@functools.lru_cache(maxsize=None)
+def schema_validator(schema_name):
+    "JSON Schema validator for a schema in the schema directory, loaded once per process"
+    import jsonschema
+
+    with open(os.path.join(SCHEMA_DIRECTORY, schema_name), "r") as schema_file:
+        schema = json.load(schema_file)
+
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+
+    return validator_class(schema, format_checker=validator_class.FORMAT_CHECKER)
+
+@functools.lru_cache(maxsize=None)
+def checks_fingerprint():
+    "Digest of the validator version and schema contents that memoized results depend on"
+
+    hasher = hashlib.sha256(f"{VALIDATOR_VERSION}".encode())
+
+    for schema_name in (CWL_SCHEMA, DESCRIPTOR_SCHEMA):
+        with open(os.path.join(SCHEMA_DIRECTORY, schema_name), "rb") as schema_file:
+            hasher.update(schema_file.read())
+
+    return hasher.hexdigest()[:16]
+
+def _issue(severity, message, path=""):
+    return { "severity": severity, "path": path, "message": message }
+
+def _load_document(basename, contents):
+    import yaml
+
+    if basename.endswith(".json"):
+        return json.loads(contents)
+
+    # The libyaml based loader is many times faster when available
+    return yaml.load(contents, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+def _error_message(error):
+    "Message for a schema violation that names the offending fields or values"
+
+    if error.validator == "additionalProperties" and isinstance(error.instance, dict):
+        known_fields = error.schema.get("properties", {})
+        field_patterns = [ re.compile(pattern) for pattern in error.schema.get("patternProperties", {}) ]
+
+        unknown_fields = [ field for field in error.instance
+                           if field not in known_fields and not any([ pattern.search(field) for pattern in field_patterns ]) ]
+
+        return f"Unknown field {', '.join(unknown_fields)}, fields of extensions need a namespace prefix"
+
+    if error.validator == "pattern" and "title" in error.schema:
+        return f"{error.instance!r} is not a valid {error.schema['title']}"
+
+    return error.message
+
+def _schema_issues(schema_name, document):
+    "Schema violations of a document, reporting the most specific cause of alternatives that all failed"
+
+    issues = []
+    for error in schema_validator(schema_name).iter_errors(document):
+        while len(error.context) > 0:
+            error = max(error.context, key=lambda e: len(e.absolute_path))
+
+        path = "".join([ f"/{part}" for part in error.absolute_path ])
+        issues.append(_issue("error", _error_message(error), path))
+
+    return sorted(issues, key=lambda issue: issue["path"])
+
+def _ids(parameters):
+    "Identifiers of CWL parameters or steps given either as a map or a list"
+
+    if isinstance(parameters, dict):
+        return list(parameters.keys())
+
+    if isinstance(parameters, list):
+        return [ str(item["id"]).lstrip("#") for item in parameters if isinstance(item, dict) and "id" in item ]
+
+    return []
+
+def _items(parameters):
+    "(identifier, value) pairs of CWL parameters or steps given either as a map or a list"
+
+    if isinstance(parameters, dict):
+        return list(parameters.items())
+
+    if isinstance(parameters, list):
+        return [ (str(item["id"]).lstrip("#"), item) for item in parameters if isinstance(item, dict) and "id" in item ]
+
+    return []
+
+def _as_list(value):
+
+    if value is None:
+        return []
+
+    return value if isinstance(value, list) else [value]
+
+def _cwl_summary(document):
+    "Parts of a CWL document that other files of the package refer to"
+
+    summary = {
+        "class": document.get("class"),
+        "inputs": _ids(document.get("inputs")),
+        "outputs": _ids(document.get("outputs")),
+        "output_sources": [ source for _, output in _items(document.get("outputs"))
+                            if isinstance(output, dict) for source in _as_list(output.get("outputSource")) ],
+        "steps": {},
+        "docker_pull": None,
+    }
+
+    requirements = document.get("requirements")
+    if isinstance(requirements, dict):
+        summary["docker_pull"] = (requirements.get("DockerRequirement") or {}).get("dockerPull")
+    elif isinstance(requirements, list):
+        for requirement in requirements:
+            if isinstance(requirement, dict) and requirement.get("class") == "DockerRequirement":
+                summary["docker_pull"] = requirement.get("dockerPull")
+
+    for step_name, step in _items(document.get("steps")):
+        if not isinstance(step, dict):
+            continue
+
+        step_inputs = {}
+        for input_name, step_input in _items(step.get("in")):
+            sources = step_input.get("source") if isinstance(step_input, dict) else step_input
+            step_inputs[input_name] = _as_list(sources)
+
+        summary["steps"][step_name] = {
+            "run": step.get("run") if isinstance(step.get("run"), str) else None,
+            "in": step_inputs,
+            "out": [ out if isinstance(out, str) else out.get("id") for out in _as_list(step.get("out")) if isinstance(out, (str, dict)) ],
+        }
+
+    return summary
+
+def _descriptor_summary(document):
+
+    process_description = document.get("processDescription")
+    process = process_description.get("process") if isinstance(process_description, dict) else None
+
+    if not isinstance(process, dict):
+        process = {}
+
+    execution_units = document.get("executionUnit")
+
+    return {
+        "inputs": _ids(process.get("inputs")),
+        "outputs": _ids(process.get("outputs")),
+        "docker_urls": [ unit["href"][len("docker://"):] for unit in _as_list(execution_units)
+                         if isinstance(unit, dict) and isinstance(unit.get("href"), str) and unit["href"].startswith("docker://") ],
+    }
+
+def check_file(basename, contents):
+    """
+    Check the contents of one generated file against its schema. Returns the issues found and a
+    summary of the parts that other files refer to, or None if the file could not be parsed.
+    """
+    import yaml
+
+    try:
+        document = _load_document(basename, contents)
+    except ValueError as err:
+        return [ _issue("error", f"Invalid JSON: {err}") ], None
+    except yaml.YAMLError as err:
+        return [ _issue("error", f"Invalid YAML: {err}") ], None
+
+    if not isinstance(document, dict):
+        return [ _issue("error", "Document is not a mapping") ], None
+
+    # Dockstore only reads the entry point from its CWL file
+    if basename == DOCKSTORE_CWL:
+        steps = document.get("steps") if isinstance(document.get("steps"), dict) else document
+        step = steps.get("step") if isinstance(steps.get("step"), dict) else {}
+
+        if not isinstance(step.get("run"), str):
+            return [ _issue("error", "No entry point CWL file given by step run", "/steps/step") ], None
+
+        return [], { "class": "Dockstore", "run": step["run"] }
+
+    if basename.endswith(".json"):
+        return _schema_issues(DESCRIPTOR_SCHEMA, document), { "class": "Descriptor", **_descriptor_summary(document) }
+
+    return _schema_issues(CWL_SCHEMA, document), _cwl_summary(document)
+
+def _package_file(directory, reference):
+    "Path relative to the output of a file referenced from a file of an application directory, or None if it is not local"
+
+    if "://" in reference or reference.startswith("#"):
+        return None
+
+    return os.path.normpath(os.path.join(directory, reference.split("#")[0]))
+
+def check_package(directory, summaries):
+    """
+    Check the references between the files of one application directory. summaries are the file
+    summaries by path relative to the output. Returns the issues found by file path.
+    """
+
+    issues = {}
+    add_issue = lambda relpath, *args: issues.setdefault(relpath, []).append(_issue(*args))
+
+    for relpath, summary in summaries.items():
+        if summary["class"] == "Dockstore":
+            run_relpath = _package_file(directory, summary["run"])
+            if run_relpath is not None and run_relpath not in summaries:
+                add_issue(relpath, "error", f"Entry point {summary['run']} is not a generated file", "/steps/step/run")
+
+        elif summary["class"] == "Descriptor":
+            if len(set(summary["inputs"])) != len(summary["inputs"]):
+                add_issue(relpath, "error", "Process inputs have duplicate ids", "/processDescription/process/inputs")
+
+            docker_pulls = [ s.get("docker_pull") for s in summaries.values() if s["class"] == "CommandLineTool" ]
+            for docker_url in summary["docker_urls"]:
+                if docker_url not in docker_pulls:
+                    add_issue(relpath, "warning", f"Execution unit image {docker_url} is not pulled by any CommandLineTool of the package", "/executionUnit")
+
+        elif summary["class"] == "Workflow":
+            for step_name, step in summary["steps"].items():
+                step_path = f"/steps/{step_name}"
+                run_summary = None
+
+                if step["run"] is not None and (run_relpath := _package_file(directory, step["run"])) is not None:
+                    if run_relpath not in summaries:
+                        add_issue(relpath, "error", f"Step runs {step['run']} which is not a generated file", f"{step_path}/run")
+                    else:
+                        run_summary = summaries[run_relpath]
+
+                if run_summary is not None and run_summary["class"] in ("CommandLineTool", "Workflow", "ExpressionTool"):
+                    for out_name in step["out"]:
+                        if out_name not in run_summary["outputs"]:
+                            add_issue(relpath, "error", f"Step output {out_name} is not an output of {step['run']}", f"{step_path}/out")
+
+                    # Extra step inputs are ignored by CWL runners, only worth a warning
+                    for input_name in step["in"]:
+                        if input_name not in run_summary["inputs"]:
+                            add_issue(relpath, "warning", f"Step input {input_name} is not an input of {step['run']}", f"{step_path}/in/{input_name}")
+
+                for input_name, sources in step["in"].items():
+                    for source in sources:
+                        if (message := _source_error(source, summary)) is not None:
+                            add_issue(relpath, "error", message, f"{step_path}/in/{input_name}")
+
+            for source in summary["output_sources"]:
+                if (message := _source_error(source, summary)) is not None:
+                    add_issue(relpath, "error", message, "/outputs")
+
+    return issues
+
+def _source_error(source, workflow_summary):
+    "Error message if a workflow source does not name a workflow input or a step output"
+
+    source = str(source).lstrip("#")
+
+    if "/" not in source:
+        if source not in workflow_summary["inputs"]:
+            return f"Source {source} is not a workflow input"
+        return None
+
+    step_name, _, out_name = source.rpartition("/")
+
+    if step_name not in workflow_summary["steps"]:
+        return f"Source {source} refers to unknown step {step_name}"
+
+    if out_name not in workflow_summary["steps"][step_name]["out"]:
+        return f"Source {source} is not an output of step {step_name}"
+
+    return None
+
+def format_issues(issues):
+
+    return "\n".join([ f"    {issue['file']}{issue['path']}: {issue['severity']}: {issue['message']}" for issue in issues ])
+
+class PackageValidator(object):
+    """
+    Checks generated application package files locally against the CWL and OGC application package
+    schemas, and the references between the files of each application directory. The result of
+    checking a file is memoized in the user cache by the digest of its contents, so files that are
+    unchanged or identical to files of other applications, such as the data staging CWL files, are
+    only parsed and checked once.
+    """
+
+    def __init__(self, cache_directory=None):
+
+        self.cache = JSONCache(VALIDATION_CACHE_NAME, cache_directory=cache_directory)
+
+    def _cache_key(self, relpath, file_digest):
+
+        # Dockstore.cwl is checked differently than other files with the same contents
+        kind = DOCKSTORE_CWL if os.path.basename(relpath) == DOCKSTORE_CWL else os.path.splitext(relpath)[1]
+
+        return f"{checks_fingerprint()}|{kind}|{file_digest}"
+
+    def validate(self, file_hashes, read_contents):
+        """
+        Check the files whose digests by path relative to the output are in file_hashes. read_contents
+        returns the contents of a list of those paths. Returns the issues found and the number of files
+        whose results were memoized.
+        """
+
+        cache_keys = { relpath: self._cache_key(relpath, file_digest) for relpath, file_digest in file_hashes.items() }
+
+        file_results = self.cache.get_many(list(set(cache_keys.values())))
+        num_memoized = len([ relpath for relpath, cache_key in cache_keys.items() if cache_key in file_results ])
+
+        # Only one of the files with the same contents is read
+        unchecked_relpaths = {}
+        for relpath, cache_key in sorted(cache_keys.items()):
+            if cache_key not in file_results:
+                unchecked_relpaths.setdefault(cache_key, relpath)
+
+        new_results = {}
+        for relpath, contents in read_contents(list(unchecked_relpaths.values())).items():
+            file_issues, summary = check_file(os.path.basename(relpath), contents)
+            new_results[cache_keys[relpath]] = { "issues": file_issues, "summary": summary }
+
+        if len(new_results) > 0:
+            self.cache.update(new_results)
+            file_results.update(new_results)
+
+        issues = {}
+        summaries_by_directory = {}
+        for relpath, cache_key in cache_keys.items():
+            issues[relpath] = list(file_results[cache_key]["issues"])
+
+            if (summary := file_results[cache_key]["summary"]) is not None:
+                summaries_by_directory.setdefault(os.path.dirname(relpath), {})[relpath] = summary
+
+        for directory, summaries in summaries_by_directory.items():
+            for relpath, package_issues in check_package(directory, summaries).items():
+                issues[relpath] += package_issues
+
+        all_issues = [ { "file": relpath, **issue } for relpath in sorted(issues.keys()) for issue in issues[relpath] ]
+
+        return all_issues, num_memoized